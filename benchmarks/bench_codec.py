@@ -0,0 +1,66 @@
+"""
+Benchmark dos codecs de mensagem: custo de codificar/decodificar e bytes.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_codec --repeticoes 20000
+
+Mede, para cada evento trocado pelos serviços (pedido do caixa, pedido com
+várias linhas, atualização de status da cozinha e aviso de erro do
+estoque), o tamanho do corpo da mensagem e o tempo médio de codificação e
+decodificação em cada codec disponível (msgpack só aparece se o pacote
+estiver instalado).
+"""
+import argparse
+import time
+
+from comum.codec import CODECS
+
+EVENTOS = {
+    'pedido': {
+        'id': 1042, 'cliente': 'Maria', 'item': 'X-Salada',
+        'observacao': None
+    },
+    'pedido com itens': {
+        'id': 1043, 'cliente': 'João', 'item': '2x X-Bacon, 1x Coca-Cola',
+        'itens': [{'item': 'X-Bacon', 'quantidade': 2},
+                  {'item': 'Coca-Cola', 'quantidade': 1}],
+        'observacao': 'sem cebola'
+    },
+    'status': {
+        'pedido_caixa_id': 1042, 'cliente': 'Maria', 'item': 'X-Salada',
+        'status': 'PRONTO'
+    },
+    'erro estoque': {
+        'pedido_caixa_id': 1044, 'status': 'ERRO_ESTOQUE',
+        'erro': 'Estoque insuficiente: Pão (precisa 2, tem 1)'
+    },
+}
+
+
+def medir(funcao, argumento, repeticoes):
+    """Tempo médio de uma chamada, em microssegundos."""
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao(argumento)
+    return (time.perf_counter() - inicio) / repeticoes * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeticoes', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'evento':18} {'codec':9} {'bytes':>6} "
+          f"{'codificar':>11} {'decodificar':>12}")
+    for nome, evento in EVENTOS.items():
+        for codec in CODECS:
+            body = codec.codificar(evento)
+            assert codec.decodificar(body) == evento
+            codificar = medir(codec.codificar, evento, args.repeticoes)
+            decodificar = medir(codec.decodificar, body, args.repeticoes)
+            print(f"{nome:18} {codec.nome:9} {len(body):6} "
+                  f"{codificar:9.2f}µs {decodificar:10.2f}µs")
+
+
+if __name__ == '__main__':
+    main()
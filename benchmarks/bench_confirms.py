@@ -0,0 +1,102 @@
+"""
+Benchmark de publicação: sem confirmação x confirm síncrono x confirm em pipeline.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_confirms --mensagens 5000
+
+Compara, em uma única thread publicando:
+  - fire-and-forget: Publicador sem confirms (mensagens podem se perder);
+  - confirm síncrono: Publicador(confirmar=True), um round-trip por mensagem;
+  - confirm em pipeline: PublicadorAssincrono, várias mensagens em voo e
+    confirms associados pelo delivery tag.
+
+Por padrão roda contra o broker falso em processo (ver broker_falso.py).
+Com --host, publica em um RabbitMQ real.
+"""
+import argparse
+import time
+
+from comum.mensageria import Publicador, PublicadorAssincrono
+
+from benchmarks.broker_falso import BrokerFalso
+
+EXCHANGE = 'benchmark_confirms'
+
+
+def mensagem(n):
+    return {
+        'id': n,
+        'cliente': 'Benchmark',
+        'item': 'X-Salada',
+        'observacao': None
+    }
+
+
+def medir_sincrono(publicador, total):
+    """Publica `total` mensagens, uma de cada vez, e retorna mensagens/s."""
+    publicador.publicar(mensagem(-1))  # abre a conexão fora da medição
+    inicio = time.perf_counter()
+    for n in range(total):
+        publicador.publicar(mensagem(n))
+    return total / (time.perf_counter() - inicio)
+
+
+def medir_pipeline(publicador, total):
+    """Publica `total` mensagens e espera todos os confirms."""
+    publicador.publicar(mensagem(-1)).result()
+    inicio = time.perf_counter()
+    futuros = [publicador.publicar(mensagem(n)) for n in range(total)]
+    for futuro in futuros:
+        futuro.result()
+    return total / (time.perf_counter() - inicio)
+
+
+def executar(args):
+    resultados = {}
+
+    publicador = Publicador(EXCHANGE, host=args.host, tamanho_pool=1)
+    resultados['fire-and-forget'] = medir_sincrono(publicador, args.mensagens)
+    publicador.fechar()
+
+    publicador = Publicador(EXCHANGE, host=args.host, tamanho_pool=1,
+                            confirmar=True)
+    resultados['confirm síncrono'] = medir_sincrono(
+        publicador, args.mensagens)
+    publicador.fechar()
+
+    publicador = PublicadorAssincrono(
+        EXCHANGE, host=args.host, limite_em_voo=args.em_voo)
+    resultados['confirm em pipeline'] = medir_pipeline(
+        publicador, args.mensagens)
+    publicador.fechar()
+
+    print(f"Mensagens: {args.mensagens} | Em voo (pipeline): {args.em_voo}")
+    for nome, taxa in resultados.items():
+        print(f"{nome:20}: {taxa:10.1f} mensagens/s")
+    print(f"Pipeline x síncrono : "
+          f"{resultados['confirm em pipeline'] / resultados['confirm síncrono']:10.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mensagens', type=int, default=5000)
+    parser.add_argument('--em-voo', type=int, default=1000,
+                        help='Limite de mensagens sem confirmação')
+    parser.add_argument('--host', default=None,
+                        help='RabbitMQ real (padrão: broker falso)')
+    parser.add_argument('--rtt-ms', type=float, default=0.5,
+                        help='Round-trip do broker falso')
+    args = parser.parse_args()
+
+    if args.host:
+        executar(args)
+        return
+
+    args.host = 'localhost'
+    broker = BrokerFalso(latencia_rtt=args.rtt_ms / 1000)
+    with broker.instalado():
+        executar(args)
+
+
+if __name__ == '__main__':
+    main()
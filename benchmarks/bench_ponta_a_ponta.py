@@ -0,0 +1,549 @@
+"""
+Benchmark ponta a ponta: caixa -> RabbitMQ -> cozinha/estoque -> caixa.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_ponta_a_ponta --taxa 50 --duracao 10
+    python -m benchmarks.bench_ponta_a_ponta --taxa 100 --cozinheiros 8 \\
+        --preparo 0.05 --json resultados/atual.json
+    python -m benchmarks.bench_ponta_a_ponta --comparar resultados/base.json
+
+Sobe, num diretório temporário (bancos novos), a API do caixa num servidor
+WSGI com threads, o relay do outbox e os consumers do caixa, da cozinha e
+do estoque (RuntimeConsumidores), todos no mesmo processo e com o broker
+falso de benchmarks.broker_falso (ou o RabbitMQ em 'rabbitmq', com
+--rabbitmq). Os chapeiros são simulados: `--cozinheiros` threads pegam os
+tickets na ordem de chegada, iniciam o preparo, esperam `--preparo`
+segundos e finalizam, publicando PREPARANDO e PRONTO como a API da
+cozinha.
+
+A carga é de malha aberta: pedidos (POST /pedidos, item sorteado do
+cardápio) agendados a `--taxa` por segundo durante `--duracao` segundos,
+enviados por `--conexoes` conexões keep-alive. As latências contam a
+partir do instante agendado, então uma API lenta aparece como latência
+em vez de reduzir a carga. Cada pedido tem os instantes das etapas:
+
+    envio       -> gravado     caixa_http (POST até o commit no caixa)
+    gravado     -> cozinha     outbox_ate_cozinha (relay + broker + ticket)
+    gravado     -> estoque     outbox_ate_estoque (relay + broker + baixa)
+    cozinha     -> inicio      fila_cozinha (espera por um chapeiro)
+    inicio      -> finalizado  preparo
+    finalizado  -> pronto      retorno_caixa (publicação + status no caixa)
+    envio       -> pronto      ponta_a_ponta
+
+Com --json o resultado (métricas, parâmetros, commit) é gravado com as
+chaves ordenadas, para guardar por versão e comparar com --comparar. Os
+consumers usam as mesmas variáveis de ambiente dos serviços (ex.
+COZINHA_WORKERS, ESTOQUE_TAMANHO_LOTE, CODEC_MENSAGENS).
+"""
+import argparse
+import contextlib
+import http.client
+import importlib
+import json
+import logging
+import os
+import platform
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.broker_falso import BrokerFalso
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos de serviço com o mesmo nome nos três diretórios
+MODULOS_SERVICO = ('database', 'app', 'api', 'outbox', 'consumidor')
+
+# (nome, marco inicial, marco final)
+ETAPAS = (
+    ('caixa_http', 'envio', 'gravado'),
+    ('outbox_ate_cozinha', 'gravado', 'cozinha'),
+    ('outbox_ate_estoque', 'gravado', 'estoque'),
+    ('fila_cozinha', 'cozinha', 'inicio'),
+    ('preparo', 'inicio', 'finalizado'),
+    ('retorno_caixa', 'finalizado', 'pronto'),
+)
+
+FORMATO_RESULTADO = 1
+
+
+class Marcos:
+    """Instantes (perf_counter) de cada etapa, por id de pedido do caixa."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pedidos = {}
+
+    def marcar(self, pedido_id, etapa, instante=None):
+        instante = time.perf_counter() if instante is None else instante
+        with self._lock:
+            self.pedidos.setdefault(pedido_id, {}).setdefault(etapa, instante)
+
+    def pendentes(self, ids):
+        with self._lock:
+            return [pedido_id for pedido_id in ids
+                    if not {'pronto', 'estoque'} <= self.pedidos[pedido_id]
+                    .keys()]
+
+
+def carregar_servico(servico, modulos):
+    """
+    Importa `modulos` do diretório do serviço.
+
+    Os serviços têm módulos com o mesmo nome (database, app...): depois de
+    importados eles saem de sys.modules, para o próximo serviço carregar os
+    seus. Cada módulo continua usando as referências que importou.
+    """
+    diretorio = os.path.join(RAIZ, servico)
+    sys.path.insert(0, diretorio)
+    try:
+        return [importlib.import_module(modulo) for modulo in modulos]
+    finally:
+        sys.path.remove(diretorio)
+        for modulo in MODULOS_SERVICO:
+            sys.modules.pop(modulo, None)
+
+
+def instrumentar(modulo, nome, depois):
+    """Troca modulo.nome por uma versão que chama depois(args, resultado)."""
+    original = getattr(modulo, nome)
+
+    def instrumentada(*args, **kwargs):
+        resultado = original(*args, **kwargs)
+        depois(args, resultado)
+        return resultado
+
+    setattr(modulo, nome, instrumentada)
+
+
+def instrumentar_baixas(db_estoque, marcos):
+    """Marca 'estoque' também quando a baixa falha (ERRO_ESTOQUE)."""
+    pedido_unico = db_estoque.dar_baixa_pedido
+    lote = db_estoque.dar_baixa_lote
+
+    def dar_baixa_pedido(itens, pedido_id=None, chave=None):
+        try:
+            return pedido_unico(itens, pedido_id, chave)
+        finally:
+            marcos.marcar(pedido_id, 'estoque')
+
+    def dar_baixa_lote(pedidos):
+        resultados = lote(pedidos)
+        for _, pedido_id, _ in pedidos:
+            marcos.marcar(pedido_id, 'estoque')
+        return resultados
+
+    db_estoque.dar_baixa_pedido = dar_baixa_pedido
+    db_estoque.dar_baixa_lote = dar_baixa_lote
+
+
+class Cozinheiros:
+    """Chapeiros simulados: preparam os tickets na ordem de chegada."""
+
+    def __init__(self, app_cozinha, db_cozinha, marcos, quantidade, preparo):
+        self.app = app_cozinha
+        self.db = db_cozinha
+        self.marcos = marcos
+        self.preparo = preparo
+        self.tickets = queue.Queue()
+        self.falhas = 0
+        self.threads = [threading.Thread(target=self._trabalhar, daemon=True)
+                        for _ in range(quantidade)]
+        for thread in self.threads:
+            thread.start()
+
+    def _trabalhar(self):
+        while True:
+            ticket = self.tickets.get()
+            if ticket is None:
+                return
+            cozinha_id, pedido_id, cliente, item = ticket
+            try:
+                self.marcos.marcar(pedido_id, 'inicio')
+                self.db.iniciar_preparo(cozinha_id)
+                self.app.publicar_pedido_preparando(pedido_id, cliente, item)
+                if self.preparo:
+                    time.sleep(self.preparo)
+                self.db.finalizar_pedido_automatico(cozinha_id)
+                self.marcos.marcar(pedido_id, 'finalizado')
+                self.app.publicar_pedido_pronto(pedido_id, cliente, item)
+            except Exception as e:
+                self.falhas += 1
+                print(f"[BENCH] Falha ao preparar o pedido #{pedido_id}: {e}")
+
+    def parar(self):
+        for _ in self.threads:
+            self.tickets.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class Sistema:
+    """Caixa, relay, consumers e chapeiros rodando no mesmo processo."""
+
+    def __init__(self, args, marcos):
+        self.args = args
+        self.marcos = marcos
+        self.threads = []
+
+        db_caixa, app_caixa, consumidor_caixa = carregar_servico(
+            'caixa', ('database', 'app', 'consumidor'))
+        db_cozinha, app_cozinha = carregar_servico(
+            'cozinha', ('database', 'app'))
+        db_estoque, app_estoque = carregar_servico(
+            'estoque', ('database', 'app'))
+
+        # Estoque que não acaba durante a carga
+        for ingrediente in db_estoque.listar_estoque():
+            db_estoque.adicionar_estoque(ingrediente['nome'], 10 ** 7,
+                                         'Benchmark')
+
+        self.cozinheiros = Cozinheiros(app_cozinha, db_cozinha, marcos,
+                                       args.cozinheiros, args.preparo)
+
+        instrumentar(db_caixa, 'inserir_pedido',
+                     lambda args, pedido: marcos.marcar(pedido['id'],
+                                                        'gravado'))
+        instrumentar(db_caixa, 'atualizar_status_pedido',
+                     self._status_caixa)
+        instrumentar(db_cozinha, 'registrar_pedido', self._ticket_recebido)
+        instrumentar_baixas(db_estoque, marcos)
+
+        self.relay = app_caixa.relay_outbox
+        self.publicadores = [self.relay.publicador,
+                             app_cozinha.publicador_status,
+                             app_estoque.publicador_avisos]
+        self.runtimes = [consumidor_caixa.runtime_consumidor(),
+                         app_cozinha.runtime_consumidor(),
+                         app_estoque.runtime_consumidor()]
+        self.app_caixa = app_caixa.app
+
+    def _status_caixa(self, args, resultado):
+        pedido_id, status = args[0], args[1]
+        if status in ('PRONTO', 'ERRO_ESTOQUE'):
+            self.marcos.marcar(pedido_id, status.lower())
+            if status == 'ERRO_ESTOQUE':
+                self.marcos.marcar(pedido_id, 'estoque')
+
+    def _ticket_recebido(self, args, cozinha_id):
+        pedido_id, cliente, item = args[:3]
+        self.marcos.marcar(pedido_id, 'cozinha')
+        self.cozinheiros.tickets.put((cozinha_id, pedido_id, cliente, item))
+
+    def _thread(self, alvo):
+        thread = threading.Thread(target=alvo, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def iniciar(self):
+        """Sobe tudo e retorna a porta da API do caixa."""
+        from werkzeug.serving import make_server
+
+        for runtime in self.runtimes:
+            self._thread(runtime.executar)
+        for runtime in self.runtimes:
+            if not runtime.consumindo.wait(30):
+                raise RuntimeError(f'{runtime.nome} não conectou ao broker')
+        self.relay.iniciar()
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.servidor = make_server('127.0.0.1', 0, self.app_caixa,
+                                    threaded=True)
+        self._thread(self.servidor.serve_forever)
+        return self.servidor.server_port
+
+    def parar(self):
+        self.servidor.shutdown()
+        self.relay.parar(10)
+        for runtime in self.runtimes:
+            runtime.parar()
+        self.cozinheiros.parar()
+        for thread in self.threads:
+            thread.join(30)
+        for publicador in self.publicadores:
+            publicador.fechar()
+
+
+def gerar_carga(porta, itens, args, marcos):
+    """
+    Envia os pedidos no ritmo de --taxa; retorna a lista de
+    (pedido_id, latência) com None nos pedidos recusados.
+    """
+    local = threading.local()
+    sorteio = random.Random(args.semente)
+    total = max(1, round(args.taxa * args.duracao))
+    corpos = [json.dumps({'cliente': f'Carga {i}',
+                          'item': sorteio.choice(itens)})
+              for i in range(total)]
+
+    def enviar(corpo, agendado):
+        conexao = getattr(local, 'conexao', None)
+        if conexao is None:
+            conexao = local.conexao = http.client.HTTPConnection(
+                '127.0.0.1', porta, timeout=30)
+        try:
+            conexao.request('POST', '/pedidos', body=corpo,
+                            headers={'Content-Type': 'application/json'})
+            resposta = conexao.getresponse()
+            dados = resposta.read()
+        except (OSError, http.client.HTTPException):
+            conexao.close()
+            local.conexao = None
+            return None, None
+        latencia = time.perf_counter() - agendado
+        if resposta.status != 201:
+            return None, None
+        pedido_id = json.loads(dados)['pedido']['id']
+        marcos.marcar(pedido_id, 'envio', agendado)
+        return pedido_id, latencia
+
+    with ThreadPoolExecutor(args.conexoes) as pool:
+        inicio = time.perf_counter()
+        futuros = []
+        for i, corpo in enumerate(corpos):
+            agendado = inicio + i / args.taxa
+            espera = agendado - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+            futuros.append(pool.submit(enviar, corpo, agendado))
+        return [futuro.result() for futuro in futuros]
+
+
+def aguardar_conclusao(ids, marcos, timeout):
+    """Espera PRONTO e a baixa no estoque de todos os pedidos aceitos."""
+    limite = time.monotonic() + timeout
+    pendentes = list(ids)
+    while pendentes and time.monotonic() < limite:
+        time.sleep(0.05)
+        pendentes = marcos.pendentes(pendentes)
+    return pendentes
+
+
+def cardapio(porta):
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=10)
+    conexao.request('GET', '/cardapio')
+    dados = json.loads(conexao.getresponse().read())
+    conexao.close()
+    return [item['nome'] for item in dados['cardapio']]
+
+
+def resumo(valores):
+    """Percentis em milissegundos de uma lista de durações em segundos."""
+    if not valores:
+        return {'n': 0}
+    valores = sorted(valores)
+    n = len(valores)
+
+    def percentil(q):
+        return round(valores[min(n - 1, int(n * q))] * 1000, 3)
+
+    return {
+        'n': n,
+        'media': round(sum(valores) / n * 1000, 3),
+        'p50': percentil(0.50),
+        'p90': percentil(0.90),
+        'p99': percentil(0.99),
+        'max': round(valores[-1] * 1000, 3),
+    }
+
+
+def versao_codigo():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def executar(args):
+    marcos = Marcos()
+    broker = None if args.rabbitmq else BrokerFalso(
+        latencia_rtt=args.rtt_ms / 1000)
+    diretorio = tempfile.mkdtemp(prefix='bench_ponta_a_ponta_')
+    anterior = os.getcwd()
+    os.chdir(diretorio)
+    try:
+        with contextlib.ExitStack() as pilha:
+            if not args.verboso:
+                saida = pilha.enter_context(open(os.devnull, 'w'))
+                pilha.enter_context(contextlib.redirect_stdout(saida))
+            if broker is not None:
+                pilha.enter_context(broker.instalado())
+
+            sistema = Sistema(args, marcos)
+            porta = sistema.iniciar()
+            try:
+                itens = cardapio(porta)
+                inicio = time.perf_counter()
+                respostas = gerar_carga(porta, itens, args, marcos)
+                aceitos = [p for p, _ in respostas if p is not None]
+                pendentes = aguardar_conclusao(aceitos, marcos, args.timeout)
+                fim = time.perf_counter()
+            finally:
+                sistema.parar()
+    finally:
+        os.chdir(anterior)
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    return montar_resultado(args, marcos, respostas, aceitos, pendentes,
+                            inicio, fim, sistema.cozinheiros.falhas, broker)
+
+
+def montar_resultado(args, marcos, respostas, aceitos, pendentes, inicio,
+                     fim, falhas_preparo, broker):
+    pendentes = set(pendentes)
+    concluidos = [marcos.pedidos[p] for p in aceitos if p not in pendentes]
+    prontos = [m for m in concluidos if 'pronto' in m]
+
+    etapas = {nome: resumo([m[b] - m[a] for m in concluidos
+                            if a in m and b in m])
+              for nome, a, b in ETAPAS}
+    ultimo = max((m['pronto'] for m in prontos), default=fim)
+
+    resultado = {
+        'formato': FORMATO_RESULTADO,
+        'execucao': {
+            'commit': versao_codigo(),
+            'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'broker': 'rabbitmq' if broker is None else 'falso',
+            'parametros': {
+                'taxa': args.taxa, 'duracao': args.duracao,
+                'conexoes': args.conexoes, 'cozinheiros': args.cozinheiros,
+                'preparo': args.preparo, 'semente': args.semente,
+                'rtt_ms': None if broker is None else args.rtt_ms,
+            },
+        },
+        'pedidos': {
+            'enviados': len(respostas),
+            'aceitos': len(aceitos),
+            'recusados': len(respostas) - len(aceitos),
+            'prontos': len(prontos),
+            'erro_estoque': sum('erro_estoque' in m for m in concluidos),
+            'nao_concluidos': len(pendentes),
+            'falhas_preparo': falhas_preparo,
+        },
+        'vazao': {
+            'pedidos_por_segundo': round(len(prontos) / (ultimo - inicio), 2)
+            if prontos else 0.0,
+            'duracao_total_s': round(fim - inicio, 3),
+        },
+        'latencia_ms': {
+            'resposta_http': resumo([l for _, l in respostas
+                                     if l is not None]),
+            'ponta_a_ponta': resumo([m['pronto'] - m['envio']
+                                     for m in prontos]),
+        },
+        'etapas_ms': etapas,
+    }
+    if broker is not None:
+        estatisticas = broker.estatisticas
+        resultado['broker'] = {
+            campo: getattr(estatisticas, campo)
+            for campo in ('conexoes', 'declaracoes', 'publicacoes',
+                          'entregas', 'rejeicoes')
+        }
+    return resultado
+
+
+def exibir(resultado):
+    pedidos = resultado['pedidos']
+    parametros = resultado['execucao']['parametros']
+    print(f"{parametros['taxa']:g} pedidos/s por {parametros['duracao']:g}s | "
+          f"{parametros['cozinheiros']} chapeiro(s), preparo "
+          f"{parametros['preparo']:g}s | broker "
+          f"{resultado['execucao']['broker']} | "
+          f"{resultado['execucao']['cpus']} CPU(s)")
+    print(f"aceitos {pedidos['aceitos']}/{pedidos['enviados']} | prontos "
+          f"{pedidos['prontos']} | erro de estoque {pedidos['erro_estoque']} "
+          f"| não concluídos {pedidos['nao_concluidos']} | vazão "
+          f"{resultado['vazao']['pedidos_por_segundo']:.1f} pedidos/s")
+    print(f"{'ms':20} {'n':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    linhas = {**resultado['latencia_ms'], **resultado['etapas_ms']}
+    for nome, valores in linhas.items():
+        if not valores['n']:
+            continue
+        print(f"{nome:20} {valores['n']:6} {valores['p50']:9.2f} "
+              f"{valores['p90']:9.2f} {valores['p99']:9.2f} "
+              f"{valores['max']:9.2f}")
+
+
+def comparar(base, atual):
+    """Diferença percentual de vazão e de p50/p99 em relação a `base`."""
+    print(f"\ncomparação com {base['execucao']['commit']} "
+          f"({base['execucao']['data']})")
+    if base['execucao']['parametros'] != atual['execucao']['parametros']:
+        print("atenção: parâmetros diferentes da execução base")
+    print(f"{'':26} {'base':>10} {'atual':>10} {'dif':>8}")
+
+    def linha(nome, antes, depois):
+        if antes is None or depois is None:
+            return
+        diferenca = (f"{(depois - antes) / antes * 100:+7.1f}%" if antes
+                     else '       -')
+        print(f"{nome:26} {antes:10.2f} {depois:10.2f} {diferenca}")
+
+    linha('pedidos/s', base['vazao']['pedidos_por_segundo'],
+          atual['vazao']['pedidos_por_segundo'])
+    for grupo in ('latencia_ms', 'etapas_ms'):
+        for nome, valores in atual[grupo].items():
+            anteriores = base.get(grupo, {}).get(nome, {})
+            for percentil in ('p50', 'p99'):
+                linha(f"{nome} {percentil}", anteriores.get(percentil),
+                      valores.get(percentil))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--taxa', type=float, default=50,
+                        help='Pedidos por segundo')
+    parser.add_argument('--duracao', type=float, default=10.0)
+    parser.add_argument('--conexoes', type=int, default=16,
+                        help='Conexões HTTP keep-alive simultâneas')
+    parser.add_argument('--cozinheiros', type=int, default=4)
+    parser.add_argument('--preparo', type=float, default=0.0,
+                        help='Segundos de preparo de cada pedido')
+    parser.add_argument('--semente', type=int, default=1,
+                        help='Semente do sorteio dos itens')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Espera máxima pelos pedidos após a carga')
+    parser.add_argument('--rtt-ms', type=float, default=0.5,
+                        help='Round-trip do broker falso')
+    parser.add_argument('--rabbitmq', action='store_true',
+                        help="Usar o RabbitMQ em 'rabbitmq' em vez do falso")
+    parser.add_argument('--json', metavar='ARQUIVO',
+                        help="Gravar o resultado em JSON ('-' para stdout)")
+    parser.add_argument('--comparar', metavar='ARQUIVO',
+                        help='Resultado JSON anterior para comparar')
+    parser.add_argument('--verboso', action='store_true',
+                        help='Mostrar os logs dos serviços')
+    args = parser.parse_args()
+
+    resultado = executar(args)
+    texto = json.dumps(resultado, indent=2, sort_keys=True,
+                       ensure_ascii=False)
+
+    if args.json == '-':
+        print(texto)
+        return
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto + '\n')
+
+    exibir(resultado)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            comparar(json.load(arquivo), resultado)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark de publicação de pedidos: conexão por mensagem x Publicador.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_publicador --pedidos 2000 --threads 8
+
+Por padrão roda contra o broker falso em processo (ver broker_falso.py).
+Com --host, publica em um RabbitMQ real.
+"""
+import argparse
+import json
+import threading
+import time
+
+import pika
+from comum.mensageria import Publicador
+
+from benchmarks.broker_falso import BrokerFalso
+
+
+def enviar_conexao_por_pedido(pedido, host):
+    """Implementação anterior de caixa.app.enviar_para_fila."""
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host))
+    channel = connection.channel()
+    channel.exchange_declare(
+        exchange='pedidos_exchange', exchange_type='fanout')
+    channel.basic_publish(
+        exchange='pedidos_exchange',
+        routing_key='',
+        body=json.dumps(pedido)
+    )
+    connection.close()
+
+
+def medir(enviar, total, threads):
+    """Dispara `total` pedidos em `threads` threads e retorna pedidos/s."""
+    por_thread = total // threads
+
+    def trabalhador(indice):
+        for n in range(por_thread):
+            enviar({
+                'id': indice * por_thread + n,
+                'cliente': 'Benchmark',
+                'item': 'X-Salada',
+                'observacao': None
+            })
+
+    workers = [threading.Thread(target=trabalhador, args=(i,))
+               for i in range(threads)]
+    inicio = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return por_thread * threads / (time.perf_counter() - inicio)
+
+
+def executar(args):
+    publicador = Publicador(
+        'pedidos_exchange', host=args.host, tamanho_pool=args.threads)
+
+    antes = medir(lambda p: enviar_conexao_por_pedido(p, args.host),
+                  args.pedidos, args.threads)
+    depois = medir(publicador.publicar, args.pedidos, args.threads)
+    publicador.fechar()
+
+    print(f"Pedidos: {args.pedidos} | Threads: {args.threads}")
+    print(f"Conexão por pedido : {antes:10.1f} pedidos/s")
+    print(f"Publicador (pool)  : {depois:10.1f} pedidos/s")
+    print(f"Ganho              : {depois / antes:10.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pedidos', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--host', default=None,
+                        help='RabbitMQ real (padrão: broker falso)')
+    parser.add_argument('--handshake-ms', type=float, default=5.0,
+                        help='Latência de conexão do broker falso')
+    parser.add_argument('--rtt-ms', type=float, default=0.5,
+                        help='Round-trip do broker falso')
+    args = parser.parse_args()
+
+    if args.host:
+        executar(args)
+        return
+
+    args.host = 'localhost'
+    broker = BrokerFalso(latencia_handshake=args.handshake_ms / 1000,
+                         latencia_rtt=args.rtt_ms / 1000)
+    with broker.instalado():
+        executar(args)
+    print(f"Conexões abertas no broker falso: "
+          f"{broker.estatisticas.conexoes}")
+
+
+if __name__ == '__main__':
+    main()
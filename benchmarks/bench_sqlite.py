@@ -0,0 +1,107 @@
+"""
+Benchmark de acesso ao SQLite: conexão por chamada x comum.banco.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_sqlite --operacoes 2000 --threads 4
+
+Cada operação é uma transação, como nas funções dos database.py: um
+INSERT em pedidos (escrita) ou um SELECT por id (leitura).
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from comum.banco import BancoSQLite
+
+CRIAR_TABELA = '''
+    CREATE TABLE IF NOT EXISTS pedidos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cliente VARCHAR(100) NOT NULL,
+        item VARCHAR(100) NOT NULL,
+        status VARCHAR(20) DEFAULT 'PENDENTE',
+        data_pedido TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def conexao_por_chamada(caminho):
+    """get_db_connection anterior: abre e fecha uma conexão por chamada."""
+    @contextmanager
+    def get_db_connection():
+        conn = sqlite3.connect(caminho)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    return get_db_connection
+
+
+def medir(get_db_connection, total, threads, escrita):
+    """Executa `total` transações em `threads` threads; retorna ops/s."""
+    por_thread = total // threads
+
+    def inserir(n):
+        with get_db_connection() as conn:
+            conn.execute(
+                'INSERT INTO pedidos (cliente, item) VALUES (?, ?)',
+                (f'cliente {n}', 'X-Salada'))
+
+    def buscar(n):
+        with get_db_connection() as conn:
+            conn.execute(
+                'SELECT * FROM pedidos WHERE id = ?', (n % 500 + 1,)
+            ).fetchone()
+
+    operacao = inserir if escrita else buscar
+
+    def trabalhador():
+        for n in range(por_thread):
+            operacao(n)
+
+    workers = [threading.Thread(target=trabalhador) for _ in range(threads)]
+    inicio = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return por_thread * threads / (time.perf_counter() - inicio)
+
+
+def executar(nome, fabrica, args, diretorio):
+    caminho = os.path.join(diretorio, f'{nome}.db')
+    get_db_connection = fabrica(caminho)
+
+    with get_db_connection() as conn:
+        conn.execute(CRIAR_TABELA)
+
+    inserts = medir(get_db_connection, args.operacoes, args.threads, True)
+    selects = medir(get_db_connection, args.operacoes, args.threads, False)
+    print(f"{nome:<20} {inserts:>12.1f} {selects:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--operacoes', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"Operações: {args.operacoes} | Threads: {args.threads}")
+    print(f"{'':<20} {'inserts/s':>12} {'selects/s':>12}")
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        executar('conexao_por_chamada', conexao_por_chamada, args, diretorio)
+        executar('comum.banco', lambda c: BancoSQLite(c).conexao, args,
+                 diretorio)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Teste de carga das APIs: servidor de desenvolvimento x Gunicorn com N workers.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_wsgi --servico caixa --workers 1 2 4
+    python -m benchmarks.bench_wsgi --servico cozinha --rota /fila
+    python -m benchmarks.bench_wsgi --servico caixa --metodo POST \\
+        --rota /pedidos/lote
+
+Para cada configuração, sobe a API do serviço em um diretório temporário
+(banco novo, pacote comum/ ligado por symlink), dispara requisições de
+`--clientes` conexões keep-alive distribuídas em processos durante
+`--duracao` segundos e mede requisições/s e latência (p50/p99). A primeira
+linha é o servidor de desenvolvimento do Flask (app.run, threaded); as
+demais, o Gunicorn com comum/gunicorn_conf.py e WEB_WORKERS = N.
+
+O ganho com mais workers depende dos núcleos livres: cliente e servidor
+dividem a mesma máquina, então use no máximo (núcleos - 1) workers.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICOS = {
+    'caixa': ('caixa', 'app', '/cardapio'),
+    'cozinha': ('cozinha', 'api', '/fila'),
+    'estoque': ('estoque', 'api', '/estoque'),
+}
+
+CORPO_POST = json.dumps({
+    'cliente': 'Carga',
+    'itens': [{'item': 'X-Salada', 'quantidade': 2},
+              {'item': 'Coca-Cola', 'quantidade': 1}]
+})
+
+
+def preparar_diretorio(servico):
+    """Cópia do serviço sem bancos, com comum/ ligado à raiz do projeto."""
+    diretorio = tempfile.mkdtemp(prefix=f'bench_wsgi_{servico}_')
+    origem = os.path.join(RAIZ, SERVICOS[servico][0])
+    shutil.copytree(origem, diretorio, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('*.db*', '__pycache__'))
+    os.symlink(os.path.join(RAIZ, 'comum'), os.path.join(diretorio, 'comum'))
+    return diretorio
+
+
+def porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def subir_servidor(servico, workers, threads):
+    """Inicia a API; workers=None usa o servidor de desenvolvimento."""
+    diretorio = preparar_diretorio(servico)
+    modulo = SERVICOS[servico][1]
+    porta = porta_livre()
+    ambiente = dict(os.environ, PYTHONPATH=RAIZ, WEB_PORTA=str(porta),
+                    WEB_WORKERS=str(workers or 1), WEB_THREADS=str(threads),
+                    WEB_ACCESSLOG='')
+
+    if workers is None:
+        comando = [sys.executable, '-c',
+                   f'from {modulo} import app; '
+                   f'app.run(port={porta}, threaded=True)']
+    else:
+        comando = [sys.executable, '-m', 'gunicorn', '-c',
+                   'comum/gunicorn_conf.py', f'{modulo}:app']
+
+    processo = subprocess.Popen(
+        comando, cwd=diretorio, env=ambiente,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite and processo.poll() is None:
+        try:
+            conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=1)
+            conexao.request('GET', '/health')
+            conexao.getresponse().read()
+            return processo, porta, diretorio
+        except OSError:
+            time.sleep(0.2)
+    parar_servidor(processo, diretorio)
+    raise RuntimeError(f'{servico} não respondeu em /health')
+
+
+def parar_servidor(processo, diretorio):
+    processo.terminate()
+    try:
+        processo.wait(15)
+    except subprocess.TimeoutExpired:
+        processo.kill()
+    shutil.rmtree(diretorio, ignore_errors=True)
+
+
+def _cliente(porta, metodo, rota, fim, latencias, erros):
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=10)
+    corpo = CORPO_POST if metodo == 'POST' else None
+    cabecalhos = {'Content-Type': 'application/json'} if corpo else {}
+    while time.monotonic() < fim:
+        inicio = time.perf_counter()
+        try:
+            conexao.request(metodo, rota, body=corpo, headers=cabecalhos)
+            resposta = conexao.getresponse()
+            resposta.read()
+            if resposta.status >= 400:
+                erros.append(resposta.status)
+                continue
+        except (OSError, http.client.HTTPException):
+            erros.append(0)
+            conexao.close()
+            conexao = http.client.HTTPConnection('127.0.0.1', porta,
+                                                 timeout=10)
+            continue
+        latencias.append(time.perf_counter() - inicio)
+
+
+def _processo_cliente(args):
+    porta, metodo, rota, conexoes, fim = args
+    latencias, erros = [], []
+    threads = [
+        threading.Thread(target=_cliente,
+                         args=(porta, metodo, rota, fim, latencias, erros))
+        for _ in range(conexoes)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencias, len(erros)
+
+
+def gerar_carga(porta, args):
+    """Dispara a carga e retorna (req/s, p50 ms, p99 ms, erros)."""
+    processos = max(1, min(args.processos_cliente, args.clientes))
+    fim = time.monotonic() + args.duracao
+    tarefas = [
+        (porta, args.metodo, args.rota,
+         args.clientes // processos + (i < args.clientes % processos), fim)
+        for i in range(processos)
+    ]
+    with multiprocessing.Pool(processos) as pool:
+        resultados = pool.map(_processo_cliente, tarefas)
+
+    latencias = sorted(l for parcial, _ in resultados for l in parcial)
+    erros = sum(e for _, e in resultados)
+    if not latencias:
+        return 0.0, 0.0, 0.0, erros
+    p50 = statistics.median(latencias) * 1000
+    p99 = latencias[min(len(latencias) - 1,
+                        int(len(latencias) * 0.99))] * 1000
+    return len(latencias) / args.duracao, p50, p99, erros
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--servico', choices=SERVICOS, default='caixa')
+    parser.add_argument('--rota', default=None,
+                        help='Padrão: /cardapio, /fila ou /estoque')
+    parser.add_argument('--metodo', choices=('GET', 'POST'), default='GET')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=8,
+                        help='WEB_THREADS de cada worker')
+    parser.add_argument('--clientes', type=int, default=32,
+                        help='Conexões simultâneas')
+    parser.add_argument('--processos-cliente', type=int,
+                        default=max(1, os.cpu_count() // 2))
+    parser.add_argument('--duracao', type=float, default=5.0)
+    parser.add_argument('--sem-dev', action='store_true',
+                        help='Não medir o servidor de desenvolvimento')
+    args = parser.parse_args()
+    args.rota = args.rota or SERVICOS[args.servico][2]
+
+    configuracoes = ([] if args.sem_dev else [None]) + args.workers
+    print(f"{args.servico}: {args.metodo} {args.rota} | "
+          f"{args.clientes} conexões | {args.duracao:g}s | "
+          f"{os.cpu_count()} CPU(s)")
+    print(f"{'servidor':22} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'erros':>6}")
+
+    for workers in configuracoes:
+        processo, porta, diretorio = subir_servidor(
+            args.servico, workers, args.threads)
+        try:
+            taxa, p50, p99, erros = gerar_carga(porta, args)
+        finally:
+            parar_servidor(processo, diretorio)
+        nome = ('dev (app.run)' if workers is None
+                else f'gunicorn {workers}w x {args.threads}t')
+        print(f"{nome:22} {taxa:9.1f} {p50:8.2f} {p99:8.2f} {erros:6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+"""
+Broker RabbitMQ falso, em processo, para os benchmarks.
+
+Substitui `pika.BlockingConnection` por uma implementação que simula a
+latência de rede: abrir conexão custa o handshake TCP+AMQP e cada operação
+síncrona (abrir canal, declarar exchange, fechar) custa um round-trip.
+basic_publish é assíncrono no protocolo e só custa o tempo de envio; com
+confirm_delivery, a BlockingConnection espera o confirm de cada mensagem,
+então cada publish passa a custar também um round-trip.
+
+`pika.SelectConnection` também é substituída (ConexaoAssincronaFalsa): as
+respostas do broker, inclusive os confirms, chegam um round-trip depois,
+pelo ioloop da conexão, sem bloquear quem publica.
+
+`AsyncioConnection` (usada por comum.consumidor) é substituída por
+ConexaoAsyncioFalsa, que também consome: as mensagens publicadas por
+qualquer conexão falsa são roteadas pelos exchanges fanout para as filas
+declaradas e entregues aos consumidores respeitando o prefetch.
+"""
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pika
+from pika.adapters import asyncio_connection
+
+
+class Estatisticas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conexoes = 0
+        self.declaracoes = 0
+        self.publicacoes = 0
+        self.entregas = 0
+        self.rejeicoes = 0
+
+    def incrementar(self, campo):
+        with self.lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+
+class CanalFalso:
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self.is_open = True
+        self.confirmando = False
+
+    def exchange_declare(self, exchange, exchange_type='direct', **kwargs):
+        self.conexao.round_trip()
+        self.conexao.broker.estatisticas.incrementar('declaracoes')
+
+    def confirm_delivery(self):
+        self.conexao.round_trip()
+        self.confirmando = True
+
+    def basic_publish(self, exchange, routing_key, body, properties=None,
+                      mandatory=False):
+        if not self.conexao.is_open:
+            raise pika.exceptions.StreamLostError('Conexão perdida')
+        time.sleep(self.conexao.broker.latencia_envio)
+        if self.confirmando:
+            self.conexao.round_trip()
+        self.conexao.broker.estatisticas.incrementar('publicacoes')
+        self.conexao.broker.rotear(exchange, routing_key, body, properties)
+
+    def close(self):
+        self.is_open = False
+
+
+class ConexaoFalsa:
+    broker = None
+
+    def __init__(self, parameters=None):
+        time.sleep(self.broker.latencia_handshake)
+        self.broker.estatisticas.incrementar('conexoes')
+        self.is_open = True
+
+    def round_trip(self):
+        time.sleep(self.broker.latencia_rtt)
+
+    def channel(self):
+        self.round_trip()
+        return CanalFalso(self)
+
+    def close(self):
+        self.round_trip()
+        self.is_open = False
+
+
+class IOLoopFalso:
+    """Laço de eventos mínimo: callbacks de outras threads e timers."""
+
+    def __init__(self):
+        self._fila = queue.Queue()
+        self._timers = []
+        self._sequencia = itertools.count()
+        self._parado = False
+
+    def add_callback_threadsafe(self, callback):
+        self._fila.put(callback)
+
+    def call_later(self, atraso, callback):
+        heapq.heappush(self._timers, (time.perf_counter() + atraso,
+                                      next(self._sequencia), callback))
+
+    def stop(self):
+        self._parado = True
+
+    def start(self):
+        self._parado = False
+        while not self._parado:
+            agora = time.perf_counter()
+            while self._timers and self._timers[0][0] <= agora:
+                _, _, callback = heapq.heappop(self._timers)
+                callback()
+
+            espera = self._timers[0][0] - agora if self._timers else 0.05
+            try:
+                callback = self._fila.get(timeout=max(espera, 0))
+            except queue.Empty:
+                continue
+            callback()
+
+
+class CanalAssincronoFalso:
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self.is_open = True
+        self._ao_confirmar = None
+        self._ultima_tag = 0
+
+    def _responder(self, callback, *args):
+        if callback is not None:
+            self.conexao.ioloop.call_later(
+                self.conexao.broker.latencia_rtt, lambda: callback(*args))
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def add_on_return_callback(self, callback):
+        pass
+
+    def exchange_declare(self, exchange, exchange_type='direct',
+                         callback=None, **kwargs):
+        self.conexao.broker.estatisticas.incrementar('declaracoes')
+        self._responder(callback, None)
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self._ao_confirmar = ack_nack_callback
+        self._responder(callback, None)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None,
+                      mandatory=False):
+        time.sleep(self.conexao.broker.latencia_envio)
+        self.conexao.broker.estatisticas.incrementar('publicacoes')
+        self.conexao.broker.rotear(exchange, routing_key, body, properties)
+        if self._ao_confirmar is not None:
+            self._ultima_tag += 1
+            confirmacao = pika.spec.Basic.Ack(delivery_tag=self._ultima_tag)
+            self._responder(self._ao_confirmar,
+                            pika.frame.Method(1, confirmacao))
+
+
+class ConexaoAssincronaFalsa:
+    broker = None
+
+    def __init__(self, parameters=None, on_open_callback=None,
+                 on_open_error_callback=None, on_close_callback=None):
+        self.ioloop = IOLoopFalso()
+        self.is_open = False
+        self._ao_fechar = on_close_callback
+        self.broker.estatisticas.incrementar('conexoes')
+
+        def abrir():
+            self.is_open = True
+            on_open_callback(self)
+
+        self.ioloop.call_later(self.broker.latencia_handshake, abrir)
+
+    def channel(self, on_open_callback=None):
+        canal = CanalAssincronoFalso(self)
+        self.ioloop.call_later(self.broker.latencia_rtt,
+                               lambda: on_open_callback(canal))
+
+    def close(self):
+        self.is_open = False
+        motivo = pika.exceptions.ConnectionClosedByClient(200, 'Normal shutdown')
+        self.ioloop.call_later(self.broker.latencia_rtt,
+                               lambda: self._ao_fechar(self, motivo))
+
+
+class FilaFalsa:
+    def __init__(self, nome):
+        self.nome = nome
+        self.mensagens = deque()
+        self.consumidores = deque()
+
+
+class CanalAsyncioFalso:
+    """Canal de consumo: declarações, qos, consume e ack/nack."""
+
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self.broker = conexao.broker
+        self.is_open = True
+        self.prefetch = 0
+        self.consumos = {}
+        self.nao_confirmadas = {}
+        self._tags = itertools.count(1)
+
+    def _responder(self, callback, metodo=None):
+        if callback is not None:
+            self.conexao.responder(callback, pika.frame.Method(1, metodo))
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def exchange_declare(self, exchange, exchange_type='direct',
+                         callback=None, **kwargs):
+        self.broker.estatisticas.incrementar('declaracoes')
+        self._responder(callback, pika.spec.Exchange.DeclareOk())
+
+    def queue_declare(self, queue, callback=None, **kwargs):
+        self.broker.estatisticas.incrementar('declaracoes')
+        nome = self.broker.declarar_fila(queue)
+        self._responder(callback, pika.spec.Queue.DeclareOk(queue=nome))
+
+    def queue_bind(self, queue, exchange, callback=None, **kwargs):
+        self.broker.ligar(exchange, queue)
+        self._responder(callback, pika.spec.Queue.BindOk())
+
+    def basic_qos(self, prefetch_count=0, callback=None, **kwargs):
+        self.prefetch = prefetch_count
+        self._responder(callback, pika.spec.Basic.QosOk())
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False,
+                      callback=None, **kwargs):
+        tag = f'ctag-{id(self)}-{len(self.consumos)}'
+        self.consumos[tag] = (queue, on_message_callback)
+        self.broker.consumir(queue, self)
+        self._responder(callback, pika.spec.Basic.ConsumeOk(tag))
+        return tag
+
+    def basic_cancel(self, consumer_tag='', callback=None):
+        fila, _ = self.consumos.pop(consumer_tag)
+        self.broker.cancelar(fila, self)
+        self._responder(callback, pika.spec.Basic.CancelOk(consumer_tag))
+
+    def tem_capacidade(self):
+        return self.is_open and (
+            not self.prefetch or len(self.nao_confirmadas) < self.prefetch)
+
+    def entregar(self, fila, body, properties):
+        """Chamado pelo broker (com o lock) para entregar uma mensagem."""
+        tag = next(self._tags)
+        self.nao_confirmadas[tag] = (fila, body, properties)
+        _, callback = next(
+            consumo for consumo in self.consumos.values()
+            if consumo[0] == fila)
+        metodo = pika.spec.Basic.Deliver(delivery_tag=tag, exchange='')
+        self.conexao.ioloop.call_soon_threadsafe(
+            callback, self, metodo,
+            properties or pika.BasicProperties(), body)
+
+    def _liquidar(self, delivery_tag, multiple):
+        if multiple:
+            tags = [t for t in self.nao_confirmadas if t <= delivery_tag]
+        else:
+            tags = [delivery_tag]
+        return [self.nao_confirmadas.pop(tag) for tag in tags]
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        mensagens = self._liquidar(delivery_tag, multiple)
+        self.broker.confirmar(self, mensagens)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        mensagens = self._liquidar(delivery_tag, multiple)
+        if requeue:
+            self.broker.devolver(mensagens)
+        else:
+            self.broker.estatisticas.incrementar('rejeicoes')
+            self.broker.confirmar(self, mensagens)
+
+    def fechar(self):
+        self.is_open = False
+        for fila, _ in self.consumos.values():
+            self.broker.cancelar(fila, self)
+        self.consumos.clear()
+        mensagens, self.nao_confirmadas = list(
+            self.nao_confirmadas.values()), {}
+        self.broker.devolver(mensagens)
+
+
+class ConexaoAsyncioFalsa:
+    broker = None
+
+    def __init__(self, parameters=None, on_open_callback=None,
+                 on_open_error_callback=None, on_close_callback=None,
+                 custom_ioloop=None):
+        self.ioloop = custom_ioloop
+        self.is_open = False
+        self._ao_fechar = on_close_callback
+        self._canais = []
+        self.broker.estatisticas.incrementar('conexoes')
+
+        def abrir():
+            self.is_open = True
+            on_open_callback(self)
+
+        self.ioloop.call_later(self.broker.latencia_handshake, abrir)
+
+    def responder(self, callback, *args):
+        self.ioloop.call_later(self.broker.latencia_rtt, callback, *args)
+
+    def channel(self, on_open_callback=None):
+        canal = CanalAsyncioFalso(self)
+        self._canais.append(canal)
+        self.responder(on_open_callback, canal)
+
+    def close(self):
+        self.is_open = False
+        for canal in self._canais:
+            canal.fechar()
+        motivo = pika.exceptions.ConnectionClosedByClient(200, 'Normal shutdown')
+        self.responder(self._ao_fechar, self, motivo)
+
+
+class BrokerFalso:
+    """Configuração de latências (em segundos) do broker simulado."""
+
+    def __init__(self, latencia_handshake=0.005, latencia_rtt=0.0005,
+                 latencia_envio=0.00005):
+        self.latencia_handshake = latencia_handshake
+        self.latencia_rtt = latencia_rtt
+        self.latencia_envio = latencia_envio
+        self.estatisticas = Estatisticas()
+        self._lock = threading.RLock()
+        self._ligacoes = {}
+        self._filas = {}
+        self._anonimas = itertools.count(1)
+
+    def declarar_fila(self, nome):
+        with self._lock:
+            nome = nome or f'amq.gen-{next(self._anonimas)}'
+            self._filas.setdefault(nome, FilaFalsa(nome))
+            return nome
+
+    def ligar(self, exchange, fila):
+        with self._lock:
+            self._ligacoes.setdefault(exchange, set()).add(fila)
+
+    def rotear(self, exchange, routing_key, body, properties=None):
+        """Exchanges fanout: copia a mensagem para cada fila ligada."""
+        with self._lock:
+            destinos = (self._ligacoes.get(exchange, ()) if exchange
+                        else [routing_key])
+            for nome in destinos:
+                fila = self._filas.get(nome)
+                if fila is not None:
+                    fila.mensagens.append((body, properties))
+                    self._despachar(fila)
+
+    def _despachar(self, fila):
+        while fila.mensagens:
+            canal = next((c for c in fila.consumidores
+                          if c.tem_capacidade()), None)
+            if canal is None:
+                return
+            # Round-robin entre os consumidores da fila
+            fila.consumidores.remove(canal)
+            fila.consumidores.append(canal)
+            body, properties = fila.mensagens.popleft()
+            self.estatisticas.incrementar('entregas')
+            canal.entregar(fila.nome, body, properties)
+
+    def consumir(self, nome, canal):
+        with self._lock:
+            fila = self._filas[nome]
+            fila.consumidores.append(canal)
+            self._despachar(fila)
+
+    def cancelar(self, nome, canal):
+        with self._lock:
+            fila = self._filas[nome]
+            if canal in fila.consumidores:
+                fila.consumidores.remove(canal)
+
+    def confirmar(self, canal, mensagens):
+        with self._lock:
+            for nome in {fila for fila, _, _ in mensagens}:
+                self._despachar(self._filas[nome])
+
+    def devolver(self, mensagens):
+        """Mensagens sem ack voltam para o início da fila."""
+        with self._lock:
+            for nome, body, properties in reversed(mensagens):
+                self._filas[nome].mensagens.appendleft((body, properties))
+            for nome in {fila for fila, _, _ in mensagens}:
+                self._despachar(self._filas[nome])
+
+    def pendentes(self, nome):
+        """Mensagens na fila ainda não entregues."""
+        with self._lock:
+            return len(self._filas[nome].mensagens)
+
+    @contextmanager
+    def instalado(self):
+        """
+        Substitui pika.BlockingConnection, pika.SelectConnection e a
+        AsyncioConnection enquanto o contexto durar.
+        """
+        originais = pika.BlockingConnection, pika.SelectConnection
+        original_asyncio = asyncio_connection.AsyncioConnection
+        pika.BlockingConnection = type(
+            'ConexaoFalsa', (ConexaoFalsa,), {'broker': self})
+        pika.SelectConnection = type(
+            'ConexaoAssincronaFalsa', (ConexaoAssincronaFalsa,),
+            {'broker': self})
+        asyncio_connection.AsyncioConnection = type(
+            'ConexaoAsyncioFalsa', (ConexaoAsyncioFalsa,), {'broker': self})
+        try:
+            yield self
+        finally:
+            pika.BlockingConnection, pika.SelectConnection = originais
+            asyncio_connection.AsyncioConnection = original_asyncio
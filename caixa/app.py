@@ -1,12 +1,12 @@
-import json
 import threading
-import time
 
 import database as db
-import pika
+from comum.eventos import Difusor, MonitorEventos, transmitir_sse
 from flasgger import Swagger
-from flask import Flask, jsonify, request, send_from_directory
+from flask import (Flask, Response, jsonify, request, send_from_directory,
+                   stream_with_context)
 from flask_cors import CORS
+from outbox import relay_outbox
 
 app = Flask(__name__, static_folder='static')
 CORS(app)
@@ -16,27 +16,18 @@ swagger = Swagger(app)
 db.init_db()
 
 
-def enviar_para_fila(pedido):
-    """Envia pedido para a fila do RabbitMQ."""
-    try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('rabbitmq'))
-        channel = connection.channel()
-
-        channel.exchange_declare(
-            exchange='pedidos_exchange', exchange_type='fanout')
+# Por quantos segundos navegadores e proxies podem reutilizar o cardápio
+# sem revalidar; depois disso revalidam com If-None-Match (304)
+CARDAPIO_MAX_AGE = 30
 
-        channel.basic_publish(
-            exchange='pedidos_exchange',
-            routing_key='',
-            body=json.dumps(pedido)
-        )
-
-        connection.close()
-        return True
-    except Exception as e:
-        print(f"[ERRO] Falha ao enviar para RabbitMQ: {e}")
-        return False
+# Pedidos criados e mudanças de status (gravados em eventos_caixa pela API e
+# pelo consumer) são lidos por uma única thread por processo e repassados
+# aos navegadores conectados em /pedidos/eventos
+INTERVALO_EVENTOS = 0.5
+difusor_pedidos = Difusor()
+monitor_pedidos = MonitorEventos(
+    difusor_pedidos, db.ultimo_evento_id, db.listar_eventos,
+    db.limpar_eventos, intervalo=INTERVALO_EVENTOS, nome='CAIXA')
 
 
 @app.route('/pedidos', methods=['POST'])
@@ -88,32 +79,93 @@ def novo_pedido():
             return jsonify({"erro": "Item é obrigatório"}), 400
 
         pedido_criado = db.inserir_pedido(cliente, item, observacao or None)
+        relay_outbox.notificar()
 
         print(
             f"[CAIXA] Pedido #{pedido_criado['id']} registrado: {item} para "
             f"{cliente}")
 
-        pedido_para_fila = {
-            'id': pedido_criado['id'],
-            'cliente': cliente,
-            'item': item,
-            'observacao': observacao or None
-        }
-
-        if enviar_para_fila(pedido_para_fila):
-            print(f"[CAIXA] Pedido #{pedido_criado['id']} enviado para a fila")
-            return jsonify({
-                "status": "sucesso",
-                "mensagem": "Pedido registrado e enviado para preparação",
-                "pedido": pedido_criado
-            }), 201
-        else:
-            return jsonify({
-                "status": "aviso",
-                "mensagem": "Pedido registrado mas falha ao enviar para "
-                "cozinha",
-                "pedido": pedido_criado
-            }), 201
+        return jsonify({
+            "status": "sucesso",
+            "mensagem": "Pedido registrado e enviado para preparação",
+            "pedido": pedido_criado
+        }), 201
+
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    except Exception as e:
+        print(f"[ERRO] Erro ao processar pedido: {e}")
+        return jsonify({"erro": "Erro interno ao processar pedido"}), 500
+
+
+@app.route('/pedidos/lote', methods=['POST'])
+def novo_pedido_lote():
+    """
+    Registra um pedido com vários itens e quantidades.
+    O pedido é gravado em uma transação e enviado à cozinha e ao estoque
+    como uma única mensagem; se algum item for inválido, nada é registrado.
+    ---
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - cliente
+            - itens
+          properties:
+            cliente:
+              type: string
+              example: "Maria"
+            itens:
+              type: array
+              items:
+                type: object
+                properties:
+                  item:
+                    type: string
+                  quantidade:
+                    type: integer
+              example: [{"item": "X-Salada", "quantidade": 2},
+                        {"item": "Coca-Cola", "quantidade": 1}]
+            observacao:
+              type: string
+              example: "Sem maionese"
+    responses:
+      201:
+        description: Pedido registrado com sucesso
+      400:
+        description: Dados inválidos
+      500:
+        description: Erro ao processar pedido
+    """
+    try:
+        dados = request.json
+
+        if not dados:
+            return jsonify({"erro": "Dados não fornecidos"}), 400
+
+        cliente = dados.get('cliente', '').strip()
+        itens = dados.get('itens')
+        observacao = dados.get('observacao', dados.get('obs', '')).strip()
+
+        if not cliente:
+            return jsonify({"erro": "Nome do cliente é obrigatório"}), 400
+
+        pedido_criado = db.inserir_pedido_itens(
+            cliente, itens, observacao or None)
+        relay_outbox.notificar()
+
+        print(
+            f"[CAIXA] Pedido #{pedido_criado['id']} registrado: "
+            f"{pedido_criado['item']} para {cliente}")
+
+        return jsonify({
+            "status": "sucesso",
+            "mensagem": "Pedido registrado e enviado para preparação",
+            "pedido": pedido_criado
+        }), 201
 
     except ValueError as e:
         return jsonify({"erro": str(e)}), 400
@@ -140,24 +192,90 @@ def listar_pedidos():
         required: false
         default: 50
         description: Número máximo de pedidos a retornar
+      - name: after
+        in: query
+        type: string
+        required: false
+        description: Cursor (next_cursor da página anterior) para buscar a
+          próxima página
     responses:
       200:
-        description: Lista de pedidos
+        description: Lista de pedidos; next_cursor é nulo na última página
+      400:
+        description: Cursor ou limit inválido
     """
     status = request.args.get('status')
     limit = request.args.get('limit', 50, type=int)
+    after = request.args.get('after')
+
+    if limit < 1:
+        return jsonify({"erro": "O 'limit' deve ser maior que zero"}), 400
 
     try:
-        pedidos = db.listar_pedidos(status=status, limit=limit)
+        apos = db.decodificar_cursor(after) if after else None
+        versao = db.ultimo_evento_id()
+        # Busca um pedido a mais só para saber se existe próxima página
+        pedidos = db.listar_pedidos(
+            status=status, limit=limit + 1, apos=apos)
+        next_cursor = None
+        if len(pedidos) > limit:
+            pedidos = pedidos[:limit]
+            next_cursor = db.codificar_cursor(pedidos[-1])
+
         return jsonify({
             "total": len(pedidos),
+            "versao": versao,
+            "next_cursor": next_cursor,
             "pedidos": pedidos
         }), 200
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
     except Exception as e:
         print(f"[ERRO] Erro ao listar pedidos: {e}")
         return jsonify({"erro": "Erro ao buscar pedidos"}), 500
 
 
+@app.route('/pedidos/eventos', methods=['GET'])
+def eventos_pedidos():
+    """
+    Stream (Server-Sent Events) de pedidos criados e mudanças de status.
+    ---
+    parameters:
+      - name: desde
+        in: query
+        type: integer
+        required: false
+        description: Envia também os eventos posteriores a esta versão
+          (campo versao de GET /pedidos). Em reconexões o cabeçalho
+          Last-Event-ID tem precedência.
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: Eventos criado, status e resync (recarregar a lista)
+    """
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None:
+        desde = request.args.get('desde', type=int)
+
+    monitor_pedidos.iniciar()
+
+    # Assinar antes de consultar o banco para não perder eventos no meio
+    assinatura = difusor_pedidos.assinar()
+    pendentes = []
+    if desde is not None:
+        pendentes = db.eventos_apos(desde)
+        if pendentes is None:
+            pendentes = [{'id': db.ultimo_evento_id(), 'tipo': 'resync'}]
+
+    return Response(
+        stream_with_context(
+            transmitir_sse(difusor_pedidos, assinatura, pendentes)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/pedidos/<int:pedido_id>', methods=['GET'])
 def buscar_pedido(pedido_id):
     """
@@ -191,16 +309,35 @@ def listar_cardapio():
     """
     Lista itens do cardápio disponíveis.
     ---
+    parameters:
+      - name: If-None-Match
+        in: header
+        type: string
+        required: false
+        description: ETag recebido em uma resposta anterior
     responses:
       200:
-        description: Lista do cardápio
+        description: Lista do cardápio (com ETag da versão atual)
+      304:
+        description: Cardápio não mudou desde o ETag informado
     """
     try:
-        cardapio = db.listar_cardapio()
-        return jsonify({
-            "total": len(cardapio),
-            "cardapio": cardapio
-        }), 200
+        versao, cardapio = db.obter_cardapio()
+        etag = f'cardapio-{versao}'
+
+        if request.if_none_match.contains(etag):
+            resposta = app.response_class(status=304)
+        else:
+            resposta = jsonify({
+                "total": len(cardapio),
+                "versao": versao,
+                "cardapio": cardapio
+            })
+
+        resposta.set_etag(etag)
+        resposta.cache_control.public = True
+        resposta.cache_control.max_age = CARDAPIO_MAX_AGE
+        return resposta
     except Exception as e:
         print(f"[ERRO] Erro ao listar cardápio: {e}")
         return jsonify({"erro": "Erro ao buscar cardápio"}), 500
@@ -221,135 +358,19 @@ def health_check():
     }), 200
 
 
-# =============================================================================
-# CONSUMER - Escuta pedidos prontos da cozinha
-# =============================================================================
-
-def callback(ch, method, properties, body):
-    """Processa mensagens de pedidos prontos vindos da cozinha."""
-    # Verificar número de tentativas (x-death header do RabbitMQ)
-    retry_count = 0
-    if properties.headers and 'x-death' in properties.headers:
-        retry_count = len(properties.headers['x-death'])
-
+@app.route('/outbox', methods=['GET'])
+def status_outbox():
+    """
+    Mensagens de pedidos que ainda aguardam publicação no RabbitMQ.
+    ---
+    responses:
+      200:
+        description: Quantidade de mensagens pendentes no outbox
+    """
     try:
-        pedido = json.loads(body)
-        pedido_id = pedido.get('pedido_caixa_id')
-        status = pedido.get('status')
-
-        if not pedido_id:
-            print("[CAIXA CONSUMER] Mensagem sem pedido_caixa_id ignorada")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
-
-        if not status:
-            print("[CAIXA CONSUMER] Mensagem sem status ignorada")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
-
-        print(f"[CAIXA CONSUMER] Pedido #{pedido_id} está {status}!")
-
-        db.atualizar_status_pedido(pedido_id, status)
-        print(f"[CAIXA CONSUMER] Status do pedido #{pedido_id} atualizado "
-              f"para {status}")
-
-        # Confirmar processamento bem-sucedido
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-
-    except json.JSONDecodeError:
-        print("[CAIXA CONSUMER] Erro ao decodificar JSON da mensagem")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return jsonify({"outbox_pendentes": db.contar_outbox()}), 200
     except Exception as e:
-        print(f"[CAIXA CONSUMER] Erro ao processar mensagem: {e}")
-
-        # Limitar tentativas: após 3 falhas, enviar para DLQ
-        if retry_count >= 2:
-            print(f"[CAIXA CONSUMER] ⚠ Limite de tentativas atingido "
-                  f"({retry_count + 1}). Enviando para DLQ...")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        else:
-            print(
-                f"[CAIXA CONSUMER] Tentativa {retry_count + 1}/3. "
-                f"Reenviando para fila...")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
-
-def iniciar_consumidor():
-    """Inicia o consumer que escuta a fila de pedidos prontos."""
-    print("[CAIXA CONSUMER] Iniciando consumer...")
-
-    while True:
-        try:
-            # Conectar ao RabbitMQ
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters('rabbitmq'))
-            channel = connection.channel()
-
-            # Declarar Dead Letter Exchange
-            channel.exchange_declare(
-                exchange='pedidos_prontos_dlx',
-                exchange_type='fanout',
-                durable=True
-            )
-
-            # Declarar Dead Letter Queue
-            channel.queue_declare(
-                queue='pedidos_prontos_dlq',
-                durable=True
-            )
-
-            # Bind DLQ ao DLX
-            channel.queue_bind(
-                exchange='pedidos_prontos_dlx',
-                queue='pedidos_prontos_dlq'
-            )
-
-            # Declarar exchange principal
-            channel.exchange_declare(
-                exchange='pedidos_prontos_exchange',
-                exchange_type='fanout'
-            )
-
-            # Criar fila com DLX configurada
-            result = channel.queue_declare(
-                queue='',
-                exclusive=True,
-                arguments={
-                    'x-dead-letter-exchange': 'pedidos_prontos_dlx',
-                }
-            )
-            queue_name = result.method.queue
-
-            # Bind da fila ao exchange
-            channel.queue_bind(
-                exchange='pedidos_prontos_exchange',
-                queue=queue_name
-            )
-
-            print(f"[CAIXA CONSUMER] Aguardando pedidos prontos na fila "
-                  f"{queue_name}...")
-            print("[CAIXA CONSUMER] DLQ configurada: pedidos_prontos_dlq")
-
-            # Configurar callback com confirmação manual
-            channel.basic_consume(
-                queue=queue_name,
-                on_message_callback=callback,
-                auto_ack=False
-            )
-
-            # Iniciar consumo
-            channel.start_consuming()
-
-        except pika.exceptions.AMQPConnectionError:
-            print("[CAIXA CONSUMER] Erro ao conectar ao RabbitMQ. "
-                  "Tentando novamente em 5s...")
-            time.sleep(5)
-        except KeyboardInterrupt:
-            print("[CAIXA CONSUMER] Encerrando consumer...")
-            break
-        except Exception as e:
-            print(f"[CAIXA CONSUMER] Erro inesperado: {e}")
-            time.sleep(5)
+        return jsonify({"erro": str(e)}), 500
 
 
 @app.route('/')
@@ -365,9 +386,16 @@ def serve_static(filename):
 
 
 if __name__ == '__main__':
+    # Desenvolvimento: consumer e relay no mesmo processo da API. Em produção
+    # a API roda no Gunicorn e o consumer em outro processo (consumidor.py).
+    from consumidor import iniciar_consumidor
+
     # Iniciar consumer em thread separada
     consumer_thread = threading.Thread(target=iniciar_consumidor, daemon=True)
     consumer_thread.start()
     print("[CAIXA] Consumer iniciado em thread separada")
 
+    relay_outbox.iniciar()
+    print("[CAIXA] Relay do outbox iniciado em thread separada")
+
     app.run(host='0.0.0.0', port=5000)
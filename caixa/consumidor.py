@@ -0,0 +1,237 @@
+"""
+Consumer do caixa: atualizações de status vindas da cozinha e do estoque e
+relay do outbox.
+
+Roda como processo próprio em produção (python consumidor.py), separado da
+API servida pelo Gunicorn; `python app.py` continua iniciando tudo num
+processo só, para desenvolvimento.
+"""
+import os
+import time
+
+import database as db
+import pika
+import requests
+from comum.codec import MensagemInvalida, decodificar
+from comum.consumidor import (Consumidor, Exchange, Fila,
+                               RuntimeConsumidores, Topologia)
+from comum.idempotencia import MensagemDuplicada, chave_mensagem
+from outbox import relay_outbox
+
+db.init_db()
+
+# Fila durável e nomeada das atualizações de status: várias réplicas do
+# caixa consomem da mesma fila (competing consumers) e as mensagens ficam
+# retidas enquanto nenhuma estiver no ar. Vazio volta à fila exclusiva
+# anterior, em que cada processo recebe todas as atualizações.
+FILA_STATUS = os.environ.get('CAIXA_FILA_STATUS', 'pedidos_prontos_caixa')
+PREFETCH_STATUS = int(os.environ.get('CAIXA_PREFETCH', '20'))
+
+# Com CONSUMIDOR_ASYNCIO=1 o consumer roda no runtime asyncio compartilhado
+# (comum.consumidor), processando até CONCORRENCIA_STATUS atualizações ao
+# mesmo tempo; as de um mesmo pedido continuam na ordem de entrega.
+CONSUMIDOR_ASYNCIO = os.environ.get('CONSUMIDOR_ASYNCIO', '0') == '1'
+CONCORRENCIA_STATUS = 4
+
+TOPOLOGIA_STATUS = Topologia(
+    exchanges=[
+        Exchange('pedidos_prontos_dlx', durable=True),
+        Exchange('pedidos_prontos_exchange'),
+    ],
+    filas=[
+        Fila('pedidos_prontos_dlq', exchanges=['pedidos_prontos_dlx']),
+        # Durável e compartilhada entre as réplicas, ou exclusiva deste
+        # processo (CAIXA_FILA_STATUS='')
+        Fila(FILA_STATUS, durable=bool(FILA_STATUS),
+             exclusive=not FILA_STATUS,
+             argumentos={'x-dead-letter-exchange': 'pedidos_prontos_dlx'},
+             exchanges=['pedidos_prontos_exchange']),
+    ]
+)
+
+# API da cozinha, consultada na inicialização do consumer para recuperar
+# mudanças de status publicadas quando a fila ainda não existia
+COZINHA_API_URL = os.environ.get('COZINHA_API_URL', 'http://cozinha_api:5001')
+
+# =============================================================================
+# CONSUMER - Escuta pedidos prontos da cozinha
+# =============================================================================
+
+def callback(ch, method, properties, body):
+    """Processa mensagens de pedidos prontos vindos da cozinha."""
+    # Verificar número de tentativas (x-death header do RabbitMQ)
+    retry_count = 0
+    if properties.headers and 'x-death' in properties.headers:
+        retry_count = len(properties.headers['x-death'])
+
+    try:
+        pedido = decodificar(properties, body)
+        pedido_id = pedido.get('pedido_caixa_id')
+        status = pedido.get('status')
+
+        if not pedido_id:
+            print("[CAIXA CONSUMER] Mensagem sem pedido_caixa_id ignorada")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+
+        if not status:
+            print("[CAIXA CONSUMER] Mensagem sem status ignorada")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+
+        print(f"[CAIXA CONSUMER] Pedido #{pedido_id} está {status}!")
+
+        chave = chave_mensagem(properties, 'status', pedido_id, status)
+        aplicar_status(pedido_id, status, chave)
+
+        # Confirmar processamento bem-sucedido
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    except MensagemDuplicada:
+        print(f"[CAIXA CONSUMER] Status {status} do pedido #{pedido_id} já "
+              f"aplicado; reentrega ignorada")
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+    except MensagemInvalida as e:
+        print(f"[CAIXA CONSUMER] Erro ao decodificar a mensagem: {e}")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+    except Exception as e:
+        print(f"[CAIXA CONSUMER] Erro ao processar mensagem: {e}")
+
+        # Limitar tentativas: após 3 falhas, enviar para DLQ
+        if retry_count >= 2:
+            print(f"[CAIXA CONSUMER] ⚠ Limite de tentativas atingido "
+                  f"({retry_count + 1}). Enviando para DLQ...")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        else:
+            print(
+                f"[CAIXA CONSUMER] Tentativa {retry_count + 1}/3. "
+                f"Reenviando para fila...")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+
+def aplicar_status(pedido_id, status, chave=None):
+    """
+    Grava o novo status; o evento gravado junto chega aos navegadores pelo
+    monitor de eventos da API. Retorna False se o status foi ignorado por
+    não avançar o pedido.
+    """
+    aplicado = db.atualizar_status_pedido(pedido_id, status, chave)
+    if aplicado:
+        print(f"[CAIXA CONSUMER] Status do pedido #{pedido_id} atualizado "
+              f"para {status}")
+    else:
+        print(f"[CAIXA CONSUMER] Status {status} do pedido #{pedido_id} "
+              f"ignorado: o pedido já está nesse status ou adiante")
+    return aplicado
+
+
+def sincronizar_status():
+    """
+    Recupera status perdidos consultando a API da cozinha.
+
+    Roda quando o consumer conecta, depois do bind da fila: o que for
+    publicado a partir daí chega pela fila, e o que foi publicado antes
+    (fila ainda inexistente ou exclusiva de outro processo) é conferido
+    aqui para os pedidos em aberto. Falhas só são registradas no log.
+    """
+    try:
+        em_aberto = {p['id']: p['status']
+                     for p in db.listar_pedidos_em_aberto()}
+        if not em_aberto:
+            return
+
+        resposta = requests.get(
+            f"{COZINHA_API_URL}/pedidos/caixa",
+            params={'ids': ','.join(map(str, em_aberto))},
+            timeout=5
+        )
+        resposta.raise_for_status()
+
+        atualizados = 0
+        for pedido_id, status in resposta.json()['status'].items():
+            pedido_id = int(pedido_id)
+            # RECEBIDO não é publicado pela cozinha: o caixa segue PENDENTE
+            if status != 'RECEBIDO' and status != em_aberto.get(pedido_id):
+                if aplicar_status(pedido_id, status):
+                    atualizados += 1
+
+        print(f"[CAIXA CONSUMER] Sincronização: {len(em_aberto)} pedido(s) "
+              f"em aberto, {atualizados} atualizado(s)")
+    except Exception as e:
+        print(f"[CAIXA CONSUMER] Sincronização com a cozinha falhou: {e}")
+
+
+def pedido_da_mensagem(properties, body):
+    """Chave de ordenação das atualizações de status: o pedido do caixa."""
+    return decodificar(properties, body).get('pedido_caixa_id')
+
+
+def runtime_consumidor():
+    """Runtime asyncio das atualizações de status (ainda não iniciado)."""
+    return RuntimeConsumidores(
+        TOPOLOGIA_STATUS,
+        [Consumidor(FILA_STATUS, callback, prefetch=PREFETCH_STATUS,
+                    concorrencia=CONCORRENCIA_STATUS,
+                    chave_ordem=pedido_da_mensagem)],
+        nome='CAIXA CONSUMER',
+        ao_conectar=sincronizar_status
+    )
+
+
+def iniciar_consumidor_asyncio():
+    """Consome as atualizações de status no runtime asyncio compartilhado."""
+    print("[CAIXA CONSUMER] Iniciando consumer (asyncio)...")
+    runtime_consumidor().executar()
+
+
+def iniciar_consumidor():
+    """Inicia o consumer que escuta a fila de pedidos prontos."""
+    if CONSUMIDOR_ASYNCIO:
+        return iniciar_consumidor_asyncio()
+
+    print("[CAIXA CONSUMER] Iniciando consumer...")
+
+    while True:
+        try:
+            # Conectar ao RabbitMQ
+            connection = pika.BlockingConnection(
+                pika.ConnectionParameters('rabbitmq'))
+            channel = connection.channel()
+
+            # Exchanges, DLQ e fila de status com DLX configurada
+            queue_name = TOPOLOGIA_STATUS.declarar(channel)[FILA_STATUS]
+
+            sincronizar_status()
+
+            print(f"[CAIXA CONSUMER] Aguardando pedidos prontos na fila "
+                  f"{queue_name} (prefetch {PREFETCH_STATUS})...")
+            print("[CAIXA CONSUMER] DLQ configurada: pedidos_prontos_dlq")
+
+            # Configurar callback com confirmação manual
+            channel.basic_qos(prefetch_count=PREFETCH_STATUS)
+            channel.basic_consume(
+                queue=queue_name,
+                on_message_callback=callback,
+                auto_ack=False
+            )
+
+            # Iniciar consumo
+            channel.start_consuming()
+
+        except pika.exceptions.AMQPConnectionError:
+            print("[CAIXA CONSUMER] Erro ao conectar ao RabbitMQ. "
+                  "Tentando novamente em 5s...")
+            time.sleep(5)
+        except KeyboardInterrupt:
+            print("[CAIXA CONSUMER] Encerrando consumer...")
+            break
+        except Exception as e:
+            print(f"[CAIXA CONSUMER] Erro inesperado: {e}")
+            time.sleep(5)
+
+
+if __name__ == '__main__':
+    relay_outbox.iniciar()
+    print("[CAIXA] Relay do outbox iniciado em thread separada")
+
+    iniciar_consumidor()
@@ -1,22 +1,39 @@
-import sqlite3
-from contextlib import contextmanager
+import base64
+import json
+import threading
+
+from comum.banco import BancoSQLite
+from comum.idempotencia import Deduplicador
 
 DATABASE_PATH = 'caixa.db'
+MAX_LINHAS_PEDIDO = 50
+banco = BancoSQLite(DATABASE_PATH)
+dedup = Deduplicador()
+
+# Cópia do cardápio em memória: (versao, {'itens': [...], 'por_nome': {}}).
+# Triggers em cardapio incrementam a versão na tabela versoes; cada acesso
+# compara a versão (leitura por chave primária) e recarrega se mudou.
+_cache_cardapio = (None, None)
+_cache_lock = threading.Lock()
+
+# Ordem dos status de um pedido no caixa. As atualizações chegam por uma
+# fila compartilhada entre réplicas e podem ser reentregues fora de ordem:
+# uma mudança só é aplicada se avança o pedido (um PREPARANDO atrasado não
+# desfaz um PRONTO). CANCELADO e ERRO_ESTOQUE encerram o pedido.
+ORDEM_STATUS = {
+    'PENDENTE': 0,
+    'PREPARANDO': 1,
+    'PRONTO': 2,
+    'CANCELADO': 3,
+    'ERRO_ESTOQUE': 3,
+}
+_ORDEM_STATUS_SQL = 'CASE status {} ELSE -1 END'.format(' '.join(
+    f"WHEN '{status}' THEN {ordem}" for status, ordem in ORDEM_STATUS.items()))
 
 
-@contextmanager
 def get_db_connection():
     """Context manager para conexão com o banco de dados."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    return banco.conexao()
 
 
 def init_db():
@@ -38,6 +55,46 @@ def init_db():
             )
         ''')
 
+        # Linhas dos pedidos com vários itens
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS itens_pedido (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pedido_id INTEGER NOT NULL,
+                item VARCHAR(100) NOT NULL,
+                quantidade INTEGER NOT NULL,
+                preco_unitario DECIMAL(10, 2) NOT NULL,
+                FOREIGN KEY (pedido_id) REFERENCES pedidos(id)
+            )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_itens_pedido '
+            'ON itens_pedido(pedido_id)')
+
+        # Outbox: mensagens gravadas na mesma transação do pedido e
+        # publicadas no RabbitMQ pelo relay (outbox.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pedido_id INTEGER NOT NULL,
+                mensagem TEXT NOT NULL,
+                tentativas INTEGER DEFAULT 0,
+                ultimo_erro TEXT,
+                data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                reservado_por TEXT,
+                reservado_ate TIMESTAMP
+            )
+        ''')
+
+        # Listagem paginada por (data_pedido, id), com e sem filtro de status
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pedidos_data
+            ON pedidos(data_pedido DESC, id DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pedidos_status_data
+            ON pedidos(status, data_pedido DESC, id DESC)
+        ''')
+
         # Tabela de itens do cardápio
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS cardapio (
@@ -50,6 +107,26 @@ def init_db():
             )
         ''')
 
+        # Versão do cardápio (invalida a cópia em memória e o ETag)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS versoes (
+                nome VARCHAR(50) PRIMARY KEY,
+                versao INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute(
+            "INSERT OR IGNORE INTO versoes (nome, versao) "
+            "VALUES ('cardapio', 0)")
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_cardapio_{evento.lower()}
+                AFTER {evento} ON cardapio
+                BEGIN
+                    UPDATE versoes SET versao = versao + 1
+                    WHERE nome = 'cardapio';
+                END
+            ''')
+
         # Inserir itens iniciais do cardápio se não existirem
         cursor.execute('SELECT COUNT(*) as count FROM cardapio')
         if cursor.fetchone()['count'] == 0:
@@ -76,7 +153,76 @@ def init_db():
                 itens_iniciais
             )
 
-        print("[DB] Banco de dados do Caixa inicializado com sucesso!")
+        # Pedidos criados e mudanças de status, na ordem em que foram
+        # gravados: cada processo da API lê os novos e os repassa aos
+        # navegadores em /pedidos/eventos (ver app.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS eventos_caixa (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo VARCHAR(20) NOT NULL,
+                pedido_id INTEGER NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                data_evento TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        _carregar_cardapio(cursor)
+        dedup.criar_tabela(cursor)
+
+    _migrar_reserva_outbox()
+    print("[DB] Banco de dados do Caixa inicializado com sucesso!")
+
+
+def _migrar_reserva_outbox():
+    """Acrescenta as colunas de reserva do relay a bancos antigos."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('PRAGMA table_info(outbox)')
+        if any(row['name'] == 'reservado_por' for row in cursor.fetchall()):
+            return
+        cursor.execute('ALTER TABLE outbox ADD COLUMN reservado_por TEXT')
+        cursor.execute('ALTER TABLE outbox ADD COLUMN reservado_ate TIMESTAMP')
+
+
+def _versao_cardapio(cursor):
+    cursor.execute("SELECT versao FROM versoes WHERE nome = 'cardapio'")
+    return cursor.fetchone()['versao']
+
+
+def _carregar_cardapio(cursor):
+    """Recarrega o cardápio inteiro para a cópia em memória."""
+    global _cache_cardapio
+
+    versao = _versao_cardapio(cursor)
+    cursor.execute('SELECT * FROM cardapio ORDER BY nome')
+    todos = [dict(row) for row in cursor.fetchall()]
+
+    cardapio = {
+        'itens': [item for item in todos if item['disponivel']],
+        'por_nome': {item['nome']: item for item in todos},
+    }
+    _cache_cardapio = (versao, cardapio)
+    return _cache_cardapio
+
+
+def _obter_cardapio(cursor):
+    versao, cardapio = _cache_cardapio
+
+    if versao is None or versao != _versao_cardapio(cursor):
+        with _cache_lock:
+            versao, cardapio = _cache_cardapio
+            if versao is None or versao != _versao_cardapio(cursor):
+                versao, cardapio = _carregar_cardapio(cursor)
+
+    return versao, cardapio
+
+
+def obter_cardapio():
+    """Retorna (versao, itens disponíveis) do cardápio em memória."""
+    with get_db_connection() as conn:
+        versao, cardapio = _obter_cardapio(conn.cursor())
+        return versao, cardapio['itens']
 
 
 def inserir_pedido(cliente, item, observacao=None):
@@ -84,11 +230,8 @@ def inserir_pedido(cliente, item, observacao=None):
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute(
-            'SELECT preco, disponivel FROM cardapio WHERE nome = ?',
-            (item,)
-        )
-        result = cursor.fetchone()
+        _, cardapio = _obter_cardapio(cursor)
+        result = cardapio['por_nome'].get(item)
 
         if not result:
             raise ValueError(f"Item '{item}' não encontrado no cardápio")
@@ -105,6 +248,20 @@ def inserir_pedido(cliente, item, observacao=None):
 
         pedido_id = cursor.lastrowid
 
+        cursor.execute('''
+            INSERT INTO itens_pedido
+            (pedido_id, item, quantidade, preco_unitario)
+            VALUES (?, ?, 1, ?)
+        ''', (pedido_id, item, preco))
+
+        _registrar_outbox(cursor, {
+            'id': pedido_id,
+            'cliente': cliente,
+            'item': item,
+            'observacao': observacao
+        })
+        _registrar_evento(cursor, 'criado', pedido_id, 'PENDENTE')
+
         return {
             'id': pedido_id,
             'cliente': cliente,
@@ -115,58 +272,378 @@ def inserir_pedido(cliente, item, observacao=None):
         }
 
 
-def atualizar_status_pedido(pedido_id, novo_status):
-    """Atualiza o status de um pedido."""
+def _registrar_evento(cursor, tipo, pedido_id, status):
+    cursor.execute(
+        'INSERT INTO eventos_caixa (tipo, pedido_id, status) VALUES (?, ?, ?)',
+        (tipo, pedido_id, status))
+
+
+def ultimo_evento_id():
+    """Retorna o id do evento mais recente (0 se não houver)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT MAX(id) AS ultimo FROM eventos_caixa')
+        return cursor.fetchone()['ultimo'] or 0
+
+
+def listar_eventos(apos_id, limit=1000):
+    """
+    Lista os eventos com id maior que `apos_id`, em ordem.
+
+    'criado' traz o pedido inteiro (estado atual) em 'pedido'; 'status'
+    traz pedido_id e o status gravado naquele evento.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            UPDATE pedidos
-            SET status = ?, data_atualizacao = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (novo_status, pedido_id))
+            SELECT e.id AS evento_id, e.tipo, e.pedido_id AS evento_pedido,
+                   e.status AS evento_status, p.*
+            FROM eventos_caixa e
+            JOIN pedidos p ON p.id = e.pedido_id
+            WHERE e.id > ?
+            ORDER BY e.id
+            LIMIT ?
+        ''', (apos_id, limit))
 
-        if cursor.rowcount == 0:
-            raise ValueError(f"Pedido {pedido_id} não encontrado")
+        eventos = []
+        for row in cursor.fetchall():
+            pedido = dict(row)
+            evento = {'id': pedido.pop('evento_id'), 'tipo': pedido.pop('tipo')}
+            pedido_id = pedido.pop('evento_pedido')
+            status = pedido.pop('evento_status')
+            if evento['tipo'] == 'criado':
+                evento['pedido'] = pedido
+            else:
+                evento.update(pedido_id=pedido_id, status=status)
+            eventos.append(evento)
+        return eventos
 
 
-def listar_pedidos(status=None, limit=50):
-    """Lista pedidos, opcionalmente filtrados por status."""
+def eventos_apos(apos_id, limit=1000):
+    """
+    Eventos posteriores a `apos_id`, ou None se algum já foi apagado por
+    limpar_eventos (o cliente precisa recarregar a lista).
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute(
+            'SELECT MIN(id) AS primeiro, MAX(id) AS ultimo FROM eventos_caixa')
+        row = cursor.fetchone()
+
+    ultimo = row['ultimo'] or 0
+    if apos_id > ultimo:
+        return None
+    if row['primeiro'] is not None and apos_id < row['primeiro'] - 1:
+        return None
+    eventos = listar_eventos(apos_id, limit)
+    if len(eventos) == limit:
+        return None
+    return eventos
+
+
+def limpar_eventos(manter=1000):
+    """Remove eventos antigos, mantendo apenas os `manter` mais recentes."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'DELETE FROM eventos_caixa WHERE id <= '
+            '(SELECT MAX(id) FROM eventos_caixa) - ?', (manter,))
+        return cursor.rowcount
+
 
-        if status:
-            cursor.execute('''
-                SELECT * FROM pedidos
-                WHERE status = ?
-                ORDER BY data_pedido DESC
+def _registrar_outbox(cursor, mensagem):
+    """Grava a mensagem do pedido no outbox, na transação de `cursor`."""
+    cursor.execute(
+        'INSERT INTO outbox (pedido_id, mensagem) VALUES (?, ?)',
+        (mensagem['id'], json.dumps(mensagem)))
+
+
+def reservar_outbox(dono, limit=100, duracao=60):
+    """
+    Reserva para o relay `dono` até `limit` mensagens pendentes, na ordem em
+    que foram gravadas, e as retorna.
+
+    Entram as mensagens livres, as já reservadas por `dono` e as de reservas
+    vencidas (relay que parou sem terminar). Com relays em vários processos
+    sobre o mesmo banco, cada mensagem fica com um só por `duracao`
+    segundos, então não é publicada duas vezes.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            UPDATE outbox
+            SET reservado_por = ?,
+                reservado_ate = datetime('now', ?)
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE reservado_ate IS NULL
+                   OR reservado_ate < datetime('now')
+                   OR reservado_por = ?
+                ORDER BY id
                 LIMIT ?
-            ''', (status, limit))
+            )
+            RETURNING id, pedido_id, mensagem, tentativas
+        ''', (dono, f'+{int(duracao)} seconds', dono, limit))
+        return sorted((dict(row) for row in cursor.fetchall()),
+                      key=lambda pendente: pendente['id'])
+
+
+def liberar_outbox(ids, dono):
+    """Devolve ao outbox as mensagens de `dono` que não foram publicadas."""
+    if not ids:
+        return
+    marcadores = ', '.join('?' * len(ids))
+    with get_db_connection() as conn:
+        conn.execute(f'''
+            UPDATE outbox SET reservado_por = NULL, reservado_ate = NULL
+            WHERE reservado_por = ? AND id IN ({marcadores})
+        ''', (dono, *ids))
+
+
+def remover_outbox(ids):
+    """Remove do outbox as mensagens já confirmadas pelo broker."""
+    if not ids:
+        return
+    marcadores = ', '.join('?' * len(ids))
+    with get_db_connection() as conn:
+        conn.execute(f'DELETE FROM outbox WHERE id IN ({marcadores})',
+                     tuple(ids))
+
+
+def registrar_falha_outbox(outbox_id, erro):
+    """Conta uma tentativa de publicação que falhou."""
+    with get_db_connection() as conn:
+        conn.execute('''
+            UPDATE outbox
+            SET tentativas = tentativas + 1, ultimo_erro = ?
+            WHERE id = ?
+        ''', (str(erro), outbox_id))
+
+
+def contar_outbox():
+    """Retorna quantas mensagens aguardam publicação."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) AS pendentes FROM outbox')
+        return cursor.fetchone()['pendentes']
+
+
+def _agrupar_itens(itens):
+    """Valida as linhas [{'item', 'quantidade'}] e soma itens repetidos."""
+    if not isinstance(itens, list) or not itens:
+        raise ValueError("Informe ao menos um item")
+    if len(itens) > MAX_LINHAS_PEDIDO:
+        raise ValueError(
+            f"Máximo de {MAX_LINHAS_PEDIDO} linhas por pedido")
+
+    agrupados = {}
+    for linha in itens:
+        if not isinstance(linha, dict) or not linha.get('item'):
+            raise ValueError("Cada linha deve ter 'item' e 'quantidade'")
+
+        quantidade = linha.get('quantidade', 1)
+        if (not isinstance(quantidade, int) or isinstance(quantidade, bool)
+                or quantidade <= 0):
+            raise ValueError(
+                f"Quantidade inválida para '{linha['item']}': {quantidade}")
+
+        item = linha['item']
+        agrupados[item] = agrupados.get(item, 0) + quantidade
+
+    return agrupados
+
+
+def inserir_pedido_itens(cliente, itens, observacao=None):
+    """
+    Insere um pedido com várias linhas em uma única transação.
+
+    `itens` é uma lista [{'item', 'quantidade'}]; linhas repetidas são
+    somadas. Todas as linhas são validadas contra a cópia do cardápio em
+    memória antes de qualquer escrita: um item inválido recusa o pedido
+    inteiro. A coluna `item` de pedidos guarda o resumo
+    ('2x X-Salada, 1x Coca-Cola') para as telas que mostram uma linha só.
+    """
+    agrupados = _agrupar_itens(itens)
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        _, cardapio = _obter_cardapio(cursor)
+
+        linhas = []
+        for item, quantidade in agrupados.items():
+            result = cardapio['por_nome'].get(item)
+
+            if not result:
+                raise ValueError(f"Item '{item}' não encontrado no cardápio")
+
+            if not result['disponivel']:
+                raise ValueError(
+                    f"Item '{item}' não está disponível no momento")
+
+            linhas.append({
+                'item': item,
+                'quantidade': quantidade,
+                'preco_unitario': result['preco'],
+                'subtotal': round(result['preco'] * quantidade, 2)
+            })
+
+        resumo = ', '.join(
+            f"{linha['quantidade']}x {linha['item']}" for linha in linhas)
+        valor = round(sum(linha['subtotal'] for linha in linhas), 2)
+
+        cursor.execute('''
+            INSERT INTO pedidos (cliente, item, observacao, valor, status)
+            VALUES (?, ?, ?, ?, 'PENDENTE')
+        ''', (cliente, resumo, observacao, valor))
+
+        pedido_id = cursor.lastrowid
+
+        cursor.executemany('''
+            INSERT INTO itens_pedido
+            (pedido_id, item, quantidade, preco_unitario)
+            VALUES (?, ?, ?, ?)
+        ''', [(pedido_id, linha['item'], linha['quantidade'],
+               linha['preco_unitario']) for linha in linhas])
+
+        _registrar_outbox(cursor, {
+            'id': pedido_id,
+            'cliente': cliente,
+            'item': resumo,
+            'itens': [{'item': linha['item'],
+                       'quantidade': linha['quantidade']}
+                      for linha in linhas],
+            'observacao': observacao
+        })
+        _registrar_evento(cursor, 'criado', pedido_id, 'PENDENTE')
+
+        return {
+            'id': pedido_id,
+            'cliente': cliente,
+            'item': resumo,
+            'itens': linhas,
+            'observacao': observacao,
+            'valor': valor,
+            'status': 'PENDENTE'
+        }
+
+
+def atualizar_status_pedido(pedido_id, novo_status, chave=None):
+    """
+    Atualiza o status de um pedido, se `novo_status` estiver à frente do
+    atual em ORDEM_STATUS.
+
+    Retorna False quando o pedido já está nesse status ou num posterior
+    (atualização atrasada ou reentregue): nada é gravado nem difundido.
+    Com `chave`, uma mensagem de status já aplicada levanta
+    MensagemDuplicada.
+    """
+    if novo_status not in ORDEM_STATUS:
+        raise ValueError(f"Status desconhecido: {novo_status}")
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        dedup.registrar(cursor, chave)
+        cursor.execute(f'''
+            UPDATE pedidos
+            SET status = ?, data_atualizacao = CURRENT_TIMESTAMP
+            WHERE id = ? AND {_ORDEM_STATUS_SQL} < ?
+        ''', (novo_status, pedido_id, ORDEM_STATUS[novo_status]))
+
+        aplicado = cursor.rowcount > 0
+        if aplicado:
+            _registrar_evento(cursor, 'status', pedido_id, novo_status)
         else:
-            cursor.execute('''
-                SELECT * FROM pedidos
-                ORDER BY data_pedido DESC
-                LIMIT ?
-            ''', (limit,))
+            cursor.execute('SELECT 1 FROM pedidos WHERE id = ?', (pedido_id,))
+            if cursor.fetchone() is None:
+                raise ValueError(f"Pedido {pedido_id} não encontrado")
+
+    dedup.lembrar(chave)
+    return aplicado
+
+
+def codificar_cursor(pedido):
+    """Gera o cursor opaco que aponta para depois de `pedido` na listagem."""
+    chave = json.dumps([pedido['data_pedido'], pedido['id']])
+    return base64.urlsafe_b64encode(chave.encode()).decode()
+
+
+def decodificar_cursor(cursor_texto):
+    """Converte um cursor de codificar_cursor em (data_pedido, id)."""
+    try:
+        data_pedido, pedido_id = json.loads(
+            base64.urlsafe_b64decode(cursor_texto.encode()))
+        return str(data_pedido), int(pedido_id)
+    except (ValueError, TypeError):
+        raise ValueError("Cursor de paginação inválido")
+
+
+def listar_pedidos(status=None, limit=50, apos=None):
+    """
+    Lista pedidos do mais recente para o mais antigo.
+
+    `apos` é a chave (data_pedido, id) do último pedido da página anterior
+    (ver decodificar_cursor); a busca continua a partir dela pelo índice,
+    sem OFFSET, então o custo não cresce com o tamanho da tabela.
+    """
+    condicoes = []
+    parametros = []
+
+    if status:
+        condicoes.append('status = ?')
+        parametros.append(status)
+
+    if apos:
+        condicoes.append('(data_pedido, id) < (?, ?)')
+        parametros.extend(apos)
+
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT * FROM pedidos
+            {where}
+            ORDER BY data_pedido DESC, id DESC
+            LIMIT ?
+        ''', (*parametros, limit))
 
         return [dict(row) for row in cursor.fetchall()]
 
 
+def listar_pedidos_em_aberto(limit=1000):
+    """Lista id e status dos pedidos que ainda não saíram da cozinha."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, status FROM pedidos
+            WHERE status IN ('PENDENTE', 'PREPARANDO')
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (limit,))
+        return [dict(row) for row in cursor.fetchall()]
+
+
 def buscar_pedido(pedido_id):
     """Busca um pedido específico por ID."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM pedidos WHERE id = ?', (pedido_id,))
         row = cursor.fetchone()
-        return dict(row) if row else None
+        if not row:
+            return None
+
+        pedido = dict(row)
+        cursor.execute('''
+            SELECT item, quantidade, preco_unitario
+            FROM itens_pedido WHERE pedido_id = ? ORDER BY id
+        ''', (pedido_id,))
+        pedido['itens'] = [dict(linha) for linha in cursor.fetchall()]
+        return pedido
 
 
 def listar_cardapio():
     """Lista todos os itens do cardápio."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM cardapio
-            WHERE disponivel = 1
-            ORDER BY nome
-        ''')
-        return [dict(row) for row in cursor.fetchall()]
+    _, itens = obter_cardapio()
+    return [dict(item) for item in itens]
@@ -0,0 +1,156 @@
+"""
+Relay do outbox: publica no RabbitMQ os pedidos gravados na tabela outbox.
+
+O pedido e a sua mensagem são gravados na mesma transação (database.py),
+então a requisição HTTP nunca espera o broker e nenhum pedido registrado
+deixa de chegar à cozinha. Uma thread em segundo plano lê o outbox em lotes,
+publica com publisher confirms em pipeline e só apaga as mensagens
+confirmadas. Se o broker estiver fora, a mensagem fica no outbox e é
+reenviada com espera exponencial.
+
+Antes de publicar, o relay reserva as mensagens do lote (reservar_outbox):
+relays em processos diferentes sobre o mesmo banco não publicam a mesma
+mensagem duas vezes.
+"""
+import json
+import os
+import socket
+import threading
+import uuid
+
+import database as db
+import pika
+from comum.mensageria import PublicadorAssincrono
+
+
+class RelayOutbox:
+    """
+    Drena o outbox em lotes de até `tamanho_lote` mensagens.
+
+    O outbox é verificado a cada `intervalo` segundos; `notificar()` acorda
+    o relay na hora, mas só quando ele roda no mesmo processo de quem gravou
+    o pedido. `publicador` deve ser um PublicadorAssincrono (publicar()
+    devolve um Future). As mensagens de um lote ficam reservadas por
+    `duracao_reserva` segundos.
+    """
+
+    def __init__(self, publicador, tamanho_lote=100, intervalo=0.05,
+                 espera_maxima=30.0, timeout_confirmacao=10.0,
+                 duracao_reserva=60):
+        self.publicador = publicador
+        self.duracao_reserva = duracao_reserva
+        self._instancia = uuid.uuid4().hex[:8]
+        self.timeout_confirmacao = timeout_confirmacao
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.espera_maxima = espera_maxima
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def dono(self):
+        """Identifica este relay nas reservas (o pid muda após um fork)."""
+        return f"{socket.gethostname()}:{os.getpid()}:{self._instancia}"
+
+    def notificar(self):
+        """Avisa que há mensagem nova no outbox (relay deste processo)."""
+        self._acordar.set()
+
+    def drenar(self):
+        """
+        Publica um lote do outbox.
+
+        As mensagens do lote são enviadas sem esperar umas pelas outras
+        (PublicadorAssincrono) e os confirms são aguardados no fim. Retorna
+        quantas foram confirmadas; se alguma falhar, as confirmadas são
+        apagadas, as demais voltam ao outbox, a falha é registrada e a
+        exceção é levantada.
+        """
+        dono = self.dono
+        pendentes = db.reservar_outbox(dono, self.tamanho_lote,
+                                       self.duracao_reserva)
+        futuros = [
+            # O outbox guarda JSON; o publicador recodifica no seu codec
+            (pendente['id'], self.publicador.publicar(
+                json.loads(pendente['mensagem']),
+                propriedades=pika.BasicProperties(
+                    delivery_mode=2,
+                    message_id=f"outbox-{pendente['id']}"
+                )
+            ))
+            for pendente in pendentes
+        ]
+
+        confirmadas = []
+        falhas = []
+        falha = None
+        for outbox_id, futuro in futuros:
+            try:
+                futuro.result(self.timeout_confirmacao)
+            except Exception as e:
+                if falha is None:
+                    falha = e
+                    db.registrar_falha_outbox(outbox_id, e)
+                falhas.append(outbox_id)
+                continue
+            confirmadas.append(outbox_id)
+
+        db.remover_outbox(confirmadas)
+        if falha is not None:
+            db.liberar_outbox(falhas, dono)
+            raise falha
+        return len(confirmadas)
+
+    def executar(self):
+        """Laço da thread do relay."""
+        falhas = 0
+
+        while not self._parar.is_set():
+            self._acordar.clear()
+            try:
+                enviadas = self.drenar()
+            except Exception as e:
+                falhas += 1
+                espera = min(2 ** (falhas - 1), self.espera_maxima)
+                print(f"[CAIXA OUTBOX] Falha ao publicar: {e}. "
+                      f"Nova tentativa em {espera}s")
+                self._parar.wait(espera)
+                continue
+
+            if falhas:
+                print("[CAIXA OUTBOX] Publicação restabelecida")
+                falhas = 0
+
+            if enviadas:
+                print(f"[CAIXA OUTBOX] {enviadas} pedido(s) enviados "
+                      f"para a fila")
+            if enviadas < self.tamanho_lote:
+                self._acordar.wait(self.intervalo)
+
+    def iniciar(self):
+        """Inicia a thread do relay (apenas uma por processo)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(
+                    target=self.executar, daemon=True)
+                self._thread.start()
+
+    def parar(self, timeout=None):
+        """Pede o fim do laço e espera a thread terminar."""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# Em produção o relay roda no processo do consumer (consumidor.py) e vê os
+# pedidos gravados pelos workers da API na verificação seguinte, a cada
+# CAIXA_OUTBOX_INTERVALO segundos; os workers não iniciam o relay e o
+# notificar() deles não tem efeito. Com `python app.py` (API e relay no
+# mesmo processo) o notificar() acorda o relay a cada pedido.
+relay_outbox = RelayOutbox(
+    PublicadorAssincrono('pedidos_exchange'),
+    intervalo=float(os.environ.get('CAIXA_OUTBOX_INTERVALO', '0.05')))
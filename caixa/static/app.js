@@ -7,6 +7,8 @@ let state = {
   pedidos: [],
   carrinho: [],
   filtroStatus: "todos",
+  eventos: null,
+  versao: null,
 };
 
 // Elementos DOM
@@ -109,47 +111,31 @@ async function fazerPedido() {
     elements.btnFazerPedido.disabled = true;
     elements.btnFazerPedido.textContent = "Processando...";
 
-    const pedidosCriados = [];
-    let erros = [];
-
-    for (const itemCarrinho of state.carrinho) {
-      for (let i = 0; i < itemCarrinho.quantidade; i++) {
-        try {
-          const pedidoData = {
-            cliente: cliente,
-            item: itemCarrinho.item.nome,
-          };
-          if (observacao) pedidoData.observacao = observacao;
-
-          const response = await fetch(`${API_URL}/pedidos`, {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify(pedidoData),
-          });
-
-          const data = await response.json();
-          if (response.ok) {
-            pedidosCriados.push(data.pedido);
-          } else {
-            erros.push(`${itemCarrinho.item.nome}: ${data.erro}`);
-          }
-        } catch (err) {
-          erros.push(`${itemCarrinho.item.nome}: ${err.message}`);
-        }
-      }
-    }
+    // Um único pedido com todas as linhas do carrinho
+    const pedidoData = {
+      cliente: cliente,
+      itens: state.carrinho.map((itemCarrinho) => ({
+        item: itemCarrinho.item.nome,
+        quantidade: itemCarrinho.quantidade,
+      })),
+    };
+    if (observacao) pedidoData.observacao = observacao;
+
+    const response = await fetch(`${API_URL}/pedidos/lote`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(pedidoData),
+    });
 
-    if (pedidosCriados.length > 0) {
-      const valorTotal = pedidosCriados.reduce((sum, p) => sum + p.valor, 0);
-      const idsPedidos = pedidosCriados.map((p) => `#${p.id}`).join(", ");
-      let mensagem = `Pedidos ${idsPedidos} realizados! Total: R$ ${valorTotal.toFixed(
-        2
-      )}`;
-      if (erros.length > 0) mensagem += `\n\nFalhas: ${erros.length}`;
-      mostrarSucesso(mensagem);
-    } else {
-      throw new Error(erros.join("\n") || "Erro ao criar pedidos");
+    const data = await response.json();
+    if (!response.ok) {
+      throw new Error(data.erro || "Erro ao criar pedido");
     }
+
+    const pedido = data.pedido;
+    mostrarSucesso(
+      `Pedido #${pedido.id} realizado! Total: R$ ${pedido.valor.toFixed(2)}`
+    );
   } catch (error) {
     mostrarErro(error.message);
   } finally {
@@ -164,7 +150,9 @@ async function carregarPedidos() {
     const response = await fetch(`${API_URL}/pedidos?limit=50`);
     const data = await response.json();
     state.pedidos = data.pedidos;
+    state.versao = data.versao;
     renderizarPedidos();
+    conectarEventos();
   } catch (error) {
     console.error("Erro pedidos:", error);
     mostrarErro("Erro ao carregar histórico.");
@@ -258,9 +246,12 @@ function renderizarPedidos() {
   }
 
   elements.pedidosList.innerHTML = "";
-  pedidosFiltrados.reverse().forEach((pedido) => {
-    elements.pedidosList.appendChild(criarPedidoCard(pedido));
-  });
+  pedidosFiltrados
+    .slice()
+    .reverse()
+    .forEach((pedido) => {
+      elements.pedidosList.appendChild(criarPedidoCard(pedido));
+    });
 }
 
 function criarPedidoCard(pedido) {
@@ -309,7 +300,52 @@ function mostrarNovoPedido() {
 function mostrarPedidos() {
   elements.sectionNovoPedido.style.display = "none";
   elements.sectionPedidos.style.display = "block";
-  carregarPedidos(); // Recarrega sempre que abre a tela
+  // Com o stream de eventos conectado a lista já está atualizada
+  if (state.eventos) renderizarPedidos();
+  else carregarPedidos();
+}
+
+// --- Atualização em tempo real ---
+// Novos pedidos e mudanças de status chegam por /pedidos/eventos (SSE),
+// sem reler GET /pedidos a cada vez.
+function conectarEventos() {
+  if (state.eventos || !window.EventSource) return;
+
+  const eventos = new EventSource(
+    `${API_URL}/pedidos/eventos?desde=${state.versao}`
+  );
+  state.eventos = eventos;
+
+  eventos.addEventListener("criado", (e) => {
+    const evento = JSON.parse(e.data);
+    if (!state.pedidos.some((p) => p.id === evento.pedido.id)) {
+      state.pedidos.unshift(evento.pedido);
+    }
+    aposEvento(evento);
+  });
+
+  eventos.addEventListener("status", (e) => {
+    const evento = JSON.parse(e.data);
+    const pedido = state.pedidos.find((p) => p.id === evento.pedido_id);
+    if (pedido) pedido.status = evento.status;
+    aposEvento(evento);
+  });
+
+  // Eventos perdidos (ex.: reinício do caixa): recarrega a lista inteira
+  eventos.addEventListener("resync", () => {
+    eventos.close();
+    state.eventos = null;
+    carregarPedidos();
+  });
+
+  eventos.onerror = () => {
+    if (eventos.readyState === EventSource.CLOSED) state.eventos = null;
+  };
+}
+
+function aposEvento(evento) {
+  state.versao = evento.id;
+  if (elements.sectionPedidos.style.display !== "none") renderizarPedidos();
 }
 
 function atualizarResumo() {
@@ -0,0 +1 @@
+"""Componentes compartilhados entre os serviços Caixa, Cozinha e Estoque."""
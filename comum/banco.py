@@ -0,0 +1,92 @@
+"""Conexões SQLite reaproveitadas e configuradas para acesso concorrente."""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Aplicados em toda conexão nova. journal_mode=WAL permite que leitores
+# (API) e o escritor (consumer) trabalhem ao mesmo tempo; com WAL,
+# synchronous=NORMAL continua seguro contra corrupção e evita um fsync
+# por commit.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -8000),
+    ('temp_store', 'MEMORY'),
+)
+
+
+class BancoSQLite:
+    """
+    Pool de conexões SQLite de um arquivo de banco.
+
+    Cada conexão é emprestada a uma thread por vez durante uma transação
+    e volta ao pool em seguida, mantendo o cache de páginas e o cache de
+    prepared statements do sqlite3 entre as chamadas. Até `maximo_ociosas`
+    conexões ficam guardadas; as excedentes são fechadas na devolução.
+    """
+
+    def __init__(self, caminho, maximo_ociosas=8, cached_statements=256):
+        self.caminho = caminho
+        self.maximo_ociosas = maximo_ociosas
+        self.cached_statements = cached_statements
+        self._ociosas = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _abrir(self):
+        conn = sqlite3.connect(
+            self.caminho,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        for nome, valor in PRAGMAS:
+            conn.execute(f'PRAGMA {nome} = {valor}')
+        return conn
+
+    def _verificar_processo(self):
+        # Conexões herdadas de um fork não podem ser usadas no filho
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._ociosas = queue.LifoQueue()
+                    self._pid = os.getpid()
+
+    def _emprestar(self):
+        self._verificar_processo()
+        try:
+            return self._ociosas.get_nowait()
+        except queue.Empty:
+            return self._abrir()
+
+    def _devolver(self, conn):
+        if self._ociosas.qsize() < self.maximo_ociosas:
+            self._ociosas.put(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão: commit ao sair, rollback em caso de erro."""
+        conn = self._emprestar()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._devolver(conn)
+
+    def fechar(self):
+        """Fecha as conexões ociosas."""
+        while True:
+            try:
+                self._ociosas.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,242 @@
+"""
+Codificação das mensagens trocadas pelo RabbitMQ.
+
+Quem publica grava o formato no content_type da mensagem e quem consome
+escolhe o codec por ele (decodificar). Mensagens sem content_type, ou com
+um tipo desconhecido, são lidas como JSON, o formato original do projeto:
+consumidores novos continuam entendendo publicadores antigos.
+
+Formatos:
+  - application/json: JSON compacto (padrão);
+  - application/x-hamburgueria-bin: binário próprio (CodecBinario), sem
+    dependências;
+  - application/x-msgpack: msgpack, se o pacote estiver instalado.
+
+O codec de publicação vem de CODEC_MENSAGENS (nome curto ou content_type).
+Para trocar o formato em produção, atualize primeiro os consumidores e só
+depois configure os publicadores.
+"""
+import json
+import os
+import struct
+
+try:
+    import msgpack
+except ImportError:  # msgpack é opcional
+    msgpack = None
+
+
+class MensagemInvalida(ValueError):
+    """O corpo da mensagem não é válido no formato do seu content_type."""
+
+
+class CodecJSON:
+    nome = 'json'
+    content_type = 'application/json'
+
+    def codificar(self, mensagem):
+        return json.dumps(mensagem, separators=(',', ':')).encode('utf-8')
+
+    def decodificar(self, body):
+        return json.loads(body)
+
+
+# Strings frequentes nas mensagens (chaves, status e itens do cardápio
+# inicial), gravadas como um índice de um byte. A tabela é parte do formato:
+# só acrescente no fim, nunca remova nem reordene.
+TABELA_STRINGS = (
+    'id', 'pedido_caixa_id', 'cliente', 'item', 'observacao', 'itens',
+    'quantidade', 'status', 'erro',
+    'PENDENTE', 'RECEBIDO', 'PREPARANDO', 'PRONTO', 'ERRO_ESTOQUE',
+    'X-Salada', 'X-Bacon', 'X-Egg', 'X-Calabresa', 'X-Frango', 'X-Tudo',
+    'X-Ceara', 'Coca-Cola', 'Guaraná', 'Suco de Laranja', 'Água Mineral',
+    'Cerveja',
+)
+
+# Marcadores de tipo do CodecBinario
+_NULO, _VERDADEIRO, _FALSO, _INTEIRO, _TEXTO, _TABELA, _LISTA, _MAPA, \
+    _REAL = range(9)
+_VERSAO = 1
+_DOUBLE = struct.Struct('>d')
+
+
+class CodecBinario:
+    """
+    Formato binário compacto para os eventos de pedido.
+
+    Um byte de versão seguido do valor codificado: cada valor começa com um
+    byte de tipo; inteiros são varints zigzag, textos têm o tamanho em
+    varint antes dos bytes UTF-8 e strings da TABELA_STRINGS viram o seu
+    índice. Um evento de status com as quatro chaves de sempre cabe em menos
+    da metade dos bytes do JSON.
+    """
+
+    nome = 'binario'
+    content_type = 'application/x-hamburgueria-bin'
+
+    def __init__(self, tabela=TABELA_STRINGS):
+        self.tabela = tabela
+        self.indices = {texto: i for i, texto in enumerate(tabela)}
+
+    def codificar(self, mensagem):
+        saida = bytearray((_VERSAO,))
+        self._valor(saida, mensagem)
+        return bytes(saida)
+
+    def _valor(self, saida, valor):
+        tipo = type(valor)
+        if tipo is str:
+            indice = self.indices.get(valor)
+            if indice is not None:
+                saida.append(_TABELA)
+                _varint(saida, indice)
+            else:
+                dados = valor.encode('utf-8')
+                saida.append(_TEXTO)
+                _varint(saida, len(dados))
+                saida += dados
+        elif tipo is int:
+            saida.append(_INTEIRO)
+            _varint(saida, valor << 1 if valor >= 0 else (-valor << 1) - 1)
+        elif tipo is dict:
+            saida.append(_MAPA)
+            _varint(saida, len(valor))
+            for chave, item in valor.items():
+                self._valor(saida, chave)
+                self._valor(saida, item)
+        elif tipo is list or tipo is tuple:
+            saida.append(_LISTA)
+            _varint(saida, len(valor))
+            for item in valor:
+                self._valor(saida, item)
+        elif valor is None:
+            saida.append(_NULO)
+        elif tipo is bool:
+            saida.append(_VERDADEIRO if valor else _FALSO)
+        elif tipo is float:
+            saida.append(_REAL)
+            saida += _DOUBLE.pack(valor)
+        else:
+            raise TypeError(
+                f"tipo não suportado pelo codec binário: {tipo.__name__}")
+
+    def decodificar(self, body):
+        """Levanta ValueError se a mensagem estiver malformada."""
+        dados = bytes(body)
+        try:
+            if dados[0] != _VERSAO:
+                raise ValueError(
+                    f"versão do codec binário desconhecida: {dados[0]}")
+            valor, posicao = self._ler(dados, 1)
+        except (IndexError, UnicodeDecodeError, struct.error) as e:
+            raise ValueError(f"mensagem binária malformada: {e}") from e
+        if posicao != len(dados):
+            raise ValueError("mensagem binária com bytes sobrando")
+        return valor
+
+    def _ler(self, dados, posicao):
+        tipo = dados[posicao]
+        posicao += 1
+        if tipo == _TABELA:
+            indice, posicao = _ler_varint(dados, posicao)
+            return self.tabela[indice], posicao
+        if tipo == _TEXTO:
+            tamanho, posicao = _ler_varint(dados, posicao)
+            fim = posicao + tamanho
+            if fim > len(dados):
+                raise IndexError("texto além do fim da mensagem")
+            return dados[posicao:fim].decode('utf-8'), fim
+        if tipo == _INTEIRO:
+            numero, posicao = _ler_varint(dados, posicao)
+            return (numero >> 1) ^ -(numero & 1), posicao
+        if tipo == _MAPA:
+            tamanho, posicao = _ler_varint(dados, posicao)
+            mapa = {}
+            for _ in range(tamanho):
+                chave, posicao = self._ler(dados, posicao)
+                mapa[chave], posicao = self._ler(dados, posicao)
+            return mapa, posicao
+        if tipo == _LISTA:
+            tamanho, posicao = _ler_varint(dados, posicao)
+            lista = []
+            for _ in range(tamanho):
+                item, posicao = self._ler(dados, posicao)
+                lista.append(item)
+            return lista, posicao
+        if tipo == _NULO:
+            return None, posicao
+        if tipo == _VERDADEIRO:
+            return True, posicao
+        if tipo == _FALSO:
+            return False, posicao
+        if tipo == _REAL:
+            return _DOUBLE.unpack_from(dados, posicao)[0], posicao + 8
+        raise ValueError(f"tipo desconhecido no codec binário: {tipo}")
+
+
+def _varint(saida, numero):
+    while numero > 0x7f:
+        saida.append((numero & 0x7f) | 0x80)
+        numero >>= 7
+    saida.append(numero)
+
+
+def _ler_varint(dados, posicao):
+    numero = deslocamento = 0
+    while True:
+        byte = dados[posicao]
+        posicao += 1
+        numero |= (byte & 0x7f) << deslocamento
+        if byte < 0x80:
+            return numero, posicao
+        deslocamento += 7
+
+
+class CodecMsgpack:
+    nome = 'msgpack'
+    content_type = 'application/x-msgpack'
+
+    def codificar(self, mensagem):
+        return msgpack.packb(mensagem)
+
+    def decodificar(self, body):
+        try:
+            return msgpack.unpackb(body)
+        except Exception as e:
+            raise ValueError(f"mensagem msgpack malformada: {e}") from e
+
+
+JSON = CodecJSON()
+CODECS = [JSON, CodecBinario()]
+if msgpack is not None:
+    CODECS.append(CodecMsgpack())
+
+_POR_CONTENT_TYPE = {codec.content_type: codec for codec in CODECS}
+_POR_NOME = {codec.nome: codec for codec in CODECS}
+
+
+def obter_codec(nome):
+    """Codec pelo nome curto ('json', 'binario', 'msgpack') ou content_type."""
+    codec = _POR_NOME.get(nome) or _POR_CONTENT_TYPE.get(nome)
+    if codec is None:
+        raise ValueError(f"codec de mensagens indisponível: {nome}")
+    return codec
+
+
+def codec_padrao():
+    """Codec de publicação configurado em CODEC_MENSAGENS (padrão JSON)."""
+    return obter_codec(os.environ.get('CODEC_MENSAGENS', 'json'))
+
+
+def decodificar(properties, body):
+    """
+    Decodifica `body` pelo content_type de `properties`.
+
+    Sem content_type (ou com um desconhecido) a mensagem é lida como JSON.
+    Levanta MensagemInvalida se o corpo não for válido no formato indicado.
+    """
+    content_type = getattr(properties, 'content_type', None)
+    try:
+        return _POR_CONTENT_TYPE.get(content_type, JSON).decodificar(body)
+    except ValueError as e:
+        raise MensagemInvalida(str(e)) from e
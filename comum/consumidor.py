@@ -0,0 +1,449 @@
+"""
+Runtime de consumo do RabbitMQ em asyncio, compartilhado pelos serviços.
+
+Cada serviço descreve a sua topologia (Topologia) e os seus consumidores
+(Consumidor) e entrega os callbacks de sempre, com a assinatura do pika
+(ch, method, properties, body). O RuntimeConsumidores abre uma única
+conexão AsyncioConnection, declara a topologia uma vez por conexão e
+multiplexa todas as filas no mesmo laço de eventos, um canal por fila.
+
+Os callbacks continuam síncronos (usam o SQLite): rodam em um pool de
+threads compartilhado e cada consumidor tem um limite de mensagens em
+processamento. Se a conexão cair, o runtime reconecta com espera
+exponencial; ao receber SIGTERM/SIGINT, cancela os consumidores, termina
+as mensagens já entregues e só então fecha a conexão.
+"""
+import asyncio
+import functools
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
+from pika.adapters import asyncio_connection
+
+
+class Exchange:
+    def __init__(self, nome, tipo='fanout', durable=False):
+        self.nome = nome
+        self.tipo = tipo
+        self.durable = durable
+
+
+class Fila:
+    """
+    Fila e os exchanges aos quais ela é ligada.
+
+    Com nome vazio o broker gera o nome (fila exclusiva da conexão); o nome
+    gerado é devolvido por Topologia.declarar.
+    """
+
+    def __init__(self, nome, durable=True, exclusive=False, argumentos=None,
+                 exchanges=()):
+        self.nome = nome
+        self.durable = durable
+        self.exclusive = exclusive
+        self.argumentos = argumentos
+        self.exchanges = tuple(exchanges)
+
+
+class Topologia:
+    """Exchanges e filas que um serviço precisa, declarados em um só lugar."""
+
+    def __init__(self, exchanges=(), filas=()):
+        self.exchanges = tuple(exchanges)
+        self.filas = tuple(filas)
+
+    def declarar(self, channel):
+        """
+        Declara tudo em um canal da BlockingConnection.
+
+        Retorna {nome da Fila: nome da fila no broker}.
+        """
+        for exchange in self.exchanges:
+            channel.exchange_declare(
+                exchange=exchange.nome, exchange_type=exchange.tipo,
+                durable=exchange.durable)
+
+        nomes = {}
+        for fila in self.filas:
+            result = channel.queue_declare(
+                queue=fila.nome, durable=fila.durable,
+                exclusive=fila.exclusive, arguments=fila.argumentos)
+            nomes[fila.nome] = result.method.queue
+            for exchange in fila.exchanges:
+                channel.queue_bind(exchange=exchange,
+                                   queue=result.method.queue)
+        return nomes
+
+    async def declarar_async(self, channel):
+        """Mesmo que declarar(), em um canal da AsyncioConnection."""
+        for exchange in self.exchanges:
+            await _aguardar(
+                channel.exchange_declare, exchange=exchange.nome,
+                exchange_type=exchange.tipo, durable=exchange.durable)
+
+        nomes = {}
+        for fila in self.filas:
+            frame = await _aguardar(
+                channel.queue_declare, queue=fila.nome, durable=fila.durable,
+                exclusive=fila.exclusive, arguments=fila.argumentos)
+            nomes[fila.nome] = frame.method.queue
+            for exchange in fila.exchanges:
+                await _aguardar(channel.queue_bind, exchange=exchange,
+                                queue=frame.method.queue)
+        return nomes
+
+
+async def _aguardar(metodo, **kwargs):
+    """Chama um método assíncrono do pika e espera o seu callback."""
+    futuro = asyncio.get_running_loop().create_future()
+
+    def concluir(resultado):
+        if not futuro.done():
+            futuro.set_result(resultado)
+
+    metodo(callback=concluir, **kwargs)
+    return await futuro
+
+
+class CanalThreadsafe:
+    """
+    Repassa basic_ack/basic_nack de outras threads à thread da conexão.
+
+    Os canais do pika não são thread-safe: quem processa a mensagem fora da
+    thread da conexão não pode chamar o canal diretamente. Cada ack é
+    entregue a `agendar` (add_callback_threadsafe da BlockingConnection ou
+    call_soon_threadsafe do laço asyncio) e executado pela conexão.
+    As confirmações pedidas ficam em `liquidadas` (delivery_tag, multiple).
+    """
+
+    def __init__(self, agendar, channel):
+        self.agendar = agendar
+        self.channel = channel
+        self.liquidadas = []
+
+    def liquidada(self, delivery_tag):
+        """True se o callback já pediu ack/nack desta mensagem."""
+        return any(tag == delivery_tag or (multiple and tag >= delivery_tag)
+                   for tag, multiple in self.liquidadas)
+
+    def _agendar(self, metodo, **kwargs):
+        def executar():
+            try:
+                metodo(**kwargs)
+            except Exception as e:
+                # Canal fechado: sem ack, o RabbitMQ reentrega a mensagem
+                print(f"[CONSUMER] Confirmação perdida ({e}); a mensagem "
+                      f"será reentregue", flush=True)
+
+        try:
+            self.agendar(executar)
+        except Exception as e:
+            print(f"[CONSUMER] Confirmação perdida ({e}); a mensagem será "
+                  f"reentregue", flush=True)
+
+    def basic_ack(self, **kwargs):
+        self._registrar(kwargs)
+        self._agendar(self.channel.basic_ack, **kwargs)
+
+    def basic_nack(self, **kwargs):
+        self._registrar(kwargs)
+        self._agendar(self.channel.basic_nack, **kwargs)
+
+    def _registrar(self, kwargs):
+        self.liquidadas.append((kwargs.get('delivery_tag', 0),
+                                kwargs.get('multiple', False)))
+
+
+class Consumidor:
+    """
+    Um callback consumindo uma fila da topologia.
+
+    - `prefetch`: mensagens entregues e ainda sem ack no canal da fila;
+    - `concorrencia`: mensagens processadas ao mesmo tempo;
+    - `chave_ordem(properties, body)`: mensagens com a mesma chave são
+      processadas na ordem de entrega, uma de cada vez;
+    - `tamanho_lote` > 1: o callback recebe (ch, [(method, properties,
+      body), ...]) com até `tamanho_lote` mensagens ou as acumuladas em
+      `espera_lote` segundos. Lotes são processados um de cada vez, porque
+      o callback pode confirmar com basic_ack(multiple=True).
+    """
+
+    def __init__(self, fila, callback, prefetch=1, concorrencia=1,
+                 chave_ordem=None, tamanho_lote=1, espera_lote=0.2):
+        self.fila = fila
+        self.callback = callback
+        self.prefetch = prefetch
+        self.concorrencia = 1 if tamanho_lote > 1 else concorrencia
+        self.chave_ordem = chave_ordem
+        self.tamanho_lote = tamanho_lote
+        self.espera_lote = espera_lote
+
+
+class _Sessao:
+    """Estado de um consumidor em uma conexão: canal, lote pendente, timer."""
+
+    def __init__(self, consumidor, canal, semaforo):
+        self.consumidor = consumidor
+        self.canal = canal
+        self.semaforo = semaforo
+        self.tag = None
+        self.lote = []
+        self.timer = None
+
+
+class RuntimeConsumidores:
+    """
+    Executa `consumidores` em uma conexão asyncio com o RabbitMQ.
+
+    `ao_conectar`, se informado, roda (no pool de threads) depois que a
+    topologia é declarada e antes do consumo começar, a cada conexão.
+    `nome` é o prefixo dos logs. `consumindo` (threading.Event) fica
+    sinalizado enquanto todos os consumidores estão registrados no broker.
+    """
+
+    def __init__(self, topologia, consumidores, host='rabbitmq',
+                 nome='CONSUMER', ao_conectar=None, espera_inicial=1.0,
+                 espera_maxima=30.0, timeout_drenagem=30.0):
+        self.topologia = topologia
+        self.consumidores = list(consumidores)
+        self.host = host
+        self.nome = nome
+        self.ao_conectar = ao_conectar
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.timeout_drenagem = timeout_drenagem
+        self._executor = ThreadPoolExecutor(
+            max_workers=sum(c.concorrencia for c in self.consumidores),
+            thread_name_prefix='consumidor')
+        self._em_voo = set()
+        self._ordem = {}
+        self._parar = None
+        self._loop = None
+        self._conectado = False
+        self._perdida = None
+        self.consumindo = threading.Event()
+
+    def _log(self, mensagem):
+        print(f"[{self.nome}] {mensagem}", flush=True)
+
+    def executar(self):
+        """Bloqueia rodando o laço de eventos até parar() ou um sinal."""
+        asyncio.run(self._executar())
+
+    def parar(self):
+        """Pede o encerramento (pode ser chamado de qualquer thread)."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._parar.set)
+
+    async def _executar(self):
+        self._loop = asyncio.get_running_loop()
+        self._parar = asyncio.Event()
+        for sinal in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self._loop.add_signal_handler(sinal, self._parar.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Fora da thread principal (ex. consumer do caixa)
+                pass
+
+        falhas = 0
+        try:
+            while not self._parar.is_set():
+                self._conectado = False
+                try:
+                    await self._sessao()
+                except Exception as e:
+                    falhas = 0 if self._conectado else falhas + 1
+                    espera = min(self.espera_inicial * 2 ** max(falhas - 1, 0),
+                                 self.espera_maxima)
+                    self._log(f"Conexão com RabbitMQ indisponível ({e!r}). "
+                              f"Tentando novamente em {espera:g}s...")
+                    try:
+                        await asyncio.wait_for(self._parar.wait(), espera)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self._executor.shutdown(wait=True)
+            self._log("Consumo encerrado")
+
+    async def _conectar(self):
+        loop = asyncio.get_running_loop()
+        aberta = loop.create_future()
+        self._perdida = loop.create_future()
+
+        def ao_abrir(conexao):
+            if not aberta.done():
+                aberta.set_result(conexao)
+
+        def ao_falhar(conexao, erro):
+            if not aberta.done():
+                aberta.set_exception(
+                    erro if isinstance(erro, Exception)
+                    else pika.exceptions.AMQPConnectionError(erro))
+
+        def ao_fechar(conexao, motivo):
+            if not aberta.done():
+                aberta.set_exception(
+                    pika.exceptions.AMQPConnectionError(motivo))
+            if not self._perdida.done():
+                self._perdida.set_result(motivo)
+
+        asyncio_connection.AsyncioConnection(
+            pika.ConnectionParameters(self.host),
+            on_open_callback=ao_abrir,
+            on_open_error_callback=ao_falhar,
+            on_close_callback=ao_fechar,
+            custom_ioloop=loop)
+        return await aberta
+
+    async def _abrir_canal(self, conexao):
+        futuro = asyncio.get_running_loop().create_future()
+        conexao.channel(on_open_callback=futuro.set_result)
+        canal = await futuro
+
+        def ao_fechar(canal, motivo):
+            # Um canal fechado pelo broker (ex. fila apagada) derruba a
+            # sessão inteira: a reconexão declara tudo de novo
+            if conexao.is_open and not self._parar.is_set():
+                conexao.close()
+
+        canal.add_on_close_callback(ao_fechar)
+        return canal
+
+    async def _sessao(self):
+        conexao = await self._conectar()
+        sessoes = []
+        try:
+            canal = await self._abrir_canal(conexao)
+            nomes = await asyncio.wait_for(
+                self.topologia.declarar_async(canal), self.espera_maxima)
+            self._conectado = True
+
+            if self.ao_conectar is not None:
+                await self._loop.run_in_executor(
+                    self._executor, self.ao_conectar)
+
+            for consumidor in self.consumidores:
+                canal = await self._abrir_canal(conexao)
+                await _aguardar(canal.basic_qos,
+                                prefetch_count=consumidor.prefetch)
+                sessao = _Sessao(consumidor, canal,
+                                 asyncio.Semaphore(consumidor.concorrencia))
+                sessao.tag = canal.basic_consume(
+                    nomes.get(consumidor.fila, consumidor.fila),
+                    functools.partial(self._ao_receber, sessao),
+                    auto_ack=False)
+                sessoes.append(sessao)
+                self._log(f"Consumindo {nomes.get(consumidor.fila)} "
+                          f"(prefetch {consumidor.prefetch}, "
+                          f"concorrência {consumidor.concorrencia})")
+
+            self.consumindo.set()
+            parar = asyncio.ensure_future(self._parar.wait())
+            try:
+                await asyncio.wait([parar, self._perdida],
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                parar.cancel()
+                self.consumindo.clear()
+
+            if self._perdida.done():
+                raise pika.exceptions.AMQPConnectionError(
+                    self._perdida.result())
+
+            await self._drenar(sessoes)
+        finally:
+            if conexao.is_open:
+                conexao.close()
+                await self._perdida
+
+    async def _drenar(self, sessoes):
+        """Para de receber e termina as mensagens já entregues."""
+        self._log("Encerrando: aguardando mensagens em processamento...")
+        for sessao in sessoes:
+            await _aguardar(sessao.canal.basic_cancel,
+                            consumer_tag=sessao.tag)
+            self._despachar_lote(sessao)
+
+        if self._em_voo:
+            _, pendentes = await asyncio.wait(
+                set(self._em_voo), timeout=self.timeout_drenagem)
+            if pendentes:
+                self._log(f"{len(pendentes)} mensagem(ns) sem ack serão "
+                          f"reentregues")
+        # Os acks agendados pelas threads rodam antes do fechamento
+        await asyncio.sleep(0)
+
+    def _ao_receber(self, sessao, ch, method, properties, body):
+        consumidor = sessao.consumidor
+        if consumidor.tamanho_lote <= 1:
+            self._criar_tarefa(self._processar(
+                sessao, (method, properties, body)))
+            return
+
+        sessao.lote.append((method, properties, body))
+        if len(sessao.lote) >= consumidor.tamanho_lote:
+            self._despachar_lote(sessao)
+        elif sessao.timer is None:
+            sessao.timer = self._loop.call_later(
+                consumidor.espera_lote, self._despachar_lote, sessao)
+
+    def _despachar_lote(self, sessao):
+        if sessao.timer is not None:
+            sessao.timer.cancel()
+            sessao.timer = None
+        lote, sessao.lote = sessao.lote, []
+        if lote:
+            self._criar_tarefa(self._processar(sessao, lote))
+
+    def _criar_tarefa(self, coro):
+        tarefa = asyncio.ensure_future(coro)
+        self._em_voo.add(tarefa)
+        tarefa.add_done_callback(self._em_voo.discard)
+
+    async def _processar(self, sessao, mensagem):
+        consumidor = sessao.consumidor
+        chave = None
+        if consumidor.chave_ordem is not None and consumidor.tamanho_lote <= 1:
+            try:
+                chave = consumidor.chave_ordem(mensagem[1], mensagem[2])
+                hash(chave)
+            except Exception:
+                # Mensagem inválida: o callback trata o erro
+                chave = None
+
+        trava = None
+        if chave is not None:
+            trava, usos = self._ordem.get(chave, (asyncio.Lock(), 0))
+            self._ordem[chave] = (trava, usos + 1)
+            await trava.acquire()
+        try:
+            async with sessao.semaforo:
+                canal = CanalThreadsafe(self._loop.call_soon_threadsafe,
+                                        sessao.canal)
+                if consumidor.tamanho_lote > 1:
+                    args, lote = (canal, mensagem), mensagem
+                else:
+                    args, lote = (canal, *mensagem), [mensagem]
+                try:
+                    await self._loop.run_in_executor(
+                        self._executor, consumidor.callback, *args)
+                except Exception as e:
+                    # Sem ack, a mensagem ocuparia um lugar do prefetch até
+                    # o canal fechar: as que o callback não confirmou vão
+                    # para a DLQ da fila
+                    self._log(f"Erro não tratado no callback: {e}")
+                    for method, _, _ in lote:
+                        if not canal.liquidada(method.delivery_tag):
+                            canal.basic_nack(
+                                delivery_tag=method.delivery_tag,
+                                requeue=False)
+        finally:
+            if trava is not None:
+                trava.release()
+                trava, usos = self._ordem[chave]
+                if usos == 1:
+                    del self._ordem[chave]
+                else:
+                    self._ordem[chave] = (trava, usos - 1)
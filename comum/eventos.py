@@ -0,0 +1,143 @@
+"""Distribuição de eventos para clientes conectados via Server-Sent Events."""
+import json
+import queue
+import threading
+import time
+
+
+class Assinatura:
+    """Fila de eventos de um cliente conectado."""
+
+    def __init__(self, tamanho):
+        self.fila = queue.Queue(maxsize=tamanho)
+        self.ativa = True
+
+
+class Difusor:
+    """
+    Repassa cada evento publicado para todas as assinaturas ativas.
+
+    Um cliente lento que deixa a própria fila encher é desconectado em vez
+    de atrasar os demais; o EventSource do navegador reconecta sozinho e
+    recupera o que perdeu pelo cabeçalho Last-Event-ID.
+    """
+
+    def __init__(self, tamanho_fila=256):
+        self.tamanho_fila = tamanho_fila
+        self._assinaturas = set()
+        self._lock = threading.Lock()
+
+    def assinar(self):
+        assinatura = Assinatura(self.tamanho_fila)
+        with self._lock:
+            self._assinaturas.add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        assinatura.ativa = False
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+    def publicar(self, evento):
+        with self._lock:
+            assinaturas = list(self._assinaturas)
+
+        for assinatura in assinaturas:
+            try:
+                assinatura.fila.put_nowait(evento)
+            except queue.Full:
+                self.cancelar(assinatura)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._assinaturas)
+
+
+class MonitorEventos:
+    """
+    Lê uma tabela de eventos do banco e repassa os novos a um Difusor.
+
+    Os eventos são gravados no banco por qualquer processo (consumer, outras
+    réplicas ou workers da API); cada processo que serve SSE roda uma única
+    thread de monitor, iniciada na primeira conexão. `ultimo_id()` e
+    `listar(apos_id)` vêm do database.py do serviço; `limpar()`, se
+    informado, apaga os eventos antigos a cada `ciclos_limpeza` leituras.
+    """
+
+    def __init__(self, difusor, ultimo_id, listar, limpar=None, intervalo=0.5,
+                 ciclos_limpeza=1200, nome='API'):
+        self.difusor = difusor
+        self.ultimo_id = ultimo_id
+        self.listar = listar
+        self.limpar = limpar
+        self.intervalo = intervalo
+        self.ciclos_limpeza = ciclos_limpeza
+        self.nome = nome
+        self._lock = threading.Lock()
+        self._iniciado = False
+
+    def executar(self):
+        """Acompanha a tabela de eventos e publica os novos no difusor."""
+        ultimo_id = self.ultimo_id()
+        ciclos = 0
+
+        while True:
+            try:
+                for evento in self.listar(ultimo_id):
+                    self.difusor.publicar(evento)
+                    ultimo_id = evento['id']
+
+                ciclos += 1
+                if self.limpar is not None and \
+                        ciclos % self.ciclos_limpeza == 0:
+                    self.limpar()
+            except Exception as e:
+                print(f"[{self.nome}] Erro ao ler eventos: {e}", flush=True)
+
+            time.sleep(self.intervalo)
+
+    def iniciar(self):
+        """Inicia a thread do monitor (apenas uma por processo)."""
+        with self._lock:
+            if not self._iniciado:
+                threading.Thread(target=self.executar, daemon=True).start()
+                self._iniciado = True
+
+
+def formatar_sse(evento):
+    """Serializa um evento {'id', 'tipo', ...} no formato text/event-stream."""
+    return (f"id: {evento['id']}\n"
+            f"event: {evento['tipo']}\n"
+            f"data: {json.dumps(evento, default=str)}\n\n")
+
+
+def transmitir_sse(difusor, assinatura, pendentes=(), keepalive=15):
+    """
+    Gera o corpo de uma resposta SSE.
+
+    Envia primeiro os eventos `pendentes` (recuperados do banco para um
+    cliente que está reconectando) e depois os que chegarem na assinatura,
+    ignorando os que já foram enviados. Comentários de keepalive mantêm a
+    conexão aberta através de proxies e detectam clientes desconectados.
+    """
+    ultimo_id = None
+    try:
+        yield 'retry: 3000\n\n'
+
+        for evento in pendentes:
+            ultimo_id = evento['id']
+            yield formatar_sse(evento)
+
+        while assinatura.ativa:
+            try:
+                evento = assinatura.fila.get(timeout=keepalive)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+
+            if ultimo_id is not None and evento['id'] <= ultimo_id:
+                continue
+            ultimo_id = evento['id']
+            yield formatar_sse(evento)
+    finally:
+        difusor.cancelar(assinatura)
@@ -0,0 +1,47 @@
+"""
+Configuração do Gunicorn compartilhada pelas APIs (caixa, cozinha_api e
+estoque_api).
+
+Uso, no diretório do serviço (no contêiner, /app):
+    gunicorn -c comum/gunicorn_conf.py app:app      # caixa
+    gunicorn -c comum/gunicorn_conf.py api:app      # cozinha_api, estoque_api
+
+Variáveis de ambiente:
+    WEB_PORTA    porta (padrão 5000)
+    WEB_WORKERS  processos (padrão: número de CPUs)
+    WEB_THREADS  threads por processo (padrão 32)
+    WEB_TIMEOUT  segundos sem resposta do worker antes de reiniciá-lo
+    WEB_ACCESSLOG  destino do log de acesso (padrão '-', stdout; vazio
+                   desliga)
+
+Os workers são gthread: cada stream SSE aberto (/pedidos/eventos,
+/fila/eventos) ocupa uma thread enquanto o navegador está conectado, então
+WEB_WORKERS * WEB_THREADS precisa cobrir as telas abertas mais as
+requisições simultâneas. Os consumers do RabbitMQ não rodam aqui: cada
+serviço tem o seu processo de consumer.
+"""
+import importlib
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('WEB_PORTA', '5000')}"
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('WEB_THREADS', '32'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('WEB_TIMEOUT', '30'))
+graceful_timeout = 10
+keepalive = 5
+accesslog = os.environ.get('WEB_ACCESSLOG', '-') or None
+errorlog = '-'
+
+
+def on_starting(server):
+    """
+    Cria tabelas e dados iniciais uma vez, no master, antes dos workers.
+
+    Sem isso todos os workers rodariam o init_db ao mesmo tempo e dois
+    poderiam inserir o cardápio/ingredientes iniciais. Cada worker ainda
+    chama init_db ao importar a aplicação, mas aí só confirma o que existe.
+    As conexões abertas aqui não passam para os workers (ver BancoSQLite).
+    """
+    importlib.import_module('database').init_db()
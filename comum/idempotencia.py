@@ -0,0 +1,104 @@
+"""Deduplicação de mensagens para consumo at-least-once do RabbitMQ."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class MensagemDuplicada(Exception):
+    """A mensagem já foi processada; quem consome só precisa do ack."""
+
+
+def chave_mensagem(properties, *partes):
+    """
+    Monta a chave de deduplicação de uma mensagem.
+
+    Usa as `partes` (ex. 'pedido', pedido_id) quando todas estão presentes,
+    senão o message_id da mensagem. Retorna None se não houver como
+    identificar a mensagem (ela é processada sem deduplicação).
+    """
+    if partes and all(parte is not None for parte in partes):
+        return ':'.join(str(parte) for parte in partes)
+    return getattr(properties, 'message_id', None)
+
+
+class Deduplicador:
+    """
+    Registro das mensagens já processadas, em uma tabela SQLite do serviço.
+
+    registrar() grava a chave na mesma transação que aplica a mensagem: se
+    a transação for desfeita, a chave também é, e se a chave já existir a
+    mensagem é uma reentrega e nada é aplicado. As chaves mais recentes
+    ficam num LRU em memória para recusar reentregas sem ir ao banco, e as
+    mais antigas que `ttl` segundos são apagadas periodicamente.
+    """
+
+    def __init__(self, tabela='mensagens_processadas', ttl=7 * 24 * 3600,
+                 tamanho_cache=10000, intervalo_limpeza=1000):
+        self.tabela = tabela
+        self.ttl = ttl
+        self.tamanho_cache = tamanho_cache
+        self.intervalo_limpeza = intervalo_limpeza
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._registros = 0
+
+    def criar_tabela(self, cursor):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.tabela} (
+                chave TEXT PRIMARY KEY,
+                data_processamento INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{self.tabela}_data
+            ON {self.tabela}(data_processamento)
+        ''')
+
+    def _em_cache(self, chave):
+        with self._lock:
+            if chave in self._cache:
+                self._cache.move_to_end(chave)
+                return True
+            return False
+
+    def lembrar(self, chave):
+        """Guarda no LRU uma chave já gravada (chamar após o commit)."""
+        if chave is None:
+            return
+        with self._lock:
+            self._cache[chave] = True
+            self._cache.move_to_end(chave)
+            while len(self._cache) > self.tamanho_cache:
+                self._cache.popitem(last=False)
+
+    def registrar(self, cursor, chave):
+        """
+        Marca `chave` como processada na transação de `cursor`.
+
+        Levanta MensagemDuplicada se ela já tiver sido processada. Sem
+        chave (None), não faz nada. Depois do commit, quem chamou deve
+        passar a chave para lembrar().
+        """
+        if chave is None:
+            return
+        if self._em_cache(chave):
+            raise MensagemDuplicada(chave)
+
+        cursor.execute(
+            f'INSERT OR IGNORE INTO {self.tabela} '
+            f'(chave, data_processamento) VALUES (?, ?)',
+            (chave, int(time.time())))
+        cursor.execute('SELECT changes()')
+        if cursor.fetchone()[0] == 0:
+            raise MensagemDuplicada(chave)
+
+        self._registros += 1
+        if self._registros % self.intervalo_limpeza == 0:
+            self.limpar(cursor)
+
+    def limpar(self, cursor):
+        """Apaga as chaves mais antigas que o TTL; retorna quantas."""
+        cursor.execute(
+            f'DELETE FROM {self.tabela} WHERE data_processamento < ?',
+            (int(time.time()) - self.ttl,))
+        return cursor.rowcount
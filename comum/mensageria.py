@@ -0,0 +1,391 @@
+"""Publicação de mensagens no RabbitMQ com conexões reaproveitadas."""
+import copy
+import functools
+import queue
+import threading
+from concurrent.futures import Future
+
+import pika
+
+from comum.codec import codec_padrao
+
+# Erros que indicam conexão/canal inutilizável: a conexão é descartada e
+# a publicação é refeita em uma conexão nova.
+ERROS_CONEXAO = (
+    pika.exceptions.AMQPConnectionError,
+    pika.exceptions.AMQPChannelError,
+    pika.exceptions.ConnectionWrongStateError,
+    pika.exceptions.ChannelWrongStateError,
+    pika.exceptions.StreamLostError,
+)
+
+
+
+class PublicacaoRecusada(Exception):
+    """O broker respondeu basic.nack para a mensagem."""
+
+
+class PublicacaoDevolvida(PublicacaoRecusada):
+    """A mensagem (mandatory) não foi roteada para nenhuma fila."""
+
+
+def _serializar(codec, mensagem, propriedades):
+    """
+    Codifica `mensagem` e marca o formato no content_type.
+
+    str e bytes já estão codificados e seguem como vieram (com o
+    content_type que o chamador informou).
+    """
+    if isinstance(mensagem, (bytes, str)):
+        return mensagem, propriedades
+    propriedades = copy.copy(propriedades or pika.BasicProperties())
+    propriedades.content_type = codec.content_type
+    return codec.codificar(mensagem), propriedades
+
+
+class Publicador:
+    """
+    Publica mensagens em uma exchange mantendo conexões abertas.
+
+    A BlockingConnection do pika não é thread-safe, então cada conexão é
+    emprestada a uma thread por vez e devolvida ao pool após o publish.
+    As conexões são abertas sob demanda (no máximo `tamanho_pool`) e a
+    exchange é declarada uma única vez, quando a conexão é criada. Se uma
+    conexão cair, ela é descartada e a mensagem é reenviada em uma nova.
+
+    Com `confirmar=True` os canais usam publisher confirms: publicar() só
+    retorna depois que o broker confirma a mensagem e levanta
+    pika.exceptions.NackError se ela for recusada.
+
+    Mensagens dict são codificadas com `codec` (padrão: CODEC_MENSAGENS,
+    ver comum.codec).
+
+    Os serviços publicam pelo PublicadorAssincrono; este publicador fica
+    como a base de comparação dos benchmarks (bench_publicador,
+    bench_confirms).
+    """
+
+    def __init__(self, exchange, exchange_type='fanout', host='rabbitmq',
+                 tamanho_pool=4, confirmar=False, codec=None):
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.confirmar = confirmar
+        self.codec = codec or codec_padrao()
+        self.parametros = pika.ConnectionParameters(host)
+        self._livres = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(tamanho_pool)
+
+    def _conectar(self):
+        connection = pika.BlockingConnection(self.parametros)
+        try:
+            channel = connection.channel()
+            channel.exchange_declare(
+                exchange=self.exchange, exchange_type=self.exchange_type)
+            if self.confirmar:
+                channel.confirm_delivery()
+        except Exception:
+            self._fechar(connection)
+            raise
+        return connection, channel
+
+    def _emprestar(self):
+        self._vagas.acquire()
+        try:
+            while True:
+                try:
+                    connection, channel = self._livres.get_nowait()
+                except queue.Empty:
+                    return self._conectar()
+                if connection.is_open and channel.is_open:
+                    return connection, channel
+                self._fechar(connection)
+        except Exception:
+            self._vagas.release()
+            raise
+
+    def _devolver(self, conexao, valida=True):
+        if valida:
+            self._livres.put(conexao)
+        else:
+            self._fechar(conexao[0])
+        self._vagas.release()
+
+    @staticmethod
+    def _fechar(connection):
+        try:
+            if connection.is_open:
+                connection.close()
+        except Exception:
+            pass
+
+    def publicar(self, mensagem, routing_key='', propriedades=None):
+        """Publica `mensagem` (dict, str ou bytes) na exchange configurada."""
+        body, propriedades = _serializar(self.codec, mensagem, propriedades)
+
+        for tentativa in range(2):
+            conexao = self._emprestar()
+            try:
+                conexao[1].basic_publish(
+                    exchange=self.exchange,
+                    routing_key=routing_key,
+                    body=body,
+                    properties=propriedades
+                )
+            except ERROS_CONEXAO:
+                self._devolver(conexao, valida=False)
+                if tentativa:
+                    raise
+            except Exception:
+                self._devolver(conexao, valida=False)
+                raise
+            else:
+                self._devolver(conexao)
+                return
+
+    def fechar(self):
+        """Fecha todas as conexões ociosas do pool."""
+        while True:
+            try:
+                connection, _ = self._livres.get_nowait()
+            except queue.Empty:
+                return
+            self._fechar(connection)
+
+
+class PublicadorAssincrono:
+    """
+    Publica com publisher confirms mantendo várias mensagens em voo.
+
+    Uma thread própria roda a SelectConnection do pika; publicar() só agenda
+    o envio nessa thread e devolve um Future, resolvido quando o broker
+    confirma a mensagem (basic.ack) ou com PublicacaoRecusada /
+    PublicacaoDevolvida quando ela é recusada ou, com `mandatory=True`, não
+    encontra fila. Os confirms são associados às mensagens pelo delivery
+    tag, inclusive os que confirmam várias de uma vez (multiple=True), então
+    o custo de um round-trip é dividido por todas as mensagens em voo em vez
+    de ser pago por mensagem.
+
+    No máximo `limite_em_voo` mensagens ficam sem confirmação; além disso
+    publicar() bloqueia até alguma ser confirmada. Se a conexão cair, os
+    Futures pendentes falham e a próxima publicação abre outra conexão.
+    Mensagens dict são codificadas com `codec`, como no Publicador.
+    """
+
+    def __init__(self, exchange, exchange_type='fanout', host='rabbitmq',
+                 limite_em_voo=1000, mandatory=False, timeout_conexao=10,
+                 codec=None):
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.codec = codec or codec_padrao()
+        self.parametros = pika.ConnectionParameters(host)
+        self.mandatory = mandatory
+        self.timeout_conexao = timeout_conexao
+        self._vagas = threading.BoundedSemaphore(limite_em_voo)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._ativa = False
+        self._pronto = None
+        self._erro = None
+        self._conexao = None
+        self._canal = None
+        # Estado abaixo só é alterado pela thread da conexão
+        self._proxima_tag = 1
+        self._pendentes = {}
+        self._devolvidas = set()
+        self._agendados = set()
+
+    # --- Thread da conexão -------------------------------------------------
+
+    def _executar(self):
+        try:
+            self._conexao = pika.SelectConnection(
+                self.parametros,
+                on_open_callback=self._ao_abrir,
+                on_open_error_callback=self._ao_falhar,
+                on_close_callback=self._ao_fechar
+            )
+            self._conexao.ioloop.start()
+        except Exception as e:
+            self._erro = e
+        finally:
+            self._canal = None
+            erro = self._erro or pika.exceptions.AMQPConnectionError(
+                'Conexão com o RabbitMQ encerrada')
+            with self._lock:
+                self._ativa = False
+                agendados, self._agendados = self._agendados, set()
+            self._falhar(list(self._pendentes.values()) + list(agendados),
+                         erro)
+            self._pendentes.clear()
+            self._pronto.set()
+
+    def _ao_abrir(self, conexao):
+        conexao.channel(on_open_callback=self._ao_abrir_canal)
+
+    def _ao_falhar(self, conexao, erro):
+        self._erro = erro
+        conexao.ioloop.stop()
+
+    def _ao_fechar(self, conexao, motivo):
+        self._erro = motivo
+        conexao.ioloop.stop()
+
+    def _ao_abrir_canal(self, canal):
+        canal.add_on_close_callback(self._ao_fechar_canal)
+        canal.add_on_return_callback(self._ao_devolver)
+        canal.exchange_declare(
+            exchange=self.exchange, exchange_type=self.exchange_type,
+            callback=lambda _: canal.confirm_delivery(
+                self._ao_confirmar,
+                callback=lambda _: self._ao_ativar(canal)))
+
+    def _ao_ativar(self, canal):
+        self._proxima_tag = 1
+        self._canal = canal
+        self._pronto.set()
+
+    def _ao_fechar_canal(self, canal, motivo):
+        self._canal = None
+        self._erro = motivo
+        if self._conexao.is_open:
+            self._conexao.close()
+
+    def _ao_devolver(self, canal, method, properties, body):
+        tag = (properties.headers or {}).get('x-publicacao')
+        if tag is not None:
+            self._devolvidas.add(tag)
+
+    def _ao_confirmar(self, frame):
+        metodo = frame.method
+        tag = metodo.delivery_tag
+        confirmada = isinstance(metodo, pika.spec.Basic.Ack)
+
+        if metodo.multiple:
+            # _pendentes está em ordem crescente de tag
+            tags = []
+            for pendente in self._pendentes:
+                if pendente > tag:
+                    break
+                tags.append(pendente)
+        else:
+            tags = [tag]
+
+        for t in tags:
+            futuro = self._pendentes.pop(t, None)
+            if futuro is None:
+                continue
+            if t in self._devolvidas:
+                self._devolvidas.discard(t)
+                futuro.set_exception(PublicacaoDevolvida(
+                    f"Mensagem {t} sem fila de destino em '{self.exchange}'"))
+            elif confirmada:
+                futuro.set_result(t)
+            else:
+                futuro.set_exception(PublicacaoRecusada(
+                    f"Mensagem {t} recusada pelo broker (basic.nack)"))
+
+    def _enviar(self, body, routing_key, propriedades, futuro):
+        with self._lock:
+            self._agendados.discard(futuro)
+
+        if self._canal is None:
+            futuro.set_exception(pika.exceptions.ChannelWrongStateError(
+                'Canal com o RabbitMQ fechado'))
+            return
+
+        tag = self._proxima_tag
+        self._proxima_tag += 1
+
+        if self.mandatory:
+            propriedades = copy.copy(propriedades or pika.BasicProperties())
+            propriedades.headers = dict(propriedades.headers or {},
+                                        **{'x-publicacao': tag})
+
+        self._pendentes[tag] = futuro
+        try:
+            self._canal.basic_publish(
+                exchange=self.exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=propriedades,
+                mandatory=self.mandatory
+            )
+        except Exception as e:
+            self._pendentes.pop(tag, None)
+            futuro.set_exception(e)
+
+    def _fechar_conexao(self):
+        if self._conexao is not None and self._conexao.is_open:
+            self._conexao.close()
+
+    @staticmethod
+    def _falhar(futuros, erro):
+        for futuro in futuros:
+            if not futuro.done():
+                futuro.set_exception(erro)
+
+    # --- Chamado pelas threads da aplicação --------------------------------
+
+    def _garantir_conexao(self):
+        with self._lock:
+            if not self._ativa:
+                if self._thread is not None:
+                    self._thread.join()
+                self._ativa = True
+                self._pronto = threading.Event()
+                self._erro = None
+                self._thread = threading.Thread(
+                    target=self._executar, daemon=True)
+                self._thread.start()
+            pronto = self._pronto
+
+        if not pronto.wait(self.timeout_conexao):
+            raise pika.exceptions.AMQPConnectionError(
+                'Tempo esgotado ao conectar ao RabbitMQ')
+        if self._canal is None:
+            raise self._erro or pika.exceptions.AMQPConnectionError(
+                'Conexão com o RabbitMQ encerrada')
+        return self._conexao
+
+    def publicar(self, mensagem, routing_key='', propriedades=None):
+        """
+        Agenda a publicação de `mensagem` (dict, str ou bytes).
+
+        Retorna um concurrent.futures.Future com o delivery tag quando o
+        broker confirmar a mensagem, ou com a exceção se ela falhar.
+        """
+        body, propriedades = _serializar(self.codec, mensagem, propriedades)
+
+        self._vagas.acquire()
+        futuro = Future()
+        futuro.set_running_or_notify_cancel()
+        futuro.add_done_callback(lambda _: self._vagas.release())
+
+        try:
+            conexao = self._garantir_conexao()
+            with self._lock:
+                if not self._ativa:
+                    raise pika.exceptions.AMQPConnectionError(
+                        'Conexão com o RabbitMQ encerrada')
+                self._agendados.add(futuro)
+            conexao.ioloop.add_callback_threadsafe(functools.partial(
+                self._enviar, body, routing_key, propriedades, futuro))
+        except Exception as e:
+            with self._lock:
+                self._agendados.discard(futuro)
+            self._falhar([futuro], e)
+
+        return futuro
+
+    def fechar(self, timeout=5):
+        """Fecha a conexão depois de enviar o que já foi agendado."""
+        with self._lock:
+            conexao, thread = self._conexao, self._thread
+
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            conexao.ioloop.add_callback_threadsafe(self._fechar_conexao)
+        except Exception:
+            pass
+        thread.join(timeout)
@@ -0,0 +1,85 @@
+"""
+Estimativa de quantis em fluxo, sem guardar as amostras.
+
+SketchQuantis é um histograma com baldes em escala logarítmica (a ideia do
+DDSketch): cada valor incrementa o contador de um balde e o quantil é
+estimado a partir dos contadores com erro relativo limitado. Dois sketches
+com o mesmo erro se combinam somando os contadores balde a balde, então
+janelas de tempo diferentes (minutos, horas, dias) podem ser guardadas
+separadas e somadas na consulta.
+"""
+import math
+
+# Balde dos valores iguais a zero (ou negativos), que não têm logaritmo
+INDICE_ZERO = -(2 ** 31)
+
+
+class SketchQuantis:
+    """
+    Sketch de quantis com erro relativo `erro`.
+
+    O valor v > 0 cai no balde i = ceil(log(v) / log(gama)), com
+    gama = (1 + erro) / (1 - erro), e o balde é representado por
+    2 * gama**i / (gama + 1): qualquer quantil devolvido fica a no máximo
+    `erro` (relativo) de um valor que realmente estava na amostra. Para
+    tempos entre 1 s e 24 h com erro de 1% são no máximo ~570 baldes.
+    """
+
+    def __init__(self, erro=0.01, baldes=None):
+        if not 0 < erro < 1:
+            raise ValueError("erro deve estar entre 0 e 1")
+        self.erro = erro
+        self.gama = (1 + erro) / (1 - erro)
+        self._log_gama = math.log(self.gama)
+        self.baldes = dict(baldes or {})
+
+    def indice(self, valor):
+        """Balde em que `valor` é contado."""
+        if valor <= 0:
+            return INDICE_ZERO
+        return math.ceil(math.log(valor) / self._log_gama)
+
+    def valor(self, indice):
+        """Valor representante do balde `indice`."""
+        if indice == INDICE_ZERO:
+            return 0.0
+        return 2 * self.gama ** indice / (self.gama + 1)
+
+    def adicionar(self, valor, quantidade=1):
+        indice = self.indice(valor)
+        self.baldes[indice] = self.baldes.get(indice, 0) + quantidade
+
+    def mesclar(self, outro):
+        """Soma os contadores de `outro` (mesmo erro) a este sketch."""
+        if outro.gama != self.gama:
+            raise ValueError("sketches com erros diferentes não se combinam")
+        for indice, quantidade in outro.baldes.items():
+            self.baldes[indice] = self.baldes.get(indice, 0) + quantidade
+
+    @property
+    def quantidade(self):
+        return sum(self.baldes.values())
+
+    def quantil(self, q):
+        """Estimativa do quantil `q` (0 a 1); None se o sketch estiver vazio."""
+        return self.quantis((q,))[q]
+
+    def quantis(self, qs):
+        """{q: estimativa} para cada `q`, numa única passada pelos baldes."""
+        total = self.quantidade
+        if total == 0:
+            return {q: None for q in qs}
+
+        ordenados = sorted(self.baldes.items())
+        resultado = {}
+        for q in sorted(qs):
+            if not 0 <= q <= 1:
+                raise ValueError(f"quantil fora de [0, 1]: {q}")
+            posicao = q * (total - 1)
+            acumulado = 0
+            for indice, quantidade in ordenados:
+                acumulado += quantidade
+                if acumulado > posicao:
+                    resultado[q] = self.valor(indice)
+                    break
+        return resultado
@@ -1,6 +1,11 @@
+
+from datetime import datetime
+
 import database as db
+from comum.eventos import Difusor, MonitorEventos, transmitir_sse
 from flasgger import Swagger
-from flask import Flask, jsonify, request, send_from_directory
+from flask import (Flask, Response, jsonify, request, send_from_directory,
+                   stream_with_context)
 from flask_cors import CORS
 
 app = Flask(__name__, static_folder='static')
@@ -9,6 +14,15 @@ swagger = Swagger(app)
 
 db.init_db()
 
+# Eventos da fila (gravados em eventos_cozinha pelo consumer e pela própria
+# API) são lidos por uma única thread e repassados a todas as telas
+# conectadas em /fila/eventos.
+INTERVALO_EVENTOS = 0.5
+difusor_fila = Difusor()
+monitor_fila = MonitorEventos(
+    difusor_fila, db.ultimo_evento_id, db.listar_eventos, db.limpar_eventos,
+    intervalo=INTERVALO_EVENTOS, nome='COZINHA API')
+
 
 @app.route('/fila', methods=['GET'])
 def listar_fila():
@@ -28,12 +42,55 @@ def listar_fila():
             "total_fila": len(fila),
             "recebidos": len(recebidos),
             "preparando": len(preparando),
+            "ultimo_evento_id": db.ultimo_evento_id(),
             "pedidos": fila
         }), 200
     except Exception as e:
         return jsonify({"erro": str(e)}), 500
 
 
+@app.route('/fila/eventos', methods=['GET'])
+def eventos_fila():
+    """
+    Stream (Server-Sent Events) das mudanças na fila de preparação.
+    ---
+    parameters:
+      - name: desde
+        in: query
+        type: integer
+        required: false
+        description: Envia também os eventos posteriores a este id
+          (ultimo_evento_id de GET /fila). Em reconexões o cabeçalho
+          Last-Event-ID tem precedência.
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: Eventos recebido, iniciado, finalizado, cancelado e
+          arquivado (o pedido saiu da fila) e resync (recarregar a fila)
+    """
+    monitor_fila.iniciar()
+
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None:
+        desde = request.args.get('desde', type=int)
+
+    # Assinar antes de consultar o banco para não perder eventos no meio
+    assinatura = difusor_fila.assinar()
+    pendentes = []
+    if desde is not None:
+        pendentes = db.eventos_apos(desde)
+        if pendentes is None:
+            pendentes = [{'id': db.ultimo_evento_id(), 'tipo': 'resync'}]
+
+    return Response(
+        stream_with_context(
+            transmitir_sse(difusor_fila, assinatura, pendentes)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/pedidos/<status>', methods=['GET'])
 def listar_por_status(status):
     """
@@ -65,6 +122,42 @@ def listar_por_status(status):
         return jsonify({"erro": str(e)}), 500
 
 
+@app.route('/pedidos/caixa', methods=['GET'])
+def status_pedidos_caixa():
+    """
+    Status na cozinha de pedidos do caixa (usado na sincronização do caixa).
+    ---
+    parameters:
+      - name: ids
+        in: query
+        type: string
+        required: true
+        description: IDs de pedidos do caixa separados por vírgula
+          (ex. 1,2,3)
+    responses:
+      200:
+        description: Status do ticket mais recente de cada pedido
+      400:
+        description: IDs inválidos
+    """
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',')
+               if i.strip()]
+    except ValueError:
+        return jsonify({"erro": "IDs inválidos"}), 400
+
+    if len(ids) > 1000:
+        return jsonify({"erro": "Máximo de 1000 pedidos por consulta"}), 400
+
+    try:
+        status = db.status_por_pedido_caixa(ids)
+        return jsonify({
+            "status": {str(pedido_id): s for pedido_id, s in status.items()}
+        }), 200
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+
 @app.route('/pedidos/<int:cozinha_id>', methods=['GET'])
 def buscar_pedido(cozinha_id):
     """
@@ -91,6 +184,94 @@ def buscar_pedido(cozinha_id):
         return jsonify({"erro": str(e)}), 500
 
 
+@app.route('/arquivo', methods=['GET'])
+def listar_arquivo():
+    """
+    Lista pedidos arquivados (concluídos e retirados da fila), do mais
+    recente para o mais antigo.
+    ---
+    parameters:
+      - name: data
+        in: query
+        type: string
+        required: false
+        description: Dia da conclusão (YYYY-MM-DD)
+      - name: status
+        in: query
+        type: string
+        enum: ['PRONTO', 'CANCELADO']
+        required: false
+      - name: pedido_id
+        in: query
+        type: integer
+        required: false
+        description: ID do pedido no caixa
+      - name: antes_id
+        in: query
+        type: integer
+        required: false
+        description: Próxima página (valor de 'proximo' da resposta anterior)
+      - name: limit
+        in: query
+        type: integer
+        default: 50
+        description: Máximo de pedidos por página (até 500)
+    responses:
+      200:
+        description: Página de pedidos arquivados
+      400:
+        description: Data inválida
+    """
+    try:
+        dia = request.args.get('data')
+        if dia is not None:
+            try:
+                datetime.strptime(dia, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({"erro": "data deve estar no formato "
+                                        "YYYY-MM-DD"}), 400
+
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        pedidos = db.listar_arquivo(
+            dia=dia,
+            status=request.args.get('status'),
+            pedido_id=request.args.get('pedido_id', type=int),
+            antes_id=request.args.get('antes_id', type=int),
+            limit=limit
+        )
+        return jsonify({
+            "pedidos": pedidos,
+            "proximo": pedidos[-1]['id'] if len(pedidos) == limit else None
+        }), 200
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+
+@app.route('/arquivo/<int:cozinha_id>', methods=['GET'])
+def buscar_pedido_arquivado(cozinha_id):
+    """
+    Busca um pedido arquivado, com as suas linhas.
+    ---
+    parameters:
+      - name: cozinha_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: Dados do pedido arquivado
+      404:
+        description: Pedido não está no arquivo
+    """
+    try:
+        pedido = db.buscar_pedido_arquivado(cozinha_id)
+        if pedido:
+            return jsonify(pedido), 200
+        return jsonify({"erro": "Pedido não encontrado no arquivo"}), 404
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+
 @app.route('/pedidos/<int:cozinha_id>/iniciar', methods=['PUT'])
 def iniciar_preparo_endpoint(cozinha_id):
     """
@@ -180,6 +361,7 @@ def finalizar_pedido_endpoint(cozinha_id):
         return jsonify({
             "mensagem": "Pedido finalizado com sucesso",
             "tempo_total": dados_pedido['tempo_preparacao'],
+            "tempo_total_segundos": dados_pedido['tempo_preparo_segundos'],
             "pedido_id": dados_pedido['pedido_id'],
             "publicado_rabbitmq": publicado
         }), 200
@@ -250,10 +432,16 @@ def cancelar_pedido_endpoint(cozinha_id):
 def estatisticas():
     """
     Retorna estatísticas da cozinha.
+
+    Lidas de contadores materializados, atualizados a cada mudança na fila:
+    o custo não cresce com o histórico de pedidos.
     ---
     responses:
       200:
-        description: Estatísticas de operação
+        description: >
+          Pedidos por status e tempos de preparo (todo o período), totais
+          dos últimos 15 minutos e de hoje, e o dia corrente por hora e
+          por item
     """
     try:
         stats = db.estatisticas_cozinha()
@@ -262,6 +450,40 @@ def estatisticas():
         return jsonify({"erro": str(e)}), 500
 
 
+@app.route('/estatisticas/tempos', methods=['GET'])
+def estatisticas_tempos():
+    """
+    Retorna os quantis (p50, p90, p99) do tempo de preparo, em segundos.
+
+    Estimados por sketches mantidos a cada pedido finalizado, no geral e por
+    item, sem percorrer pedidos_cozinha. Um ticket com vários itens conta o
+    seu tempo para cada item.
+    ---
+    parameters:
+      - name: janela
+        in: query
+        type: string
+        enum: ['15min', 'hoje', 'total']
+        default: hoje
+        description: Período considerado
+    responses:
+      200:
+        description: Quantidade de amostras e quantis, geral e por item
+      400:
+        description: Janela inválida
+    """
+    try:
+        janela = request.args.get('janela', 'hoje')
+        if janela not in db.JANELAS_TEMPOS:
+            return jsonify({
+                "erro": "janela deve ser uma de: "
+                        + ", ".join(db.JANELAS_TEMPOS)
+            }), 400
+        return jsonify(db.quantis_preparo(janela)), 200
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
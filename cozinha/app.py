@@ -1,23 +1,60 @@
-import json
+import os
+import queue
+import threading
 import time
 
 import database as db
 import pika
+from comum.consumidor import (CanalThreadsafe, Consumidor, Exchange, Fila,
+                               RuntimeConsumidores, Topologia)
+from comum.codec import decodificar
+from comum.idempotencia import MensagemDuplicada, chave_mensagem
+from comum.mensageria import PublicadorAssincrono
 
 db.init_db()
 
+# Com COZINHA_WORKERS > 1 as mensagens são processadas em paralelo por um
+# pool de threads (ConsumidorPool); COZINHA_PREFETCH limita quantas ficam
+# entregues e ainda sem ack.
+WORKERS = int(os.environ.get('COZINHA_WORKERS', '1'))
+PREFETCH = int(os.environ.get('COZINHA_PREFETCH',
+                              str(WORKERS * 4 if WORKERS > 1 else 1)))
+
+# Com CONSUMIDOR_ASYNCIO=1 o consumer roda no runtime asyncio compartilhado
+# (comum.consumidor), com WORKERS mensagens em processamento e a mesma
+# ordem por pedido do ConsumidorPool.
+CONSUMIDOR_ASYNCIO = os.environ.get('CONSUMIDOR_ASYNCIO', '0') == '1'
+
+TOPOLOGIA = Topologia(
+    exchanges=[
+        Exchange('pedidos_dlx', durable=True),
+        Exchange('pedidos_exchange'),
+    ],
+    filas=[
+        Fila('pedidos_dlq_cozinha', exchanges=['pedidos_dlx']),
+        Fila('pedidos_cozinha_app',
+             argumentos={'x-dead-letter-exchange': 'pedidos_dlx'},
+             exchanges=['pedidos_exchange']),
+    ]
+)
+
+# Tickets PRONTO/CANCELADO concluídos há mais de COZINHA_ARQUIVAR_APOS
+# minutos saem de pedidos_cozinha para o histórico; a verificação roda a cada
+# COZINHA_ARQUIVAR_INTERVALO segundos, no processo do consumer.
+ARQUIVAR_APOS = int(os.environ.get('COZINHA_ARQUIVAR_APOS', '60'))
+ARQUIVAR_INTERVALO = float(os.environ.get('COZINHA_ARQUIVAR_INTERVALO', '300'))
+
+# Compartilhado pelas threads da API da cozinha (ver api.py), que publicam
+# as mudanças de status a cada clique na tela do chapeiro. Cada requisição
+# espera o confirm da sua mensagem, mas cliques simultâneos ficam em voo
+# juntos na mesma conexão.
+publicador_status = PublicadorAssincrono('pedidos_prontos_exchange')
+TIMEOUT_CONFIRMACAO = 5
+
 
 def publicar_status_pedido(pedido_id, cliente, item, status):
     """Publica atualização de status do pedido no RabbitMQ."""
     try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('rabbitmq'))
-        channel = connection.channel()
-
-        # Declarar exchange para atualizações de status
-        channel.exchange_declare(
-            exchange='pedidos_prontos_exchange', exchange_type='fanout')
-
         mensagem = {
             'pedido_caixa_id': pedido_id,
             'cliente': cliente,
@@ -25,13 +62,13 @@ def publicar_status_pedido(pedido_id, cliente, item, status):
             'status': status
         }
 
-        channel.basic_publish(
-            exchange='pedidos_prontos_exchange',
-            routing_key='',
-            body=json.dumps(mensagem)
-        )
+        # Persistente: fica na fila durável do caixa mesmo se o broker
+        # reiniciar antes do consumo
+        publicador_status.publicar(
+            mensagem,
+            propriedades=pika.BasicProperties(delivery_mode=2)
+        ).result(TIMEOUT_CONFIRMACAO)
 
-        connection.close()
         print(
             f"[COZINHA] Status '{status}' do pedido #{pedido_id} "
             f"publicado no RabbitMQ", flush=True)
@@ -59,19 +96,27 @@ def callback(ch, method, properties, body):
         retry_count = len(properties.headers['x-death'])
 
     try:
-        pedido = json.loads(body)
+        pedido = decodificar(properties, body)
         pedido_id = pedido.get('id')
         cliente = pedido.get('cliente')
         item = pedido.get('item')
         observacao = pedido.get('observacao')
 
+        # Pedidos com várias linhas: 'item' traz o resumo para a tela
+        itens = [(linha['item'], linha.get('quantidade', 1))
+                 for linha in pedido.get('itens') or []]
+        if itens and not item:
+            item = ', '.join(f"{qtd}x {nome}" for nome, qtd in itens)
+
         print(
             f"\n[COZINHA] Pedido #{pedido_id} recebido: {item} para {cliente}",
             flush=True)
         if observacao:
             print(f"          Observação: {observacao}", flush=True)
 
-        cozinha_id = db.registrar_pedido(pedido_id, cliente, item, observacao)
+        cozinha_id = db.registrar_pedido(
+            pedido_id, cliente, item, observacao, itens,
+            chave=chave_mensagem(properties, 'pedido', pedido_id))
 
         print(
             f"[COZINHA] Pedido #{pedido_id} registrado na fila "
@@ -79,6 +124,10 @@ def callback(ch, method, properties, body):
 
         ch.basic_ack(delivery_tag=method.delivery_tag)
 
+    except MensagemDuplicada:
+        print(f"[COZINHA] Pedido #{pedido_id} já registrado; reentrega "
+              f"ignorada", flush=True)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
     except Exception as e:
         print(f"[ERRO] Erro ao processar pedido na cozinha: {e}", flush=True)
 
@@ -94,8 +143,96 @@ def callback(ch, method, properties, body):
             ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
 
 
+def pedido_da_mensagem(properties, body):
+    """Chave de ordenação das mensagens: o id do pedido no caixa."""
+    return decodificar(properties, body).get('id')
+
+
+class ConsumidorPool:
+    """
+    Processa as mensagens em `workers` threads.
+
+    Cada worker tem a sua fila e as mensagens de um mesmo pedido_id vão
+    sempre para o mesmo worker, então chegam ao banco na ordem de entrega;
+    pedidos diferentes são processados em paralelo. O total em
+    processamento é limitado pelo prefetch do canal.
+    """
+
+    def __init__(self, connection, channel, workers):
+        self.canal = CanalThreadsafe(connection.add_callback_threadsafe,
+                                     channel)
+        self.filas = [queue.Queue() for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self._trabalhar, args=(fila,),
+                             daemon=True)
+            for fila in self.filas
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def on_message(self, ch, method, properties, body):
+        try:
+            pedido_id = pedido_da_mensagem(properties, body)
+        except Exception:
+            # Mensagem inválida: o callback trata o erro em qualquer worker
+            pedido_id = None
+        self.filas[hash(pedido_id) % len(self.filas)].put(
+            (method, properties, body))
+
+    def _trabalhar(self, fila):
+        while True:
+            mensagem = fila.get()
+            if mensagem is None:
+                return
+            callback(self.canal, *mensagem)
+
+    def parar(self):
+        """Termina os workers depois das mensagens já enfileiradas."""
+        for fila in self.filas:
+            fila.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def runtime_consumidor():
+    """Runtime asyncio do consumer de pedidos (ainda não iniciado)."""
+    return RuntimeConsumidores(
+        TOPOLOGIA,
+        [Consumidor('pedidos_cozinha_app', callback, prefetch=PREFETCH,
+                    concorrencia=WORKERS, chave_ordem=pedido_da_mensagem)],
+        nome='COZINHA'
+    )
+
+
+def iniciar_consumidor_asyncio():
+    """Consome os pedidos no runtime asyncio compartilhado."""
+    print("[COZINHA] Conectando ao RabbitMQ (asyncio)...", flush=True)
+    runtime_consumidor().executar()
+
+
+def arquivar_periodicamente():
+    while True:
+        try:
+            arquivados = db.arquivar_pedidos(ARQUIVAR_APOS)
+            if arquivados:
+                print(f"[COZINHA] {arquivados} pedidos movidos para o "
+                      f"histórico", flush=True)
+        except Exception as e:
+            print(f"[COZINHA] Erro ao arquivar pedidos: {e}", flush=True)
+        time.sleep(ARQUIVAR_INTERVALO)
+
+
+def iniciar_arquivamento():
+    """Inicia a thread que arquiva os pedidos concluídos."""
+    threading.Thread(target=arquivar_periodicamente, daemon=True,
+                     name='arquivamento').start()
+
+
 def iniciar_consumidor():
     """Inicia o consumidor de mensagens do RabbitMQ."""
+    if CONSUMIDOR_ASYNCIO:
+        return iniciar_consumidor_asyncio()
+
     print("[COZINHA] Conectando ao RabbitMQ...", flush=True)
 
     while True:
@@ -104,51 +241,32 @@ def iniciar_consumidor():
                 pika.ConnectionParameters('rabbitmq'))
             channel = connection.channel()
 
-            # Declarar Dead Letter Exchange para pedidos
-            channel.exchange_declare(
-                exchange='pedidos_dlx',
-                exchange_type='fanout',
-                durable=True
-            )
-
-            # Declarar Dead Letter Queue
-            channel.queue_declare(
-                queue='pedidos_dlq_cozinha',
-                durable=True
-            )
-
-            # Bind DLQ ao DLX
-            channel.queue_bind(
-                exchange='pedidos_dlx',
-                queue='pedidos_dlq_cozinha'
-            )
-
-            # Declarar exchange principal
-            channel.exchange_declare(
-                exchange='pedidos_exchange', exchange_type='fanout')
-
-            # Criar fila com DLX
-            channel.queue_declare(
-                queue='pedidos_cozinha_app',
-                exclusive=False,
-                durable=True,
-                arguments={
-                    'x-dead-letter-exchange': 'pedidos_dlx',
-                }
-            )
+            # Exchanges, DLQ e fila de pedidos com DLX
+            TOPOLOGIA.declarar(channel)
             queue_name = 'pedidos_cozinha_app'
 
-            channel.queue_bind(exchange='pedidos_exchange', queue=queue_name)
-
             print('[COZINHA] ✓ Conectado! Aguardando pedidos...', flush=True)
             print('[COZINHA] DLQ configurada: pedidos_dlq_cozinha', flush=True)
 
-            # Processar uma mensagem por vez para garantir confiabilidade
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(
-                queue=queue_name, on_message_callback=callback, auto_ack=False)
+            pool = None
+            if WORKERS > 1:
+                print(f'[COZINHA] Modo pool: {WORKERS} workers, '
+                      f'prefetch {PREFETCH}', flush=True)
+                pool = ConsumidorPool(connection, channel, WORKERS)
+                on_message = pool.on_message
+            else:
+                on_message = callback
 
-            channel.start_consuming()
+            channel.basic_qos(prefetch_count=PREFETCH)
+            channel.basic_consume(
+                queue=queue_name, on_message_callback=on_message,
+                auto_ack=False)
+
+            try:
+                channel.start_consuming()
+            finally:
+                if pool is not None:
+                    pool.parar()
             break
 
         except pika.exceptions.AMQPConnectionError as e:
@@ -161,4 +279,5 @@ def iniciar_consumidor():
 
 
 if __name__ == '__main__':
+    iniciar_arquivamento()
     iniciar_consumidor()
@@ -1,23 +1,51 @@
-import sqlite3
-from contextlib import contextmanager
+import itertools
+
+from comum.banco import BancoSQLite
+from comum.idempotencia import Deduplicador
+from comum.quantis import SketchQuantis
 
 DATABASE_PATH = 'cozinha.db'
 FUSO_BRASILIA = '-03:00'
+banco = BancoSQLite(DATABASE_PATH)
+dedup = Deduplicador()
+
+# Escalas das janelas de estatísticas: (escala, formato do início). A escala
+# 'total' tem uma linha só; as de minuto servem à janela dos últimos 15
+# minutos e são apagadas depois de MINUTOS_ESTATISTICAS.
+ESCALAS_ESTATISTICAS = (
+    ('total', None),
+    ('hora', '%Y-%m-%d %H'),
+    ('minuto', '%Y-%m-%d %H:%M'),
+)
+MINUTOS_ESTATISTICAS = 120
+INTERVALO_LIMPEZA_ESTATISTICAS = 500
+
+# Quantis dos tempos de preparo (segundos): erro relativo do sketch, quantis
+# informados e janelas consultáveis -> (escala, início em SQL)
+ERRO_QUANTIS = 0.01
+QUANTIS_PREPARO = (0.5, 0.9, 0.99)
+JANELAS_TEMPOS = {
+    '15min': ('minuto', "strftime('%Y-%m-%d %H:%M', 'now', "
+                        f"'{FUSO_BRASILIA}', '-14 minutes')"),
+    'hoje': ('hora', f"date('now', '{FUSO_BRASILIA}')"),
+    'total': ('total', "''"),
+}
+DIAS_TEMPOS_POR_HORA = 30
+
+# Tickets concluídos vão para pedidos_cozinha_historico (arquivar_pedidos),
+# então pedidos_cozinha guarda só a fila ativa e os concluídos recentes.
+COLUNAS_PEDIDO = (
+    'id, pedido_id, cliente, item, observacao, status, tempo_preparacao, '
+    'data_recebimento, data_inicio_preparo, data_conclusao, '
+    'tempo_preparo_segundos'
+)
+LIMITE_FILA = 100
+_registros = itertools.count(1)
 
 
-@contextmanager
 def get_db_connection():
     """Context manager para conexão com o banco de dados."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    return banco.conexao()
 
 
 def init_db():
@@ -35,56 +63,468 @@ def init_db():
                 tempo_preparacao INTEGER DEFAULT 0,
                 data_recebimento TIMESTAMP,
                 data_inicio_preparo TIMESTAMP,
-                data_conclusao TIMESTAMP
+                data_conclusao TIMESTAMP,
+                tempo_preparo_segundos INTEGER
             )
         ''')
         cursor.execute(
             'CREATE INDEX IF NOT EXISTS idx_status ON pedidos_cozinha(status)')
-        print("[DB] Banco de dados da Cozinha inicializado com sucesso!")
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_pedido_caixa '
+            'ON pedidos_cozinha(pedido_id)')
+        # Índices parciais: a fila ativa e os concluídos (candidatos ao
+        # arquivamento) não passam pelas linhas um do outro
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pedidos_ativos
+            ON pedidos_cozinha(data_recebimento)
+            WHERE status IN ('RECEBIDO', 'PREPARANDO')
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pedidos_concluidos
+            ON pedidos_cozinha(data_conclusao)
+            WHERE status IN ('PRONTO', 'CANCELADO')
+        ''')
+
+        # Linhas de cada pedido (um ticket pode ter vários itens)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS itens_pedido_cozinha (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cozinha_id INTEGER NOT NULL,
+                item VARCHAR(100) NOT NULL,
+                quantidade INTEGER NOT NULL DEFAULT 1,
+                FOREIGN KEY (cozinha_id) REFERENCES pedidos_cozinha(id)
+            )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_itens_pedido_cozinha '
+            'ON itens_pedido_cozinha(cozinha_id)')
+
+        # Histórico: tickets concluídos retirados de pedidos_cozinha
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pedidos_cozinha_historico (
+                id INTEGER PRIMARY KEY,
+                pedido_id INTEGER NOT NULL,
+                cliente VARCHAR(100) NOT NULL,
+                item VARCHAR(100) NOT NULL,
+                observacao TEXT,
+                status VARCHAR(20) NOT NULL,
+                tempo_preparacao INTEGER DEFAULT 0,
+                data_recebimento TIMESTAMP,
+                data_inicio_preparo TIMESTAMP,
+                data_conclusao TIMESTAMP,
+                tempo_preparo_segundos INTEGER,
+                data_arquivamento TIMESTAMP NOT NULL
+            )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_historico_conclusao '
+            'ON pedidos_cozinha_historico(data_conclusao)')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_historico_pedido_caixa '
+            'ON pedidos_cozinha_historico(pedido_id)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS itens_pedido_cozinha_historico (
+                id INTEGER PRIMARY KEY,
+                cozinha_id INTEGER NOT NULL,
+                item VARCHAR(100) NOT NULL,
+                quantidade INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_itens_historico '
+            'ON itens_pedido_cozinha_historico(cozinha_id)')
+
+        # Log de eventos da fila, lido pela API para o stream SSE da tela
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS eventos_cozinha (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo VARCHAR(20) NOT NULL,
+                cozinha_id INTEGER NOT NULL,
+                data_evento TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Estatísticas materializadas, atualizadas na mesma transação de
+        # cada mudança em pedidos_cozinha (ver _contabilizar)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS estatisticas_status (
+                status VARCHAR(20) PRIMARY KEY,
+                quantidade INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS estatisticas_janelas (
+                escala VARCHAR(10) NOT NULL,
+                inicio VARCHAR(16) NOT NULL,
+                recebidos INTEGER NOT NULL DEFAULT 0,
+                iniciados INTEGER NOT NULL DEFAULT 0,
+                prontos INTEGER NOT NULL DEFAULT 0,
+                cancelados INTEGER NOT NULL DEFAULT 0,
+                tempo_total INTEGER NOT NULL DEFAULT 0,
+                tempo_amostras INTEGER NOT NULL DEFAULT 0,
+                tempo_minimo INTEGER,
+                tempo_maximo INTEGER,
+                PRIMARY KEY (escala, inicio)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS estatisticas_itens (
+                dia DATE NOT NULL,
+                item VARCHAR(100) NOT NULL,
+                pedidos INTEGER NOT NULL DEFAULT 0,
+                unidades INTEGER NOT NULL DEFAULT 0,
+                prontas INTEGER NOT NULL DEFAULT 0,
+                canceladas INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dia, item)
+            ) WITHOUT ROWID
+        ''')
+        # Sketch dos tempos de preparo: contadores por balde de cada janela;
+        # item '' é o geral (ver comum/quantis.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tempos_preparo (
+                escala VARCHAR(10) NOT NULL,
+                inicio VARCHAR(16) NOT NULL,
+                item VARCHAR(100) NOT NULL,
+                balde INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (escala, inicio, item, balde)
+            ) WITHOUT ROWID
+        ''')
+        dedup.criar_tabela(cursor)
+
+    _migrar_tempo_segundos()
+    _reconstruir_estatisticas()
+    _analisar_fila()
+    print("[DB] Banco de dados da Cozinha inicializado com sucesso!")
 
 
-def registrar_pedido(pedido_id, cliente, item, observacao=None):
+def _registrar_evento(cursor, tipo, cozinha_id):
+    cursor.execute(
+        'INSERT INTO eventos_cozinha (tipo, cozinha_id) VALUES (?, ?)',
+        (tipo, cozinha_id))
+
+
+def _agora(cursor):
+    cursor.execute(f"SELECT datetime('now', '{FUSO_BRASILIA}')")
+    return cursor.fetchone()[0]
+
+
+def _status_atual(cursor, cozinha_id):
+    cursor.execute(
+        'SELECT status FROM pedidos_cozinha WHERE id = ?', (cozinha_id,))
+    row = cursor.fetchone()
+    return row['status'] if row else None
+
+
+def _itens_do_pedido(cursor, cozinha_id):
+    cursor.execute(
+        'SELECT item, SUM(quantidade) AS quantidade '
+        'FROM itens_pedido_cozinha WHERE cozinha_id = ? GROUP BY item',
+        (cozinha_id,))
+    return [(row['item'], row['quantidade']) for row in cursor.fetchall()]
+
+
+def _somar_linhas(itens):
+    """Junta linhas repetidas do mesmo item: [(item, quantidade total)]."""
+    soma = {}
+    for nome, quantidade in itens:
+        soma[nome] = soma.get(nome, 0) + quantidade
+    return list(soma.items())
+
+
+def _mudar_status(cursor, anterior, novo):
+    """Move um pedido de `anterior` (None se for novo) para `novo`."""
+    if anterior is not None:
+        cursor.execute(
+            'UPDATE estatisticas_status SET quantidade = quantidade - 1 '
+            'WHERE status = ?', (anterior,))
+    cursor.execute('''
+        INSERT INTO estatisticas_status (status, quantidade) VALUES (?, 1)
+        ON CONFLICT (status) DO UPDATE SET quantidade = quantidade + 1
+    ''', (novo,))
+
+
+def _contabilizar(cursor, momento, recebidos=0, iniciados=0, prontos=0,
+                  cancelados=0, tempo=None):
+    """
+    Soma um evento ocorrido em `momento` às janelas total, hora e minuto.
+
+    As janelas contam eventos (quantos pedidos chegaram, começaram, ficaram
+    prontos ou foram cancelados naquele intervalo), não o status atual, que
+    fica em estatisticas_status. `tempo` é o tempo de preparo de um pedido
+    finalizado; tempos nulos ou zero não entram nas médias, como antes.
+    """
+    amostras = 1 if tempo else 0
+    tempo = tempo or None
+    cursor.executemany('''
+        INSERT INTO estatisticas_janelas
+        (escala, inicio, recebidos, iniciados, prontos, cancelados,
+         tempo_total, tempo_amostras, tempo_minimo, tempo_maximo)
+        VALUES (?, COALESCE(strftime(?, ?), ''), ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (escala, inicio) DO UPDATE SET
+            recebidos = recebidos + excluded.recebidos,
+            iniciados = iniciados + excluded.iniciados,
+            prontos = prontos + excluded.prontos,
+            cancelados = cancelados + excluded.cancelados,
+            tempo_total = tempo_total + excluded.tempo_total,
+            tempo_amostras = tempo_amostras + excluded.tempo_amostras,
+            tempo_minimo = COALESCE(MIN(tempo_minimo, excluded.tempo_minimo),
+                                    tempo_minimo, excluded.tempo_minimo),
+            tempo_maximo = COALESCE(MAX(tempo_maximo, excluded.tempo_maximo),
+                                    tempo_maximo, excluded.tempo_maximo)
+    ''', [(escala, formato, momento, recebidos, iniciados, prontos,
+           cancelados, tempo or 0, amostras, tempo, tempo)
+          for escala, formato in ESCALAS_ESTATISTICAS])
+
+
+def _contabilizar_itens(cursor, momento, itens, pedidos=0, unidades=0,
+                        prontas=0, canceladas=0):
+    """
+    Soma as linhas `itens` [(item, quantidade)] ao dia de `momento`.
+
+    `unidades`, `prontas` e `canceladas` são flags: a coluna marcada recebe
+    a quantidade de cada linha.
+    """
+    cursor.executemany('''
+        INSERT INTO estatisticas_itens
+        (dia, item, pedidos, unidades, prontas, canceladas)
+        VALUES (date(?), ?, ?, ?, ?, ?)
+        ON CONFLICT (dia, item) DO UPDATE SET
+            pedidos = pedidos + excluded.pedidos,
+            unidades = unidades + excluded.unidades,
+            prontas = prontas + excluded.prontas,
+            canceladas = canceladas + excluded.canceladas
+    ''', [(momento, item, pedidos, quantidade * unidades,
+           quantidade * prontas, quantidade * canceladas)
+          for item, quantidade in itens])
+
+
+def _contabilizar_tempo(cursor, momento, segundos, itens):
+    """
+    Conta o tempo de preparo `segundos` no sketch geral e no de cada item.
+
+    Um ticket com vários itens conta o mesmo tempo para cada um deles.
+    """
+    balde = _sketch_vazio().indice(segundos)
+    cursor.executemany('''
+        INSERT INTO tempos_preparo (escala, inicio, item, balde, quantidade)
+        VALUES (?, COALESCE(strftime(?, ?), ''), ?, ?, 1)
+        ON CONFLICT (escala, inicio, item, balde) DO UPDATE SET
+            quantidade = quantidade + 1
+    ''', [(escala, formato, momento, item, balde)
+          for escala, formato in ESCALAS_ESTATISTICAS
+          for item in [''] + sorted({nome for nome, _ in itens})])
+
+
+def _sketch_vazio():
+    return SketchQuantis(ERRO_QUANTIS)
+
+
+def _limpar_estatisticas(cursor):
+    """
+    Apaga as janelas de minuto mais antigas que MINUTOS_ESTATISTICAS e os
+    sketches por hora mais antigos que DIAS_TEMPOS_POR_HORA.
+    """
+    limite_minuto = (f"strftime('%Y-%m-%d %H:%M', 'now', '{FUSO_BRASILIA}', "
+                     f"'-{MINUTOS_ESTATISTICAS} minutes')")
+    cursor.execute(
+        "DELETE FROM estatisticas_janelas "
+        f"WHERE escala = 'minuto' AND inicio < {limite_minuto}")
+    removidas = cursor.rowcount
+    cursor.execute(
+        "DELETE FROM tempos_preparo "
+        f"WHERE escala = 'minuto' AND inicio < {limite_minuto}")
+    removidas += cursor.rowcount
+    cursor.execute(f'''
+        DELETE FROM tempos_preparo
+        WHERE escala = 'hora' AND inicio < date(
+            'now', '{FUSO_BRASILIA}', '-{DIAS_TEMPOS_POR_HORA} days')
+    ''')
+    return removidas + cursor.rowcount
+
+
+def _migrar_tempo_segundos():
+    """
+    Acrescenta tempo_preparo_segundos a bancos antigos.
+
+    Os segundos dos pedidos já prontos são recalculados pelas datas de
+    início e conclusão, e esses tempos preenchem os sketches.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(f'''
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('PRAGMA table_info(pedidos_cozinha)')
+        if any(row['name'] == 'tempo_preparo_segundos'
+               for row in cursor.fetchall()):
+            return
+        cursor.execute('ALTER TABLE pedidos_cozinha '
+                       'ADD COLUMN tempo_preparo_segundos INTEGER')
+        cursor.execute('''
+            UPDATE pedidos_cozinha
+            SET tempo_preparo_segundos = CAST(ROUND(
+                (julianday(data_conclusao) - julianday(data_inicio_preparo))
+                * 86400) AS INTEGER)
+            WHERE status = 'PRONTO' AND data_inicio_preparo IS NOT NULL
+        ''')
+        cursor.execute('''
+            SELECT id, data_conclusao, tempo_preparo_segundos
+            FROM pedidos_cozinha
+            WHERE tempo_preparo_segundos IS NOT NULL ORDER BY id
+        ''')
+        prontos = cursor.fetchall()
+        for pedido in prontos:
+            _contabilizar_tempo(cursor, pedido['data_conclusao'],
+                                pedido['tempo_preparo_segundos'],
+                                _itens_do_pedido(cursor, pedido['id']))
+        _limpar_estatisticas(cursor)
+        print(f"[DB] Tempos em segundos calculados para {len(prontos)} "
+              f"pedidos prontos")
+
+
+def _reconstruir_estatisticas():
+    """
+    Preenche as estatísticas a partir de pedidos_cozinha.
+
+    Só roda em bancos criados antes das tabelas de estatísticas (tickets
+    existentes e nenhum status contabilizado); depois disso elas são
+    mantidas pelas funções que alteram os pedidos. Pedidos finalizados e
+    cancelados depois contam só como cancelados.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT 1 FROM estatisticas_status LIMIT 1')
+        if cursor.fetchone():
+            return
+        cursor.execute('''
+            SELECT id, status, tempo_preparacao, data_recebimento,
+                   data_inicio_preparo, data_conclusao
+            FROM pedidos_cozinha ORDER BY id
+        ''')
+        pedidos = cursor.fetchall()
+        for pedido in pedidos:
+            itens = _itens_do_pedido(cursor, pedido['id'])
+            _mudar_status(cursor, None, pedido['status'])
+            _contabilizar(cursor, pedido['data_recebimento'], recebidos=1)
+            _contabilizar_itens(cursor, pedido['data_recebimento'], itens,
+                                pedidos=1, unidades=1)
+            if pedido['data_inicio_preparo']:
+                _contabilizar(cursor, pedido['data_inicio_preparo'],
+                              iniciados=1)
+            if pedido['status'] == 'PRONTO':
+                _contabilizar(cursor, pedido['data_conclusao'], prontos=1,
+                              tempo=pedido['tempo_preparacao'])
+                _contabilizar_itens(cursor, pedido['data_conclusao'], itens,
+                                    prontas=1)
+            elif pedido['status'] == 'CANCELADO':
+                _contabilizar(cursor, pedido['data_conclusao'], cancelados=1)
+                _contabilizar_itens(cursor, pedido['data_conclusao'], itens,
+                                    canceladas=1)
+        _limpar_estatisticas(cursor)
+        if pedidos:
+            print(f"[DB] Estatísticas reconstruídas a partir de "
+                  f"{len(pedidos)} pedidos")
+
+
+def registrar_pedido(pedido_id, cliente, item, observacao=None, itens=None,
+                     chave=None):
+    """
+    Registra um ticket na fila de preparo.
+
+    `item` é o texto exibido na tela; `itens` são as linhas do pedido como
+    tuplas (item, quantidade). Sem `itens`, o ticket tem uma linha só.
+    Com `chave`, uma reentrega da mesma mensagem levanta MensagemDuplicada
+    em vez de criar outro ticket.
+    """
+    itens = itens or [(item, 1)]
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        dedup.registrar(cursor, chave)
+        agora = _agora(cursor)
+        cursor.execute('''
             INSERT INTO pedidos_cozinha
             (pedido_id, cliente, item, observacao, status, data_recebimento)
-            VALUES (?, ?, ?, ?, 'RECEBIDO', datetime('now', '{FUSO_BRASILIA}'))
-        ''', (pedido_id, cliente, item, observacao))
-        return cursor.lastrowid
+            VALUES (?, ?, ?, ?, 'RECEBIDO', ?)
+        ''', (pedido_id, cliente, item, observacao, agora))
+        cozinha_id = cursor.lastrowid
+
+        cursor.executemany(
+            'INSERT INTO itens_pedido_cozinha (cozinha_id, item, quantidade) '
+            'VALUES (?, ?, ?)',
+            [(cozinha_id, nome, quantidade) for nome, quantidade in itens])
+        _registrar_evento(cursor, 'recebido', cozinha_id)
+
+        _mudar_status(cursor, None, 'RECEBIDO')
+        _contabilizar(cursor, agora, recebidos=1)
+        _contabilizar_itens(cursor, agora, _somar_linhas(itens), pedidos=1,
+                            unidades=1)
+        if next(_registros) % INTERVALO_LIMPEZA_ESTATISTICAS == 0:
+            _limpar_estatisticas(cursor)
+
+    dedup.lembrar(chave)
+    return cozinha_id
 
 
 def iniciar_preparo(cozinha_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(f'''
+        cursor.execute('BEGIN IMMEDIATE')
+        anterior = _status_atual(cursor, cozinha_id)
+        if anterior is None:
+            raise ValueError(f"Pedido {cozinha_id} não encontrado na cozinha")
+
+        agora = _agora(cursor)
+        cursor.execute('''
             UPDATE pedidos_cozinha
-            SET status = 'PREPARANDO',
-                data_inicio_preparo = datetime('now', '{FUSO_BRASILIA}')
+            SET status = 'PREPARANDO', data_inicio_preparo = ?
             WHERE id = ?
-        ''', (cozinha_id,))
-        if cursor.rowcount == 0:
-            raise ValueError(f"Pedido {cozinha_id} não encontrado na cozinha")
+        ''', (agora, cozinha_id))
+        _registrar_evento(cursor, 'iniciado', cozinha_id)
+
+        if anterior != 'PREPARANDO':
+            _mudar_status(cursor, anterior, 'PREPARANDO')
+            _contabilizar(cursor, agora, iniciados=1)
 
 
 def finalizar_pedido_automatico(cozinha_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(f'''
+        cursor.execute('BEGIN IMMEDIATE')
+        anterior = _status_atual(cursor, cozinha_id)
+        if anterior is None:
+            raise ValueError(f"Pedido {cozinha_id} não encontrado")
+
+        agora = _agora(cursor)
+        cursor.execute('''
             UPDATE pedidos_cozinha
             SET status = 'PRONTO',
-                data_conclusao = datetime('now', '{FUSO_BRASILIA}'),
+                data_conclusao = ?,
                 tempo_preparacao = CAST(
-                    (julianday('now', '{FUSO_BRASILIA}') - julianday(data_inicio_preparo)) * 24 * 60 
-                AS INTEGER)
+                    (julianday(?) - julianday(data_inicio_preparo)) * 24 * 60
+                AS INTEGER),
+                tempo_preparo_segundos = CAST(ROUND(
+                    (julianday(?) - julianday(data_inicio_preparo)) * 86400
+                ) AS INTEGER)
             WHERE id = ?
-        ''', (cozinha_id,))
-        if cursor.rowcount == 0:
-            raise ValueError(f"Pedido {cozinha_id} não encontrado")
+        ''', (agora, agora, agora, cozinha_id))
+        _registrar_evento(cursor, 'finalizado', cozinha_id)
 
         cursor.execute(
-            'SELECT pedido_id, cliente, item, tempo_preparacao FROM pedidos_cozinha WHERE id = ?', (cozinha_id,))
-        return dict(cursor.fetchone())
+            'SELECT pedido_id, cliente, item, tempo_preparacao, '
+            'tempo_preparo_segundos FROM pedidos_cozinha WHERE id = ?',
+            (cozinha_id,))
+        pedido = dict(cursor.fetchone())
+
+        if anterior != 'PRONTO':
+            itens = _itens_do_pedido(cursor, cozinha_id)
+            _mudar_status(cursor, anterior, 'PRONTO')
+            _contabilizar(cursor, agora, prontos=1,
+                          tempo=pedido['tempo_preparacao'])
+            _contabilizar_itens(cursor, agora, itens, prontas=1)
+            if pedido['tempo_preparo_segundos'] is not None:
+                _contabilizar_tempo(cursor, agora,
+                                    pedido['tempo_preparo_segundos'], itens)
+        return pedido
 
 
 # --- FUNÇÃO QUE FALTAVA ---
@@ -92,14 +532,25 @@ def cancelar_pedido(cozinha_id):
     """Marca um pedido como cancelado."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(f'''
+        cursor.execute('BEGIN IMMEDIATE')
+        anterior = _status_atual(cursor, cozinha_id)
+        if anterior is None:
+            raise ValueError(f"Pedido {cozinha_id} não encontrado")
+
+        agora = _agora(cursor)
+        cursor.execute('''
             UPDATE pedidos_cozinha
-            SET status = 'CANCELADO',
-                data_conclusao = datetime('now', '{FUSO_BRASILIA}')
+            SET status = 'CANCELADO', data_conclusao = ?
             WHERE id = ?
-        ''', (cozinha_id,))
-        if cursor.rowcount == 0:
-            raise ValueError(f"Pedido {cozinha_id} não encontrado")
+        ''', (agora, cozinha_id))
+        _registrar_evento(cursor, 'cancelado', cozinha_id)
+
+        if anterior != 'CANCELADO':
+            _mudar_status(cursor, anterior, 'CANCELADO')
+            _contabilizar(cursor, agora, cancelados=1)
+            _contabilizar_itens(cursor, agora,
+                                _itens_do_pedido(cursor, cozinha_id),
+                                canceladas=1)
 
 
 def listar_pedidos_por_status(status):
@@ -110,23 +561,37 @@ def listar_pedidos_por_status(status):
         return [dict(row) for row in cursor.fetchall()]
 
 
+ORDEM_FILA = {'PREPARANDO': 1, 'RECEBIDO': 2, 'PRONTO': 3}
+
+
 def listar_fila_preparo():
+    """
+    Fila da tela: todos os tickets ativos e os concluídos mais recentes.
+
+    Os ativos vêm sempre inteiros (índice parcial idx_pedidos_ativos); os
+    concluídos completam até LIMITE_FILA. Ordenação: Preparando > Recebido
+    > Pronto > Cancelado e, em cada status, por ordem de chegada.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        # Ordenação: Preparando > Recebido > Pronto > Cancelado
         cursor.execute('''
             SELECT * FROM pedidos_cozinha
-            ORDER BY
-                CASE status
-                    WHEN 'PREPARANDO' THEN 1
-                    WHEN 'RECEBIDO' THEN 2
-                    WHEN 'PRONTO' THEN 3
-                    ELSE 4
-                END,
-                data_recebimento ASC
-            LIMIT 100
+            WHERE status IN ('RECEBIDO', 'PREPARANDO')
+            ORDER BY data_recebimento
         ''')
-        return [dict(row) for row in cursor.fetchall()]
+        pedidos = [dict(row) for row in cursor.fetchall()]
+
+        cursor.execute('''
+            SELECT * FROM pedidos_cozinha
+            WHERE status IN ('PRONTO', 'CANCELADO')
+            ORDER BY data_conclusao DESC
+            LIMIT ?
+        ''', (max(LIMITE_FILA - len(pedidos), 0),))
+        pedidos.extend(dict(row) for row in cursor.fetchall())
+
+    pedidos.sort(key=lambda pedido: (ORDEM_FILA.get(pedido['status'], 4),
+                                     pedido['data_recebimento'] or ''))
+    return pedidos
 
 
 def buscar_pedido(cozinha_id):
@@ -135,25 +600,368 @@ def buscar_pedido(cozinha_id):
         cursor.execute(
             'SELECT * FROM pedidos_cozinha WHERE id = ?', (cozinha_id,))
         row = cursor.fetchone()
-        return dict(row) if row else None
+        if not row:
+            return None
+
+        pedido = dict(row)
+        cursor.execute(
+            'SELECT item, quantidade FROM itens_pedido_cozinha '
+            'WHERE cozinha_id = ? ORDER BY id', (cozinha_id,))
+        pedido['itens'] = [dict(linha) for linha in cursor.fetchall()]
+        return pedido
+
+
+def status_por_pedido_caixa(pedido_ids):
+    """
+    Retorna {pedido_id: status} do ticket mais recente de cada pedido.
+
+    Pedidos sem ticket em pedidos_cozinha são procurados no histórico.
+    """
+    if not pedido_ids:
+        return {}
+
+    resultado = {}
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        for tabela in ('pedidos_cozinha', 'pedidos_cozinha_historico'):
+            faltando = [pedido_id for pedido_id in pedido_ids
+                        if pedido_id not in resultado]
+            if not faltando:
+                break
+            marcadores = ', '.join('?' * len(faltando))
+            cursor.execute(f'''
+                SELECT pedido_id, status FROM {tabela}
+                WHERE id IN (
+                    SELECT MAX(id) FROM {tabela}
+                    WHERE pedido_id IN ({marcadores})
+                    GROUP BY pedido_id
+                )
+            ''', tuple(faltando))
+            resultado.update(
+                (row['pedido_id'], row['status'])
+                for row in cursor.fetchall())
+    return resultado
+
+
+def arquivar_pedidos(apos_minutos=60, lote=500):
+    """
+    Move para o histórico os tickets concluídos há mais de `apos_minutos`.
+
+    Cada lote de até `lote` tickets (com as suas linhas) é copiado para
+    pedidos_cozinha_historico e apagado de pedidos_cozinha numa transação,
+    com um evento 'arquivado' para as telas abertas tirarem o card. As
+    estatísticas não mudam: são materializadas. Retorna quantos arquivou.
+    """
+    arquivados = 0
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(f'''
+                SELECT id FROM pedidos_cozinha
+                WHERE status IN ('PRONTO', 'CANCELADO')
+                  AND data_conclusao < datetime(
+                      'now', '{FUSO_BRASILIA}', ?)
+                ORDER BY data_conclusao
+                LIMIT ?
+            ''', (f'-{int(apos_minutos)} minutes', lote))
+            ids = [row['id'] for row in cursor.fetchall()]
+            if not ids:
+                break
+
+            marcadores = ', '.join('?' * len(ids))
+            cursor.execute(f'''
+                INSERT INTO pedidos_cozinha_historico
+                ({COLUNAS_PEDIDO}, data_arquivamento)
+                SELECT {COLUNAS_PEDIDO}, datetime('now', '{FUSO_BRASILIA}')
+                FROM pedidos_cozinha WHERE id IN ({marcadores})
+            ''', ids)
+            cursor.execute(f'''
+                INSERT INTO itens_pedido_cozinha_historico
+                (id, cozinha_id, item, quantidade)
+                SELECT id, cozinha_id, item, quantidade
+                FROM itens_pedido_cozinha WHERE cozinha_id IN ({marcadores})
+            ''', ids)
+            cursor.execute(
+                f'DELETE FROM itens_pedido_cozinha '
+                f'WHERE cozinha_id IN ({marcadores})', ids)
+            cursor.execute(
+                f'DELETE FROM pedidos_cozinha WHERE id IN ({marcadores})',
+                ids)
+            cursor.executemany(
+                "INSERT INTO eventos_cozinha (tipo, cozinha_id) "
+                "VALUES ('arquivado', ?)", [(cozinha_id,) for cozinha_id in ids])
+
+        arquivados += len(ids)
+        if len(ids) < lote:
+            break
+
+    if arquivados:
+        _analisar_fila()
+    return arquivados
+
+
+def _analisar_fila():
+    """
+    Atualiza as estatísticas do planejador para pedidos_cozinha.
+
+    Sem elas o SQLite prefere idx_status aos índices parciais da fila. A
+    tabela só guarda a fila e os concluídos recentes, então é barato.
+    """
+    with get_db_connection() as conn:
+        conn.execute('ANALYZE pedidos_cozinha')
+
+
+def buscar_pedido_arquivado(cozinha_id):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT * FROM pedidos_cozinha_historico WHERE id = ?',
+            (cozinha_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        pedido = dict(row)
+        cursor.execute(
+            'SELECT item, quantidade FROM itens_pedido_cozinha_historico '
+            'WHERE cozinha_id = ? ORDER BY id', (cozinha_id,))
+        pedido['itens'] = [dict(linha) for linha in cursor.fetchall()]
+        return pedido
+
+
+def listar_arquivo(dia=None, status=None, pedido_id=None, antes_id=None,
+                   limit=50):
+    """
+    Lista tickets arquivados, do mais recente para o mais antigo.
+
+    Filtros opcionais: `dia` da conclusão ('YYYY-MM-DD'), `status` e
+    `pedido_id` do caixa. A paginação é por chave: passe em `antes_id` o
+    menor id da página anterior.
+    """
+    condicoes, parametros = [], []
+    if dia is not None:
+        condicoes.append(
+            'data_conclusao >= ? AND data_conclusao < date(?, \'+1 day\')')
+        parametros += [dia, dia]
+    if status is not None:
+        condicoes.append('status = ?')
+        parametros.append(status)
+    if pedido_id is not None:
+        condicoes.append('pedido_id = ?')
+        parametros.append(pedido_id)
+    if antes_id is not None:
+        condicoes.append('id < ?')
+        parametros.append(antes_id)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT * FROM pedidos_cozinha_historico {where}
+            ORDER BY id DESC LIMIT ?
+        ''', (*parametros, limit))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def _resumo_janela(row):
+    amostras = row['tempo_amostras'] or 0
+    return {
+        'recebidos': row['recebidos'] or 0,
+        'iniciados': row['iniciados'] or 0,
+        'prontos': row['prontos'] or 0,
+        'cancelados': row['cancelados'] or 0,
+        'tempo_medio_preparo':
+            round(row['tempo_total'] / amostras, 2) if amostras else 0,
+        'tempo_minimo': row['tempo_minimo'] or 0,
+        'tempo_maximo': row['tempo_maximo'] or 0
+    }
+
+
+def _somar_janelas(cursor, escala, desde):
+    cursor.execute('''
+        SELECT SUM(recebidos) AS recebidos, SUM(iniciados) AS iniciados,
+               SUM(prontos) AS prontos, SUM(cancelados) AS cancelados,
+               SUM(tempo_total) AS tempo_total,
+               SUM(tempo_amostras) AS tempo_amostras,
+               MIN(tempo_minimo) AS tempo_minimo,
+               MAX(tempo_maximo) AS tempo_maximo
+        FROM estatisticas_janelas WHERE escala = ? AND inicio >= ?
+    ''', (escala, desde))
+    return _resumo_janela(cursor.fetchone())
 
 
 def estatisticas_cozinha():
+    """
+    Estatísticas da cozinha lidas das tabelas materializadas.
+
+    Nenhuma consulta passa por pedidos_cozinha: o custo não cresce com o
+    histórico. 'pedidos_por_status' e os tempos no nível de cima cobrem todo
+    o período; 'ultimos_15_minutos' e 'hoje' somam as janelas de minuto e de
+    hora; 'por_hora' e 'por_item' são do dia corrente.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            'SELECT status, COUNT(*) as quantidade FROM pedidos_cozinha GROUP BY status')
+            'SELECT status, quantidade FROM estatisticas_status '
+            'WHERE quantidade > 0')
         status_count = {row['status']: row['quantidade']
                         for row in cursor.fetchall()}
 
-        cursor.execute('''
-            SELECT AVG(tempo_preparacao) as tempo_medio, MIN(tempo_preparacao) as tempo_minimo, MAX(tempo_preparacao) as tempo_maximo
-            FROM pedidos_cozinha WHERE status = 'PRONTO' AND tempo_preparacao > 0
+        cursor.execute(f'''
+            SELECT strftime('%Y-%m-%d %H:%M', 'now', '{FUSO_BRASILIA}',
+                            '-14 minutes') AS minuto,
+                   date('now', '{FUSO_BRASILIA}') AS hoje
         ''')
-        tempos = cursor.fetchone()
+        inicio = cursor.fetchone()
+        hoje = inicio['hoje']
+
+        total = _somar_janelas(cursor, 'total', '')
+
+        cursor.execute(
+            "SELECT * FROM estatisticas_janelas "
+            "WHERE escala = 'hora' AND inicio >= ? ORDER BY inicio", (hoje,))
+        por_hora = {row['inicio'][-2:]: _resumo_janela(row)
+                    for row in cursor.fetchall()}
+
+        cursor.execute('''
+            SELECT item, pedidos, unidades, prontas, canceladas
+            FROM estatisticas_itens WHERE dia = ?
+            ORDER BY unidades DESC, item
+        ''', (hoje,))
+        por_item = {row.pop('item'): row
+                    for row in map(dict, cursor.fetchall())}
+
         return {
             'pedidos_por_status': status_count,
-            'tempo_medio_preparo': round(tempos['tempo_medio'], 2) if tempos['tempo_medio'] else 0,
-            'tempo_minimo': tempos['tempo_minimo'] or 0,
-            'tempo_maximo': tempos['tempo_maximo'] or 0
+            'tempo_medio_preparo': total['tempo_medio_preparo'],
+            'tempo_minimo': total['tempo_minimo'],
+            'tempo_maximo': total['tempo_maximo'],
+            'ultimos_15_minutos':
+                _somar_janelas(cursor, 'minuto', inicio['minuto']),
+            'hoje': _somar_janelas(cursor, 'hora', hoje),
+            'por_hora': por_hora,
+            'por_item': por_item
         }
+
+
+def quantis_preparo(janela='hoje'):
+    """
+    Quantis do tempo de preparo, em segundos, na `janela` pedida.
+
+    `janela` é uma das chaves de JANELAS_TEMPOS: '15min' e 'hoje' somam os
+    sketches de minuto e de hora do período; 'total' lê o acumulado. O custo
+    depende do número de baldes (no máximo algumas centenas por item), não
+    do número de pedidos. Os valores têm erro relativo de até ERRO_QUANTIS.
+    """
+    escala, inicio = JANELAS_TEMPOS[janela]
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT item, balde, SUM(quantidade) AS quantidade
+            FROM tempos_preparo
+            WHERE escala = ? AND inicio >= {inicio}
+            GROUP BY item, balde
+        ''', (escala,))
+        sketches = {}
+        for row in cursor.fetchall():
+            sketch = sketches.setdefault(row['item'], _sketch_vazio())
+            sketch.baldes[row['balde']] = row['quantidade']
+
+    def resumo(sketch):
+        quantis = sketch.quantis(QUANTIS_PREPARO)
+        dados = {'amostras': sketch.quantidade}
+        for q in QUANTIS_PREPARO:
+            valor = quantis[q]
+            dados[f'p{round(q * 100):d}'] = (
+                round(valor, 1) if valor is not None else None)
+        return dados
+
+    geral = sketches.pop('', _sketch_vazio())
+    return {
+        'janela': janela,
+        'unidade': 'segundos',
+        'erro_relativo': ERRO_QUANTIS,
+        'geral': resumo(geral),
+        'por_item': {item: resumo(sketch)
+                     for item, sketch in sorted(sketches.items())}
+    }
+
+
+def ultimo_evento_id():
+    """Retorna o id do evento mais recente da fila (0 se não houver)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT MAX(id) AS ultimo FROM eventos_cozinha')
+        return cursor.fetchone()['ultimo'] or 0
+
+
+def listar_eventos(apos_id, limit=1000):
+    """
+    Lista os eventos com id maior que `apos_id`, em ordem.
+
+    Cada evento traz o estado atual do pedido em 'pedido'; a tela aplica os
+    eventos em sequência, então sempre converge para o estado do banco.
+    Eventos 'arquivado' trazem só o id do pedido, que saiu da fila; os
+    demais eventos de um pedido já arquivado são omitidos.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT e.id AS evento_id, e.tipo, e.cozinha_id, p.*
+            FROM eventos_cozinha e
+            LEFT JOIN pedidos_cozinha p ON p.id = e.cozinha_id
+            WHERE e.id > ?
+            ORDER BY e.id
+            LIMIT ?
+        ''', (apos_id, limit))
+
+        eventos = []
+        for row in cursor.fetchall():
+            pedido = dict(row)
+            evento_id = pedido.pop('evento_id')
+            tipo = pedido.pop('tipo')
+            cozinha_id = pedido.pop('cozinha_id')
+            if tipo == 'arquivado':
+                pedido = {'id': cozinha_id}
+            elif pedido['id'] is None:
+                continue
+            eventos.append({'id': evento_id, 'tipo': tipo, 'pedido': pedido})
+        return eventos
+
+
+def eventos_apos(apos_id, limit=1000):
+    """
+    Eventos posteriores a `apos_id`, ou None se algum já foi apagado por
+    limpar_eventos ou se há mais de `limit` pendentes (a tela precisa
+    recarregar a fila).
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT MIN(id) AS primeiro, MAX(id) AS ultimo,
+                   SUM(id > ?) AS pendentes
+            FROM eventos_cozinha
+        ''', (apos_id,))
+        row = cursor.fetchone()
+
+    ultimo = row['ultimo'] or 0
+    if apos_id > ultimo:
+        return None
+    if row['primeiro'] is not None and apos_id < row['primeiro'] - 1:
+        return None
+    # Conta as linhas da tabela: listar_eventos omite os eventos de pedidos
+    # arquivados, então o tamanho da lista não mostra se o LIMIT cortou
+    if (row['pendentes'] or 0) > limit:
+        return None
+    return listar_eventos(apos_id, limit)
+
+
+def limpar_eventos(manter=1000):
+    """Remove eventos antigos, mantendo apenas os `manter` mais recentes."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'DELETE FROM eventos_cozinha WHERE id <= '
+            '(SELECT MAX(id) FROM eventos_cozinha) - ?', (manter,))
+        return cursor.rowcount
@@ -10,6 +10,9 @@ let state = {
   pedidoSelecionado: null,
   ingredienteSelecionado: null,
   atualizacaoAutomatica: null,
+  eventos: null,
+  ultimoEventoId: null,
+  recargaEstoque: null,
 };
 
 // Elementos DOM
@@ -57,9 +60,8 @@ function init() {
   console.log("Iniciando aplicação...");
   try {
     setupEventListeners();
-    carregarPedidos();
+    carregarPedidos().then(conectarEventos);
     carregarEstoque();
-    iniciarAtualizacaoAutomatica();
   } catch (error) {
     console.error("Erro fatal na inicialização:", error);
     mostrarToast("Erro ao iniciar sistema.", "error");
@@ -132,6 +134,7 @@ async function carregarPedidos(silencioso = false) {
 
     const data = await response.json();
     state.pedidos = data.pedidos || [];
+    if (state.ultimoEventoId === null) state.ultimoEventoId = data.ultimo_evento_id;
     renderizarPedidos();
     atualizarEstatisticas();
   } catch (error) {
@@ -150,7 +153,7 @@ async function iniciarPreparo(pedidoId) {
     const data = await response.json();
     if (response.ok) {
       mostrarToast("Cronômetro iniciado! ⏱️", "success");
-      carregarPedidos();
+      if (!state.eventos) carregarPedidos();
       fecharModal();
     } else {
       mostrarToast(data.erro || "Erro", "error");
@@ -171,7 +174,7 @@ async function finalizarPedido(pedidoId) {
     if (response.ok) {
       const tempoTotal = data.tempo_total || "calculado";
       mostrarToast(`✅ Pedido finalizado em ${tempoTotal} min!`, "success");
-      carregarPedidos();
+      if (!state.eventos) carregarPedidos();
       fecharModal();
     } else {
       mostrarToast(data.erro || "Erro", "error");
@@ -191,7 +194,7 @@ async function cancelarPedidoApi(pedidoId, motivo) {
 
     if (response.ok) {
       mostrarToast("Pedido cancelado com sucesso!", "success");
-      carregarPedidos();
+      if (!state.eventos) carregarPedidos();
       fecharModalCancelar();
     } else {
       const data = await response.json();
@@ -518,12 +521,98 @@ function mostrarToast(msg, tipo = "success") {
   elements.toast.className = `toast ${tipo} show`;
   setTimeout(() => elements.toast.classList.remove("show"), 3000);
 }
+
+// --- Atualização em tempo real ---
+// A fila é atualizada pelo stream SSE /fila/eventos. O polling de /fila
+// fica só como alternativa, quando o navegador não suporta EventSource ou
+// quando a conexão com o stream cai de vez.
+const TIPOS_EVENTO = [
+  "recebido",
+  "iniciado",
+  "finalizado",
+  "cancelado",
+  "arquivado",
+];
+
+function conectarEventos() {
+  if (!window.EventSource) {
+    iniciarAtualizacaoAutomatica();
+    return;
+  }
+
+  const desde =
+    state.ultimoEventoId !== null ? `?desde=${state.ultimoEventoId}` : "";
+  const eventos = new EventSource(`${API_URL}/fila/eventos${desde}`);
+  state.eventos = eventos;
+
+  TIPOS_EVENTO.forEach((tipo) => {
+    eventos.addEventListener(tipo, (e) => aplicarEvento(JSON.parse(e.data)));
+  });
+
+  // Eventos perdidos (reconexão depois da limpeza ou com eventos demais
+  // pendentes): recarrega a fila; o stream segue a partir deste evento
+  eventos.addEventListener("resync", (e) => {
+    state.ultimoEventoId = JSON.parse(e.data).id;
+    carregarPedidos(true);
+  });
+
+  eventos.onopen = () => pararAtualizacaoAutomatica();
+
+  eventos.onerror = () => {
+    // O EventSource tenta reconectar sozinho (enviando Last-Event-ID);
+    // enquanto isso, ou se ele desistir, a tela volta ao polling.
+    iniciarAtualizacaoAutomatica();
+    if (eventos.readyState === EventSource.CLOSED) {
+      state.eventos = null;
+      setTimeout(conectarEventos, 5000);
+    }
+  };
+}
+
+function aplicarEvento(evento) {
+  state.ultimoEventoId = evento.id;
+  const pedido = evento.pedido;
+  const indice = state.pedidos.findIndex((p) => p.id === pedido.id);
+
+  if (evento.tipo === "arquivado") {
+    // Pedido concluído há tempo: saiu da fila e foi para o arquivo
+    if (indice >= 0) state.pedidos.splice(indice, 1);
+  } else if (indice >= 0) {
+    state.pedidos[indice] = pedido;
+  } else {
+    state.pedidos.push(pedido);
+  }
+
+  renderizarPedidos();
+  atualizarEstatisticas();
+
+  // Pedido novo consome ingredientes: atualiza o estoque (agrupando rajadas)
+  if (evento.tipo === "recebido") agendarRecargaEstoque();
+}
+
+function agendarRecargaEstoque() {
+  if (state.recargaEstoque) return;
+  state.recargaEstoque = setTimeout(() => {
+    state.recargaEstoque = null;
+    carregarEstoque();
+  }, 2000);
+}
+
 function iniciarAtualizacaoAutomatica() {
+  if (state.atualizacaoAutomatica) return;
   state.atualizacaoAutomatica = setInterval(() => {
     carregarPedidos(true);
     carregarEstoque();
   }, 10000);
 }
+
+function pararAtualizacaoAutomatica() {
+  if (!state.atualizacaoAutomatica) return;
+  clearInterval(state.atualizacaoAutomatica);
+  state.atualizacaoAutomatica = null;
+}
+
 window.addEventListener("beforeunload", () => {
-  if (state.atualizacaoAutomatica) clearInterval(state.atualizacaoAutomatica);
+  pararAtualizacaoAutomatica();
+  if (state.eventos) state.eventos.close();
 });
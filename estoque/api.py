@@ -10,31 +10,64 @@ swagger = Swagger(app)
 
 db.init_db()
 
+# Limite de nomes por consulta em ?nomes=, bem abaixo do limite de
+# variáveis do SQLite usado pelo IN (?, ?, ...) de buscar_ingredientes
+MAX_NOMES = 100
+
 
 @app.route('/estoque', methods=['GET'])
 def listar_estoque():
     """
-    Lista todos os ingredientes do estoque.
+    Lista os ingredientes do estoque.
     ---
+    parameters:
+      - name: nomes
+        in: query
+        type: string
+        required: false
+        description: Nomes separados por vírgula (ex. pao,carne,queijo)
+          para buscar apenas esses ingredientes (no máximo 100)
     responses:
       200:
         description: Lista de ingredientes
+      400:
+        description: Parâmetro nomes vazio ou com mais de 100 nomes
     """
     try:
-        estoque = db.listar_estoque()
+        nomes = request.args.get('nomes')
+
+        if nomes is not None:
+            nomes = list(dict.fromkeys(
+                n.strip() for n in nomes.split(',') if n.strip()))
+            if not nomes:
+                return jsonify(
+                    {"erro": "Informe ao menos um nome em 'nomes'"}), 400
+            if len(nomes) > MAX_NOMES:
+                return jsonify({
+                    "erro": f"Informe no máximo {MAX_NOMES} nomes em 'nomes'"
+                }), 400
+            estoque = db.buscar_ingredientes(nomes)
+            encontrados = {i['nome'] for i in estoque}
+        else:
+            estoque = db.listar_estoque()
 
         # Separar por status
         criticos = [i for i in estoque if i['status'] == 'CRITICO']
         baixos = [i for i in estoque if i['status'] == 'BAIXO']
 
-        return jsonify({
+        resposta = {
             "total_ingredientes": len(estoque),
             "alertas": {
                 "criticos": len(criticos),
                 "baixos": len(baixos)
             },
             "estoque": estoque
-        }), 200
+        }
+        if nomes:
+            resposta["nao_encontrados"] = [
+                n for n in nomes if n not in encontrados]
+
+        return jsonify(resposta), 200
     except Exception as e:
         return jsonify({"erro": str(e)}), 500
 
@@ -56,9 +89,7 @@ def consultar_ingrediente(ingrediente_nome):
         description: Ingrediente não encontrado
     """
     try:
-        estoque = db.listar_estoque()
-        ingrediente = next(
-            (i for i in estoque if i['nome'] == ingrediente_nome), None)
+        ingrediente = db.buscar_ingrediente(ingrediente_nome)
 
         if ingrediente:
             return jsonify(ingrediente), 200
@@ -150,6 +181,41 @@ def historico():
         return jsonify({"erro": str(e)}), 500
 
 
+@app.route('/estoque/historico/diario', methods=['GET'])
+def historico_diario():
+    """
+    Retorna o histórico agregado por dia e ingrediente.
+
+    Inclui os dias já compactados (além da retenção, sem as movimentações
+    individuais) e os dias recentes, agregados na consulta.
+    ---
+    parameters:
+      - name: ingrediente
+        in: query
+        type: string
+        required: false
+      - name: limit
+        in: query
+        type: integer
+        default: 30
+        description: Máximo de linhas (dia, ingrediente)
+    responses:
+      200:
+        description: Entradas, saídas e saldo inicial/final de cada dia
+    """
+    try:
+        ingrediente = request.args.get('ingrediente')
+        limit = request.args.get('limit', 30, type=int)
+
+        dias = db.historico_diario(ingrediente, limit)
+        return jsonify({
+            "total": len(dias),
+            "dias": dias
+        }), 200
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+
 @app.route('/estoque/verificar/<produto>', methods=['GET'])
 def verificar_disponibilidade(produto):
     """
@@ -178,6 +244,51 @@ def verificar_disponibilidade(produto):
         return jsonify({"erro": str(e)}), 500
 
 
+@app.route('/estoque/receitas/<produto>', methods=['PUT'])
+def definir_receita(produto):
+    """
+    Cadastra ou substitui a receita de um produto.
+    ---
+    parameters:
+      - name: produto
+        in: path
+        type: string
+        required: true
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - ingredientes
+          properties:
+            ingredientes:
+              type: object
+              example: {"pao": 1, "carne": 1, "queijo": 2}
+    responses:
+      200:
+        description: Receita atualizada
+      400:
+        description: Dados inválidos
+    """
+    try:
+        dados = request.json or {}
+        ingredientes = dados.get('ingredientes')
+
+        if not isinstance(ingredientes, dict):
+            return jsonify({"erro": "Informe os ingredientes da receita"}), 400
+
+        resultado = db.definir_receita(produto, ingredientes)
+        return jsonify({
+            "status": "sucesso",
+            "resultado": resultado
+        }), 200
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
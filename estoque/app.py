@@ -1,75 +1,178 @@
-import json
+import os
+import threading
 import time
 
 import database as db
 import pika
+from comum.consumidor import (Consumidor, Exchange, Fila,
+                               RuntimeConsumidores, Topologia)
+from comum.codec import decodificar
+from comum.idempotencia import MensagemDuplicada, chave_mensagem
+from comum.mensageria import PublicadorAssincrono
 
 db.init_db()
 
-
-def publicar_erro_estoque(channel, pedido_id, mensagem_erro):
+# Com TAMANHO_LOTE > 1 o consumer acumula até TAMANHO_LOTE mensagens (ou
+# espera ESPERA_LOTE segundos) e dá baixa em todas numa única transação.
+TAMANHO_LOTE = int(os.environ.get('ESTOQUE_TAMANHO_LOTE', '1'))
+ESPERA_LOTE = float(os.environ.get('ESTOQUE_ESPERA_LOTE', '0.2'))
+
+# Com CONSUMIDOR_ASYNCIO=1 o consumer roda no runtime asyncio compartilhado
+# (comum.consumidor), que também acumula os lotes de TAMANHO_LOTE.
+CONSUMIDOR_ASYNCIO = os.environ.get('CONSUMIDOR_ASYNCIO', '0') == '1'
+
+TOPOLOGIA = Topologia(
+    exchanges=[
+        Exchange('pedidos_dlx', durable=True),
+        Exchange('pedidos_prontos_exchange'),
+        Exchange('pedidos_exchange'),
+    ],
+    filas=[
+        Fila('pedidos_dlq_estoque', exchanges=['pedidos_dlx']),
+        Fila('pedidos_estoque_app',
+             argumentos={'x-dead-letter-exchange': 'pedidos_dlx'},
+             exchanges=['pedidos_exchange']),
+    ]
+)
+
+# Movimentações com mais de ESTOQUE_RETENCAO_DIAS dias são agregadas por dia
+# em movimentacoes_diarias e apagadas; a verificação roda a cada
+# ESTOQUE_COMPACTAR_INTERVALO segundos, no processo do consumer.
+RETENCAO_DIAS = int(os.environ.get('ESTOQUE_RETENCAO_DIAS', '30'))
+COMPACTAR_INTERVALO = float(
+    os.environ.get('ESTOQUE_COMPACTAR_INTERVALO', '3600'))
+
+# Avisos de falta de ingredientes, publicados com publisher confirms
+publicador_avisos = PublicadorAssincrono('pedidos_prontos_exchange')
+TIMEOUT_CONFIRMACAO = 5
+
+
+def publicar_erro_estoque(pedido_id, mensagem_erro):
     """
     Publica uma mensagem de erro na exchange de pedidos prontos/atualizações.
     Isso permite que Caixa ou Cozinha saibam que houve falha.
+
+    Retorna o Future do publisher confirm (ver aguardar_avisos).
     """
-    try:
-        msg = {
-            'pedido_caixa_id': pedido_id,
-            'status': 'ERRO_ESTOQUE',
-            'erro': mensagem_erro
-        }
-        # Usa o mesmo exchange que a cozinha/caixa escutam para atualizações
-        channel.basic_publish(
-            exchange='pedidos_prontos_exchange',
-            routing_key='',
-            body=json.dumps(msg)
-        )
-        print(
-            f"[ESTOQUE] Aviso de erro enviado: Pedido #{pedido_id} - {mensagem_erro}", flush=True)
-    except Exception as e:
-        print(f"[ERRO] Falha ao notificar erro: {e}", flush=True)
+    msg = {
+        'pedido_caixa_id': pedido_id,
+        'status': 'ERRO_ESTOQUE',
+        'erro': mensagem_erro
+    }
+    # Usa o mesmo exchange que a cozinha/caixa escutam para atualizações
+    return publicador_avisos.publicar(
+        msg,
+        propriedades=pika.BasicProperties(delivery_mode=2)
+    )
+
+
+def aguardar_avisos(avisos):
+    """
+    Espera os confirms de uma lista de (pedido_id, futuro).
+
+    Os avisos de um lote são publicados juntos e aguardados antes do
+    basic_ack, então o pedido só sai da fila depois que o aviso de erro
+    foi aceito pelo broker.
+    """
+    for pedido_id, futuro in avisos:
+        try:
+            futuro.result(TIMEOUT_CONFIRMACAO)
+            print(f"[ESTOQUE] Aviso de erro enviado: Pedido #{pedido_id}",
+                  flush=True)
+        except Exception as e:
+            print(f"[ERRO] Falha ao notificar erro do pedido #{pedido_id}: "
+                  f"{e}", flush=True)
 
 
-def callback(ch, method, properties, body):
-    """Processa pedidos e dá baixa nos ingredientes."""
+def rejeitar(ch, method, properties):
+    """Reenvia a mensagem para a fila ou, após 3 tentativas, para a DLQ."""
     retry_count = 0
     if properties.headers and 'x-death' in properties.headers:
         retry_count = len(properties.headers['x-death'])
 
+    if retry_count >= 2:
+        print(f"[ESTOQUE] ⚠ Limite de tentativas atingido "
+              f" ({retry_count + 1}). Enviando para DLQ...", flush=True)
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+    else:
+        print(f"[ESTOQUE] Tentativa {retry_count + 1}/3. "
+              f"Reenviando para fila...",
+              flush=True)
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+
+def itens_do_pedido(pedido):
+    """
+    Converte a mensagem do pedido em {produto: quantidade}.
+
+    Pedidos com várias linhas trazem 'itens' ([{'item', 'quantidade'}]);
+    mensagens antigas trazem só 'item' e valem como uma unidade.
+    """
+    linhas = pedido.get('itens')
+    if not linhas:
+        return {pedido.get('item'): 1}
+
+    itens = {}
+    for linha in linhas:
+        if not isinstance(linha, dict):
+            raise ValueError("linha do pedido deve ser um objeto JSON")
+        produto = linha.get('item')
+        quantidade = linha.get('quantidade', 1)
+        if (not isinstance(quantidade, int) or isinstance(quantidade, bool)
+                or quantidade <= 0):
+            raise ValueError(
+                f"Quantidade inválida para '{produto}': {quantidade}")
+        itens[produto] = itens.get(produto, 0) + quantidade
+    return itens
+
+
+def exibir_baixa(pedido_id, movimentacoes):
+    """Mostra as movimentações de uma baixa e alerta estoque baixo."""
+    print(
+        f"[ESTOQUE] ✓ Baixa realizada para pedido #{pedido_id}:",
+        flush=True)
+    for mov in movimentacoes:
+        print(f"          - {mov['ingrediente']}: "
+              f"-{mov['quantidade_baixada']} "
+              f"(restam {mov['quantidade_restante']})", flush=True)
+
+        # Alertar se estoque baixo
+        if mov['quantidade_restante'] <= 10:
+            print(f"⚠ ALERTA: Estoque de {mov['ingrediente']} está baixo!",
+                  flush=True)
+
+
+def callback(ch, method, properties, body):
+    """Processa pedidos e dá baixa nos ingredientes."""
     try:
-        pedido = json.loads(body)
+        pedido = decodificar(properties, body)
         pedido_id = pedido.get('id')
-        item_pedido = pedido.get('item')
+        itens = itens_do_pedido(pedido)
 
         print(
-            f"\n[ESTOQUE] Processando pedido #{pedido_id}: {item_pedido}...",
-            flush=True)
+            f"\n[ESTOQUE] Processando pedido #{pedido_id}: "
+            f"{db.descrever_itens(itens)}...", flush=True)
 
-        disponivel, mensagem = db.verificar_disponibilidade(item_pedido)
-
-        if not disponivel:
-            print(f"[ESTOQUE] ✗ ALERTA: {mensagem}", flush=True)
+        # Validar e dar baixa em todas as linhas numa única transação
+        try:
+            movimentacoes = db.dar_baixa_pedido(
+                itens, pedido_id,
+                chave_mensagem(properties, 'pedido', pedido_id))
+        except MensagemDuplicada:
+            print(f"[ESTOQUE] Pedido #{pedido_id} já baixado; reentrega "
+                  f"ignorada", flush=True)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        except ValueError as e:
+            print(f"[ESTOQUE] ✗ ALERTA: {e}", flush=True)
 
-            publicar_erro_estoque(ch, pedido_id, mensagem)
+            aguardar_avisos(
+                [(pedido_id, publicar_erro_estoque(pedido_id, str(e)))])
 
             ch.basic_ack(delivery_tag=method.delivery_tag)
             return
 
-        # Dar baixa nos ingredientes
-        movimentacoes = db.dar_baixa_ingredientes(item_pedido, pedido_id)
-
-        print(
-            f"[ESTOQUE] ✓ Baixa realizada para pedido #{pedido_id}:",
-            flush=True)
-        for mov in movimentacoes:
-            print(f"          - {mov['ingrediente']}: "
-                  f"-{mov['quantidade_baixada']} "
-                  f"(restam {mov['quantidade_restante']})", flush=True)
-
-            # Alertar se estoque baixo
-            if mov['quantidade_restante'] <= 10:
-                print(f"⚠ ALERTA: Estoque de {mov['ingrediente']} está baixo!",
-                      flush=True)
+        exibir_baixa(pedido_id, movimentacoes)
 
         # Confirmar processamento bem-sucedido
         ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -79,20 +182,138 @@ def callback(ch, method, properties, body):
         ch.basic_ack(delivery_tag=method.delivery_tag)
     except Exception as e:
         print(f"[ERRO] Erro ao processar no estoque: {e}", flush=True)
+        rejeitar(ch, method, properties)
+
+
+class ConsumidorLote:
+    """
+    Acumula mensagens entregues pelo RabbitMQ e processa em lote.
 
-        if retry_count >= 2:
-            print(f"[ESTOQUE] ⚠ Limite de tentativas atingido "
-                  f" ({retry_count + 1}). Enviando para DLQ...", flush=True)
+    O lote é processado quando atinge `tamanho` mensagens ou quando a mais
+    antiga espera `espera` segundos. Todas as baixas do lote são feitas em
+    uma transação (db.dar_baixa_lote) e confirmadas com um único
+    basic_ack(multiple=True).
+    """
+
+    def __init__(self, connection, channel, tamanho, espera):
+        self.connection = connection
+        self.channel = channel
+        self.tamanho = tamanho
+        self.espera = espera
+        self.mensagens = []
+        self.timer = None
+
+    def on_message(self, ch, method, properties, body):
+        self.mensagens.append((method, properties, body))
+
+        if len(self.mensagens) >= self.tamanho:
+            self.processar()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(
+                self.espera, self._tempo_esgotado)
+
+    def _tempo_esgotado(self):
+        self.timer = None
+        self.processar()
+
+    def processar(self):
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+
+        lote, self.mensagens = self.mensagens, []
+        if lote:
+            processar_lote(self.channel, lote)
+
+
+def processar_lote(ch, lote):
+    """Dá baixa em um lote de mensagens (method, properties, body)."""
+    pedidos = []
+    for method, properties, body in lote:
+        try:
+            pedido = decodificar(properties, body)
+            if not isinstance(pedido, dict):
+                raise ValueError("pedido deve ser um objeto")
+            pedidos.append((method, properties, pedido,
+                            itens_do_pedido(pedido)))
+        except ValueError as e:
+            # Mensagem malformada não volta para a fila: vai direto à DLQ
+            print(f"[ESTOQUE] ✗ Mensagem inválida descartada: {e}",
+                  flush=True)
             ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+
+    if not pedidos:
+        return
+
+    print(f"\n[ESTOQUE] Processando lote de {len(pedidos)} pedido(s)...",
+          flush=True)
+
+    try:
+        resultados = db.dar_baixa_lote(
+            [(itens, pedido.get('id'),
+              chave_mensagem(properties, 'pedido', pedido.get('id')))
+             for _, properties, pedido, itens in pedidos])
+    except Exception as e:
+        # Transação inteira desfeita: cada mensagem segue a política de
+        # tentativas normal
+        print(f"[ERRO] Erro ao processar lote no estoque: {e}", flush=True)
+        for method, properties, _, _ in pedidos:
+            rejeitar(ch, method, properties)
+        return
+
+    ultima_tag = None
+    avisos = []
+    for (method, properties, pedido, _), (movimentacoes, erro) in zip(
+            pedidos, resultados):
+        pedido_id = pedido.get('id')
+
+        if erro is None:
+            exibir_baixa(pedido_id, movimentacoes)
+        elif isinstance(erro, MensagemDuplicada):
+            print(f"[ESTOQUE] Pedido #{pedido_id} já baixado; reentrega "
+                  f"ignorada", flush=True)
+        elif isinstance(erro, ValueError):
+            print(f"[ESTOQUE] ✗ ALERTA: {erro}", flush=True)
+            avisos.append(
+                (pedido_id, publicar_erro_estoque(pedido_id, str(erro))))
         else:
-            print(f"[ESTOQUE] Tentativa {retry_count + 1}/3. "
-                  f"Reenviando para fila...",
+            # Falha inesperada isolada no SAVEPOINT do pedido: só ele vai
+            # para a DLQ, o restante do lote é confirmado
+            print(f"[ERRO] Pedido #{pedido_id} enviado para DLQ: {erro}",
                   flush=True)
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            continue
+
+        ultima_tag = method.delivery_tag
+
+    aguardar_avisos(avisos)
+
+    if ultima_tag is not None:
+        ch.basic_ack(delivery_tag=ultima_tag, multiple=True)
+
+
+def runtime_consumidor():
+    """Runtime asyncio do consumer de pedidos (ainda não iniciado)."""
+    if TAMANHO_LOTE > 1:
+        consumidor = Consumidor(
+            'pedidos_estoque_app', processar_lote, prefetch=TAMANHO_LOTE,
+            tamanho_lote=TAMANHO_LOTE, espera_lote=ESPERA_LOTE)
+    else:
+        consumidor = Consumidor('pedidos_estoque_app', callback)
+    return RuntimeConsumidores(TOPOLOGIA, [consumidor], nome='ESTOQUE')
+
+
+def iniciar_consumidor_asyncio():
+    """Consome os pedidos no runtime asyncio compartilhado."""
+    print("[ESTOQUE] Conectando ao RabbitMQ (asyncio)...", flush=True)
+    runtime_consumidor().executar()
 
 
 def iniciar_consumidor():
     """Inicia o consumidor de mensagens do RabbitMQ."""
+    if CONSUMIDOR_ASYNCIO:
+        return iniciar_consumidor_asyncio()
+
     print("[ESTOQUE] Conectando ao RabbitMQ...", flush=True)
 
     while True:
@@ -102,47 +323,24 @@ def iniciar_consumidor():
             channel = connection.channel()
 
             # Declarar Exchanges e Filas (garantir topologia)
-            channel.exchange_declare(
-                exchange='pedidos_dlx',
-                exchange_type='fanout',
-                durable=True
-            )
-
-            channel.exchange_declare(
-                exchange='pedidos_prontos_exchange',
-                exchange_type='fanout'
-            )
-
-            channel.queue_declare(
-                queue='pedidos_dlq_estoque',
-                durable=True
-            )
-
-            channel.queue_bind(
-                exchange='pedidos_dlx',
-                queue='pedidos_dlq_estoque'
-            )
-
-            channel.exchange_declare(
-                exchange='pedidos_exchange', exchange_type='fanout'
-            )
-
-            channel.queue_declare(
-                queue='pedidos_estoque_app',
-                exclusive=False,
-                durable=True,
-                arguments={
-                    'x-dead-letter-exchange': 'pedidos_dlx',
-                }
-            )
+            TOPOLOGIA.declarar(channel)
             queue_name = 'pedidos_estoque_app'
-            channel.queue_bind(exchange='pedidos_exchange', queue=queue_name)
 
             print('[ESTOQUE] ✓ Conectado! Monitorando pedidos...', flush=True)
 
-            channel.basic_qos(prefetch_count=1)
+            if TAMANHO_LOTE > 1:
+                print(f'[ESTOQUE] Modo lote: até {TAMANHO_LOTE} mensagens '
+                      f'ou {ESPERA_LOTE}s por transação', flush=True)
+                on_message = ConsumidorLote(
+                    connection, channel, TAMANHO_LOTE, ESPERA_LOTE
+                ).on_message
+            else:
+                on_message = callback
+
+            channel.basic_qos(prefetch_count=TAMANHO_LOTE)
             channel.basic_consume(
-                queue=queue_name, on_message_callback=callback, auto_ack=False
+                queue=queue_name, on_message_callback=on_message,
+                auto_ack=False
             )
 
             channel.start_consuming()
@@ -157,5 +355,25 @@ def iniciar_consumidor():
             time.sleep(2)
 
 
+def compactar_periodicamente():
+    while True:
+        try:
+            compactadas = db.compactar_movimentacoes(RETENCAO_DIAS)
+            if compactadas:
+                print(f"[ESTOQUE] {compactadas} movimentações agregadas por "
+                      f"dia", flush=True)
+        except Exception as e:
+            print(f"[ESTOQUE] Erro ao compactar movimentações: {e}",
+                  flush=True)
+        time.sleep(COMPACTAR_INTERVALO)
+
+
+def iniciar_compactacao():
+    """Inicia a thread que compacta as movimentações antigas."""
+    threading.Thread(target=compactar_periodicamente, daemon=True,
+                     name='compactacao').start()
+
+
 if __name__ == '__main__':
+    iniciar_compactacao()
     iniciar_consumidor()
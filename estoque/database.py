@@ -1,22 +1,56 @@
-import sqlite3
-from contextlib import contextmanager
+import threading
+
+from comum.banco import BancoSQLite
+from comum.idempotencia import Deduplicador
 
 DATABASE_PATH = 'estoque.db'
+banco = BancoSQLite(DATABASE_PATH)
+dedup = Deduplicador()
+
+# Cache das receitas em memória: (versao, {produto: {ingrediente: qtd}}).
+# A versão fica na tabela versoes e é incrementada por trigger a cada
+# alteração em receitas, então o consumer e a API (processos diferentes)
+# percebem as mudanças um do outro com uma leitura por chave primária.
+_cache_receitas = (None, {})
+_cache_lock = threading.Lock()
+
+# Agregados de um dia de movimentações por ingrediente, usados tanto para
+# compactar (compactar_movimentacoes) quanto para o histórico diário dos
+# dias ainda não compactados. Parâmetros: início e fim do intervalo.
+AGREGADO_DIARIO = '''
+    SELECT date(m.data_movimentacao) AS dia, m.ingrediente_nome,
+           COUNT(*) AS movimentacoes,
+           COUNT(DISTINCT m.pedido_id) AS pedidos,
+           SUM(CASE WHEN m.tipo = 'ENTRADA' THEN m.quantidade ELSE 0 END)
+               AS quantidade_entrada,
+           SUM(CASE WHEN m.tipo = 'SAIDA' THEN m.quantidade ELSE 0 END)
+               AS quantidade_saida,
+           SUM(CASE WHEN m.tipo NOT IN ('ENTRADA', 'SAIDA')
+                    THEN m.quantidade ELSE 0 END) AS quantidade_ajuste,
+           (SELECT p.quantidade_anterior FROM movimentacoes p
+            WHERE p.ingrediente_nome = m.ingrediente_nome
+              AND p.data_movimentacao >= date(m.data_movimentacao)
+              AND p.data_movimentacao < date(m.data_movimentacao, '+1 day')
+            ORDER BY p.data_movimentacao, p.id LIMIT 1) AS quantidade_inicial,
+           (SELECT p.quantidade_posterior FROM movimentacoes p
+            WHERE p.ingrediente_nome = m.ingrediente_nome
+              AND p.data_movimentacao >= date(m.data_movimentacao)
+              AND p.data_movimentacao < date(m.data_movimentacao, '+1 day')
+            ORDER BY p.data_movimentacao DESC, p.id DESC LIMIT 1)
+               AS quantidade_final
+    FROM movimentacoes m
+    WHERE m.data_movimentacao >= ? AND m.data_movimentacao < ?
+'''
+COLUNAS_DIARIAS = (
+    'dia, ingrediente_nome, movimentacoes, pedidos, quantidade_entrada, '
+    'quantidade_saida, quantidade_ajuste, quantidade_inicial, '
+    'quantidade_final'
+)
 
 
-@contextmanager
 def get_db_connection():
     """Context manager para conexão com o banco de dados."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    return banco.conexao()
 
 
 def init_db():
@@ -47,6 +81,30 @@ def init_db():
             )
         ''')
 
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_receitas_produto '
+            'ON receitas(produto)')
+
+        # Versão das receitas (invalida o cache em memória)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS versoes (
+                nome VARCHAR(50) PRIMARY KEY,
+                versao INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute(
+            "INSERT OR IGNORE INTO versoes (nome, versao) "
+            "VALUES ('receitas', 0)")
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_receitas_{evento.lower()}
+                AFTER {evento} ON receitas
+                BEGIN
+                    UPDATE versoes SET versao = versao + 1
+                    WHERE nome = 'receitas';
+                END
+            ''')
+
         # Tabela de histórico de movimentação
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS movimentacoes (
@@ -62,6 +120,32 @@ def init_db():
                 FOREIGN KEY (ingrediente_nome) REFERENCES ingredientes(nome)
             )
         ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_movimentacoes_ingrediente_data '
+            'ON movimentacoes(ingrediente_nome, data_movimentacao)')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_movimentacoes_data '
+            'ON movimentacoes(data_movimentacao)')
+
+        # Movimentações compactadas: um registro por ingrediente e dia (UTC,
+        # como data_movimentacao) para os dias além da retenção
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS movimentacoes_diarias (
+                dia DATE NOT NULL,
+                ingrediente_nome VARCHAR(100) NOT NULL,
+                movimentacoes INTEGER NOT NULL,
+                pedidos INTEGER NOT NULL,
+                quantidade_entrada INTEGER NOT NULL,
+                quantidade_saida INTEGER NOT NULL,
+                quantidade_ajuste INTEGER NOT NULL,
+                quantidade_inicial INTEGER,
+                quantidade_final INTEGER,
+                PRIMARY KEY (ingrediente_nome, dia)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_movimentacoes_diarias_dia '
+            'ON movimentacoes_diarias(dia)')
 
         # Verificar se já existem dados
         cursor.execute('SELECT COUNT(*) as count FROM ingredientes')
@@ -144,49 +228,98 @@ def init_db():
                 VALUES (?, ?, ?)
             ''', receitas_iniciais)
 
+        _carregar_receitas(cursor)
+        dedup.criar_tabela(cursor)
+
         print("[DB] Banco de dados do Estoque inicializado com sucesso!")
 
 
+def _versao_receitas(cursor):
+    cursor.execute("SELECT versao FROM versoes WHERE nome = 'receitas'")
+    return cursor.fetchone()['versao']
+
+
+def _carregar_receitas(cursor):
+    """Recarrega todas as receitas para o cache em memória."""
+    global _cache_receitas
+
+    versao = _versao_receitas(cursor)
+    cursor.execute('''
+        SELECT produto, ingrediente_nome, quantidade_necessaria
+        FROM receitas
+    ''')
+
+    receitas = {}
+    for row in cursor.fetchall():
+        receitas.setdefault(row['produto'], {})[row['ingrediente_nome']] = \
+            row['quantidade_necessaria']
+
+    _cache_receitas = (versao, receitas)
+    return receitas
+
+
+def invalidar_cache_receitas():
+    """Descarta o cache de receitas; a próxima consulta recarrega do banco."""
+    global _cache_receitas
+    _cache_receitas = (None, {})
+
+
+def _obter_receita(cursor, produto):
+    versao, receitas = _cache_receitas
+
+    if versao is None or versao != _versao_receitas(cursor):
+        with _cache_lock:
+            versao, receitas = _cache_receitas
+            if versao is None or versao != _versao_receitas(cursor):
+                receitas = _carregar_receitas(cursor)
+
+    return dict(receitas.get(produto, {}))
+
+
 def obter_receita(produto):
     """Retorna os ingredientes necessários para um produto."""
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT ingrediente_nome, quantidade_necessaria
-            FROM receitas
-            WHERE produto = ?
-        ''', (produto,))
+        return _obter_receita(conn.cursor(), produto)
 
-        return {row['ingrediente_nome']: row['quantidade_necessaria']
-                for row in cursor.fetchall()}
 
+def _quantidades_em_estoque(cursor, nomes):
+    """Retorna {nome: quantidade} dos ingredientes em uma única consulta."""
+    marcadores = ', '.join('?' * len(nomes))
+    cursor.execute(
+        f'SELECT nome, quantidade FROM ingredientes WHERE nome IN ({marcadores})',
+        tuple(nomes)
+    )
+    return {row['nome']: row['quantidade'] for row in cursor.fetchall()}
 
-def verificar_disponibilidade(produto):
-    """Verifica se há ingredientes suficientes para preparar um produto."""
-    receita = obter_receita(produto)
 
-    if not receita:
-        return False, f"Receita não encontrada para '{produto}'"
+def _ingredientes_faltando(receita, quantidades):
+    ingredientes_faltando = []
+
+    for ingrediente, qtd_necessaria in receita.items():
+        disponivel = quantidades.get(ingrediente)
 
+        if disponivel is None:
+            ingredientes_faltando.append(f"{ingrediente} (não cadastrado)")
+        elif disponivel < qtd_necessaria:
+            ingredientes_faltando.append(
+                f"{ingrediente} (disponível: {disponivel},"
+                f"  necessário: {qtd_necessaria})"
+            )
+
+    return ingredientes_faltando
+
+
+def verificar_disponibilidade(produto):
+    """Verifica se há ingredientes suficientes para preparar um produto."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        receita = _obter_receita(cursor, produto)
 
-        ingredientes_faltando = []
+        if not receita:
+            return False, f"Receita não encontrada para '{produto}'"
 
-        for ingrediente, qtd_necessaria in receita.items():
-            cursor.execute(
-                'SELECT quantidade FROM ingredientes WHERE nome = ?',
-                (ingrediente,)
-            )
-            result = cursor.fetchone()
-
-            if not result:
-                ingredientes_faltando.append(f"{ingrediente} (não cadastrado)")
-            elif result['quantidade'] < qtd_necessaria:
-                ingredientes_faltando.append(
-                    f"{ingrediente} (disponível: {result['quantidade']},"
-                    f"  necessário: {qtd_necessaria})"
-                )
+        ingredientes_faltando = _ingredientes_faltando(
+            receita, _quantidades_em_estoque(cursor, receita))
 
         if ingredientes_faltando:
             return False, f"Ingredientes insuficientes: {', '.join(ingredientes_faltando)}"
@@ -194,77 +327,255 @@ def verificar_disponibilidade(produto):
         return True, "Ingredientes disponíveis"
 
 
+def descrever_itens(itens):
+    """Resumo legível de {produto: quantidade}, ex. '2x X-Salada, 1x Coca-Cola'."""
+    return ', '.join(f"{qtd}x {produto}" for produto, qtd in itens.items())
+
+
+def _receita_do_pedido(cursor, itens):
+    """
+    Soma as receitas de todas as linhas do pedido.
+
+    `itens` é um dict {produto: quantidade}; retorna {ingrediente: total}.
+    """
+    necessario = {}
+
+    for produto, quantidade in itens.items():
+        if (not isinstance(quantidade, int) or isinstance(quantidade, bool)
+                or quantidade <= 0):
+            raise ValueError(
+                f"Quantidade inválida para '{produto}': {quantidade}")
+
+        receita = _obter_receita(cursor, produto)
+        if not receita:
+            raise ValueError(f"Receita não encontrada para '{produto}'")
+
+        for ingrediente, qtd_necessaria in receita.items():
+            necessario[ingrediente] = \
+                necessario.get(ingrediente, 0) + qtd_necessaria * quantidade
+
+    return necessario
+
+
+def _baixar_pedido(cursor, itens, pedido_id, chave=None):
+    """
+    Valida e baixa os ingredientes de todas as linhas de um pedido.
+
+    Deve rodar dentro de uma transação já aberta com BEGIN IMMEDIATE: a
+    leitura das quantidades e a baixa acontecem sob o mesmo lock de escrita.
+    As receitas das linhas são somadas por ingrediente e baixadas com um
+    único UPDATE condicional (quantidade >= necessária), aceito só se
+    atingir todos os ingredientes; caso contrário levanta ValueError e quem
+    chamou desfaz a transação. O pedido é baixado inteiro ou não é baixado.
+    Com `chave`, uma mensagem já baixada levanta MensagemDuplicada.
+    """
+    dedup.registrar(cursor, chave)
+
+    if not itens:
+        raise ValueError("Pedido sem itens")
+
+    receita = _receita_do_pedido(cursor, itens)
+
+    quantidades = _quantidades_em_estoque(cursor, receita)
+    ingredientes_faltando = _ingredientes_faltando(receita, quantidades)
+    if ingredientes_faltando:
+        raise ValueError(
+            f"Ingredientes insuficientes: {', '.join(ingredientes_faltando)}")
+
+    baixa = ', '.join(['(?, ?)'] * len(receita))
+    parametros = [valor for item in receita.items() for valor in item]
+
+    cursor.execute(f'''
+        WITH baixa(nome, quantidade) AS (VALUES {baixa})
+        UPDATE ingredientes
+        SET quantidade = quantidade - (
+                SELECT baixa.quantidade FROM baixa
+                WHERE baixa.nome = ingredientes.nome),
+            data_atualizacao = CURRENT_TIMESTAMP
+        WHERE nome IN (SELECT nome FROM baixa)
+          AND quantidade >= (
+                SELECT baixa.quantidade FROM baixa
+                WHERE baixa.nome = ingredientes.nome)
+    ''', parametros)
+
+    # rowcount não é confiável para UPDATE iniciado por WITH
+    cursor.execute('SELECT changes()')
+    if cursor.fetchone()[0] != len(receita):
+        raise ValueError(
+            f"Estoque alterado durante a baixa de '{descrever_itens(itens)}'")
+
+    if len(itens) == 1 and 1 in itens.values():
+        motivo = f"Baixa para produto: {next(iter(itens))}"
+    else:
+        motivo = f"Baixa para pedido: {descrever_itens(itens)}"
+
+    movimentacoes = []
+    linhas = []
+
+    for ingrediente, qtd_necessaria in receita.items():
+        qtd_anterior = quantidades[ingrediente]
+        qtd_posterior = qtd_anterior - qtd_necessaria
+
+        linhas.extend((ingrediente, qtd_necessaria, qtd_anterior,
+                       qtd_posterior, motivo, pedido_id))
+        movimentacoes.append({
+            'ingrediente': ingrediente,
+            'quantidade_baixada': qtd_necessaria,
+            'quantidade_restante': qtd_posterior
+        })
+
+    valores = ', '.join(["(?, 'SAIDA', ?, ?, ?, ?, ?)"] * len(receita))
+    cursor.execute(f'''
+        INSERT INTO movimentacoes
+        (ingrediente_nome, tipo, quantidade, quantidade_anterior,
+         quantidade_posterior, motivo, pedido_id)
+        VALUES {valores}
+    ''', linhas)
+
+    return movimentacoes
+
+
 def dar_baixa_ingredientes(produto, pedido_id=None):
     """Dá baixa nos ingredientes necessários para um produto."""
-    receita = obter_receita(produto)
+    return dar_baixa_pedido({produto: 1}, pedido_id)
 
-    if not receita:
-        raise ValueError(f"Receita não encontrada para '{produto}'")
 
-    # Verificar disponibilidade primeiro
-    disponivel, mensagem = verificar_disponibilidade(produto)
-    if not disponivel:
-        raise ValueError(mensagem)
+def dar_baixa_pedido(itens, pedido_id=None, chave=None):
+    """
+    Dá baixa nos ingredientes de um pedido com várias linhas.
 
+    `itens` é um dict {produto: quantidade}; todas as linhas são baixadas
+    na mesma transação.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        movimentacoes = _baixar_pedido(cursor, itens, pedido_id, chave)
 
-        movimentacoes = []
+    dedup.lembrar(chave)
+    return movimentacoes
 
-        for ingrediente, qtd_necessaria in receita.items():
-            # Buscar quantidade atual
-            cursor.execute(
-                'SELECT quantidade FROM ingredientes WHERE nome = ?',
-                (ingrediente,)
-            )
-            qtd_anterior = cursor.fetchone()['quantidade']
-            qtd_posterior = qtd_anterior - qtd_necessaria
 
-            # Atualizar estoque
-            cursor.execute('''
-                UPDATE ingredientes
-                SET quantidade = quantidade - ?,
-                    data_atualizacao = CURRENT_TIMESTAMP
-                WHERE nome = ?
-            ''', (qtd_necessaria, ingrediente))
+def dar_baixa_lote(pedidos):
+    """
+    Dá baixa em vários pedidos numa única transação.
 
-            # Registrar movimentação
-            cursor.execute('''
-                INSERT INTO movimentacoes
-                (ingrediente_nome, tipo, quantidade, quantidade_anterior,
-                 quantidade_posterior, motivo, pedido_id)
-                VALUES (?, 'SAIDA', ?, ?, ?, ?, ?)
-            ''', (ingrediente, qtd_necessaria, qtd_anterior, qtd_posterior,
-                  f"Baixa para produto: {produto}", pedido_id))
+    `pedidos` é uma lista de tuplas (itens, pedido_id, chave), com `itens`
+    no formato de dar_baixa_pedido. Cada pedido roda dentro de um SAVEPOINT:
+    se falhar, só as alterações dele são desfeitas e os demais seguem no
+    mesmo commit. Retorna, na mesma ordem, uma lista de tuplas
+    (movimentacoes, erro) em que apenas um dos dois é preenchido.
+    """
+    resultados = []
 
-            movimentacoes.append({
-                'ingrediente': ingrediente,
-                'quantidade_baixada': qtd_necessaria,
-                'quantidade_restante': qtd_posterior
-            })
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+
+        for itens, pedido_id, chave in pedidos:
+            cursor.execute('SAVEPOINT pedido')
+            try:
+                movimentacoes = _baixar_pedido(
+                    cursor, itens, pedido_id, chave)
+            except Exception as e:
+                cursor.execute('ROLLBACK TO pedido')
+                cursor.execute('RELEASE pedido')
+                resultados.append((None, e))
+            else:
+                cursor.execute('RELEASE pedido')
+                resultados.append((movimentacoes, None))
+
+    for (_, _, chave), (_, erro) in zip(pedidos, resultados):
+        if erro is None:
+            dedup.lembrar(chave)
+
+    return resultados
+
+
+def definir_receita(produto, ingredientes):
+    """
+    Substitui a receita de um produto.
+
+    `ingredientes` é um dict {ingrediente: quantidade_necessaria}.
+    """
+    if not ingredientes:
+        raise ValueError("A receita precisa de ao menos um ingrediente")
+
+    for ingrediente, quantidade in ingredientes.items():
+        if (not isinstance(quantidade, int) or isinstance(quantidade, bool)
+                or quantidade <= 0):
+            raise ValueError(
+                f"Quantidade inválida para '{ingrediente}': {quantidade}")
 
-        return movimentacoes
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cadastrados = _quantidades_em_estoque(cursor, ingredientes)
+        nao_cadastrados = [nome for nome in ingredientes
+                           if nome not in cadastrados]
+        if nao_cadastrados:
+            raise ValueError(
+                f"Ingredientes não cadastrados: {', '.join(nao_cadastrados)}")
+
+        cursor.execute('DELETE FROM receitas WHERE produto = ?', (produto,))
+        cursor.executemany('''
+            INSERT INTO receitas (
+                           produto, ingrediente_nome, quantidade_necessaria
+                           )
+            VALUES (?, ?, ?)
+        ''', [(produto, nome, qtd) for nome, qtd in ingredientes.items()])
+
+    invalidar_cache_receitas()
+
+    return {'produto': produto, 'receita': dict(ingredientes)}
+
+
+# Colunas de ingredientes com o status calculado (CRITICO, BAIXO ou OK)
+SELECT_INGREDIENTES = '''
+    SELECT
+        nome,
+        quantidade,
+        unidade,
+        estoque_minimo,
+        CASE
+            WHEN quantidade <= estoque_minimo THEN 'CRITICO'
+            WHEN quantidade <= estoque_minimo * 1.5 THEN 'BAIXO'
+            ELSE 'OK'
+        END as status,
+        data_atualizacao
+    FROM ingredientes
+'''
 
 
 def listar_estoque():
     """Lista todos os ingredientes do estoque."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT
-                nome,
-                quantidade,
-                unidade,
-                estoque_minimo,
-                CASE
-                    WHEN quantidade <= estoque_minimo THEN 'CRITICO'
-                    WHEN quantidade <= estoque_minimo * 1.5 THEN 'BAIXO'
-                    ELSE 'OK'
-                END as status,
-                data_atualizacao
-            FROM ingredientes
-            ORDER BY nome
-        ''')
+        cursor.execute(SELECT_INGREDIENTES + 'ORDER BY nome')
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def buscar_ingrediente(nome):
+    """Busca um ingrediente pelo nome (consulta pelo índice único)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SELECT_INGREDIENTES + 'WHERE nome = ?', (nome,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def buscar_ingredientes(nomes):
+    """Busca vários ingredientes pelo nome em uma única consulta."""
+    if not nomes:
+        return []
+
+    marcadores = ', '.join('?' * len(nomes))
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            SELECT_INGREDIENTES + f'WHERE nome IN ({marcadores}) ORDER BY nome',
+            tuple(nomes)
+        )
         return [dict(row) for row in cursor.fetchall()]
 
 
@@ -313,7 +624,12 @@ def adicionar_estoque(ingrediente_nome, quantidade, motivo="Reposição"):
 
 
 def historico_movimentacoes(ingrediente_nome=None, limit=100):
-    """Retorna o histórico de movimentações."""
+    """
+    Retorna as movimentações mais recentes.
+
+    Só as dos últimos dias ficam guardadas uma a uma; as mais antigas estão
+    agregadas por dia (ver historico_diario).
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
@@ -332,3 +648,114 @@ def historico_movimentacoes(ingrediente_nome=None, limit=100):
             ''', (limit,))
 
         return [dict(row) for row in cursor.fetchall()]
+
+
+def compactar_movimentacoes(dias_retencao=30):
+    """
+    Agrega por dia e ingrediente as movimentações mais antigas que
+    `dias_retencao` dias e apaga as linhas originais.
+
+    Cada dia é compactado numa transação própria, do mais antigo para o
+    mais novo, para não segurar o lock de escrita do consumer por muito
+    tempo. Só entram dias já encerrados (anteriores a hoje em UTC, o relógio
+    de data_movimentacao) e cada um é agregado e apagado na mesma transação,
+    então um dia nunca é agregado duas vezes: não há como somar pedidos
+    distintos de duas passadas. Retorna quantas movimentações foram
+    compactadas.
+    """
+    compactadas = 0
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT date(MIN(data_movimentacao)) AS dia,
+                       date(MIN(data_movimentacao), '+1 day') AS dia_seguinte,
+                       date('now', ?) AS limite
+                FROM movimentacoes
+            ''', (f'-{max(0, int(dias_retencao))} days',))
+            row = cursor.fetchone()
+            if row['dia'] is None or row['dia'] >= row['limite']:
+                break
+
+            intervalo = (row['dia'], row['dia_seguinte'])
+            cursor.execute(f'''
+                INSERT INTO movimentacoes_diarias ({COLUNAS_DIARIAS})
+                {AGREGADO_DIARIO}
+                GROUP BY m.ingrediente_nome
+            ''', intervalo)
+            cursor.execute(
+                'DELETE FROM movimentacoes '
+                'WHERE data_movimentacao >= ? AND data_movimentacao < ?',
+                intervalo)
+            compactadas += cursor.rowcount
+
+    return compactadas
+
+
+def _dias_do_historico(cursor, ingrediente_nome, limit):
+    """
+    Os `limit` dias mais recentes com movimentações ou agregados, do mais
+    novo para o mais antigo.
+
+    Os dias ainda em movimentacoes são achados pelo índice, um MAX por dia
+    andando para trás, sem ler as movimentações de cada dia.
+    """
+    filtro = 'AND ingrediente_nome = ?' if ingrediente_nome else ''
+    filtro_diario = 'WHERE ingrediente_nome = ?' if ingrediente_nome else ''
+    parametros = [ingrediente_nome] if ingrediente_nome else []
+
+    cursor.execute(f'''
+        SELECT DISTINCT dia FROM movimentacoes_diarias {filtro_diario}
+        ORDER BY dia DESC LIMIT ?
+    ''', (*parametros, limit))
+    dias = {row['dia'] for row in cursor.fetchall()}
+
+    antes = '9999-12-31'
+    for _ in range(limit):
+        cursor.execute(f'''
+            SELECT date(MAX(data_movimentacao)) AS dia FROM movimentacoes
+            WHERE data_movimentacao < ? {filtro}
+        ''', (antes, *parametros))
+        antes = cursor.fetchone()['dia']
+        if antes is None:
+            break
+        dias.add(antes)
+
+    return sorted(dias, reverse=True)[:limit]
+
+
+def historico_diario(ingrediente_nome=None, limit=30):
+    """
+    Retorna o histórico por dia e ingrediente, do dia mais recente para o
+    mais antigo.
+
+    Os dias compactados vêm de movimentacoes_diarias; os que ainda estão
+    na retenção são agregados na hora a partir de movimentacoes, no mesmo
+    formato. `limit` é o número de linhas (dia, ingrediente), que cabem em
+    no máximo `limit` dias: só as movimentações desses dias são agregadas.
+    """
+    filtro = 'AND m.ingrediente_nome = ?' if ingrediente_nome else ''
+    filtro_diario = 'AND ingrediente_nome = ?' if ingrediente_nome else ''
+    parametros = [ingrediente_nome] if ingrediente_nome else []
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        dias = _dias_do_historico(cursor, ingrediente_nome, limit)
+        if not dias:
+            return []
+
+        inicio = dias[-1]
+        cursor.execute(f'''
+            SELECT * FROM (
+                {AGREGADO_DIARIO} {filtro}
+                GROUP BY dia, m.ingrediente_nome
+            )
+            UNION ALL
+            SELECT {COLUNAS_DIARIAS} FROM movimentacoes_diarias
+            WHERE dia >= ? {filtro_diario}
+            ORDER BY dia DESC, ingrediente_nome
+            LIMIT ?
+        ''', (inicio, '9999-12-31', *parametros, inicio, *parametros,
+              limit))
+        return [dict(row) for row in cursor.fetchall()]